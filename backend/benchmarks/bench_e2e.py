@@ -0,0 +1,256 @@
+"""End-to-end benchmark suite: the FastAPI app against the local mock LLM.
+
+Builds a scratch knowledge base from the bundled 新闻传播学理论知识库 workbooks
+(the PDFs under testdata/ are added to it by the upload scenario), then drives
+the app in-process at each concurrency level and reports throughput and
+p50/p95/p99 latency per scenario:
+
+- chat:     POST /api/chat (use_kb, response cache off)
+- quiz:     POST /api/quiz/generate (use_kb, live generation)
+- grading:  POST /api/grading/batch with --essays synthetic essays per request
+- kb_upload: POST /api/kb/upload of a testdata PDF, timed until its ingest job is done
+- kb_list:  POST /api/kb/list
+
+Results are written as JSON (with the git commit, parameters and environment)
+so runs can be compared over time.
+
+    python -m benchmarks.bench_e2e --concurrency 1,8,32 --latency 0.5 --out e2e.json
+"""
+import argparse
+import asyncio
+import glob
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import HashingEmbeddingFunction, Timer, dump, summarize, synth_text
+from benchmarks.mock_llm import MockLLMServer
+
+SCENARIOS = ("chat", "quiz", "grading", "kb_upload", "kb_list")
+TESTDATA_DIR = "../testdata"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def build_scratch_kb(embedding: str, workers: int) -> dict:
+    """Index the bundled workbooks into the (scratch) CHROMA_DB_PATH the app was configured with."""
+    import ingest
+    from services.rag_service import rag_service
+
+    if embedding == "hashing":
+        rag_service.ef = HashingEmbeddingFunction()
+    files = sorted(f for f in os.listdir(ingest.DATA_DIR) if f.endswith(".xlsx"))
+    with Timer() as t:
+        rows, _ = ingest.parse_all(files, workers or min(len(files), os.cpu_count() or 1) or 1)
+        collection = rag_service.client.get_or_create_collection(name=rag_service.collection_name, embedding_function=rag_service.ef)
+        for i in range(0, len(rows), ingest.EMBED_BATCH_SIZE):
+            batch = rows[i:i + ingest.EMBED_BATCH_SIZE]
+            ids, documents, metadatas = map(list, zip(*batch))
+            collection.upsert(ids=ids, documents=documents, metadatas=metadatas)
+            if rag_service.lexical_index is not None:
+                rag_service.lexical_index.add(ids, documents, metadatas)
+        rag_service.collection = collection
+
+        totals = {}
+        for _, content, meta in rows:
+            chunks, size = totals.get(meta["source"], (0, 0))
+            totals[meta["source"]] = (chunks + 1, size + len(content.encode("utf-8")))
+        for source, (chunks, size) in totals.items():
+            rag_service.catalog.set_document(ingest.SYSTEM_OWNER, source, chunks, size)
+        # The catalog is complete: the first kb_list must not rebuild it from Chroma
+        rag_service.catalog.mark_initialized()
+    return {"workbooks": len(files), "chunks": collection.count(), "build_s": round(t.elapsed, 2), "embedding": embedding}
+
+
+class Scenarios:
+    """One coroutine per scenario; each call is one timed request."""
+
+    def __init__(self, client: httpx.AsyncClient, args, essays_dir: str, pdfs):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.essays_dir = essays_dir
+        self.pdfs = pdfs
+        self.counter = 0
+
+    def next_id(self) -> int:
+        self.counter += 1
+        return self.counter
+
+    async def chat(self):
+        query = f"请解释{synth_text(self.rng, 2)}"
+        resp = await self.client.post("/api/chat", json={"query": query, "role": "student", "use_kb": True})
+        resp.raise_for_status()
+
+    async def quiz(self):
+        query = f"出1道关于{synth_text(self.rng, 1)}的题"
+        resp = await self.client.post("/api/quiz/generate", json={"query": query, "role": "teacher", "use_kb": True})
+        resp.raise_for_status()
+
+    async def grading(self):
+        files = []
+        for i in range(self.args.essays):
+            with open(os.path.join(self.essays_dir, f"essay_{i}.txt"), "rb") as f:
+                files.append(("files", (f"essay_{i}.txt", f.read(), "text/plain")))
+        resp = await self.client.post("/api/grading/batch", files=files)
+        resp.raise_for_status()
+
+    async def kb_upload(self):
+        # A fresh owner per request, so identical re-uploads are never skipped
+        path = self.pdfs[self.next_id() % len(self.pdfs)]
+        with open(path, "rb") as f:
+            data = f.read()
+        resp = await self.client.post(
+            "/api/kb/upload",
+            files={"file": (os.path.basename(path), data, "application/pdf")},
+            data={"user_id": f"bench_{self.counter}"},
+        )
+        resp.raise_for_status()
+        job_id = resp.json()["job_id"]
+        while True:
+            job = (await self.client.get(f"/api/kb/jobs/{job_id}")).json()
+            if job["status"] == "done":
+                return
+            if job["status"] == "failed":
+                raise RuntimeError(job.get("error"))
+            await asyncio.sleep(0.05)
+
+    async def kb_list(self):
+        resp = await self.client.post("/api/kb/list", data={"role": "internal_test", "limit": 100})
+        resp.raise_for_status()
+
+
+async def run_level(call, concurrency: int, requests: int) -> dict:
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call()
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"{call.__name__} error: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        **summarize(latencies),
+    }
+
+
+async def run_all(args, essays_dir: str, pdfs) -> dict:
+    from main import app
+    from services.llm_usage import llm_usage
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    # Run the app's startup hooks (ingest workers) as uvicorn would
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=600) as client:
+            scenarios = Scenarios(client, args, essays_dir, pdfs)
+            for name in args.scenarios:
+                call = getattr(scenarios, name)
+                results[name] = []
+                # Untimed warmup (lazy loads, first Chroma query)
+                await run_level(call, 1, args.warmup)
+                for concurrency in args.concurrency:
+                    requests = concurrency * (args.grading_rounds if name in ("grading", "kb_upload") else args.rounds)
+                    level = await run_level(call, concurrency, requests)
+                    results[name].append(level)
+                    print(f"{name} c={concurrency}: {level['rps']} req/s, p95 {level['p95_ms']} ms")
+    results["llm_usage"] = llm_usage.stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--rounds", type=int, default=4, help="Requests per level = concurrency * rounds")
+    parser.add_argument("--grading-rounds", type=int, default=1, help="Rounds for the heavier grading / upload scenarios")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed requests per scenario before measuring")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--essays", type=int, default=10, help="Essays per grading batch request")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock LLM seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Mock LLM token rate (0 = all at once)")
+    parser.add_argument("--embedding", choices=("hashing", "model"), default="hashing",
+                        help="hashing: offline n-gram vectors; model: the configured embedding model")
+    parser.add_argument("--workers", type=int, default=None, help="Workbook parser processes")
+    parser.add_argument("--port", type=int, default=9103)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    scratch = tempfile.mkdtemp(prefix="bench_e2e_")
+    rng = random.Random(args.seed)
+    essays_dir = os.path.join(scratch, "essays")
+    os.makedirs(essays_dir)
+    for i in range(args.essays):
+        with open(os.path.join(essays_dir, f"essay_{i}.txt"), "w", encoding="utf-8") as f:
+            f.write("".join(synth_text(rng, 12) for _ in range(20)))
+    pdfs = sorted(glob.glob(os.path.join(TESTDATA_DIR, "**", "*.pdf"), recursive=True))
+    if "kb_upload" in args.scenarios and not pdfs:
+        parser.error(f"no PDFs found under {TESTDATA_DIR}")
+
+    try:
+        with MockLLMServer(port=args.port, latency=args.latency, tokens_per_second=args.tokens_per_second) as llm:
+            # Everything the app persists goes to the scratch directory; configure before importing it
+            os.environ.update({
+                "OPENAI_API_KEY": "mock",
+                "OPENAI_BASE_URL": llm.base_url,
+                "CHROMA_DB_PATH": os.path.join(scratch, "chroma_db"),
+                "INGEST_JOBS_DB": os.path.join(scratch, "ingest_jobs.sqlite3"),
+                "INGEST_SPOOL_DIR": os.path.join(scratch, "upload_spool"),
+                "GRADING_JOBS_DB": os.path.join(scratch, "grading_jobs.sqlite3"),
+                "EXPORT_CACHE_DIR": os.path.join(scratch, "export_cache"),
+                "RESPONSE_CACHE": "0",
+                "QUESTION_BANK": "0",
+                # No background warmup racing the timed requests; the untimed warmup requests do its work
+                "WARMUP": "0",
+            })
+            report = {
+                "benchmark": "e2e",
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "params": {k: v for k, v in vars(args).items() if k not in ("out", "keep")},
+            }
+            report["knowledge_base"] = build_scratch_kb(args.embedding, args.workers)
+            report.update(asyncio.run(run_all(args, essays_dir, pdfs)))
+    finally:
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    dump(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Embedding backends: retrieval overlap against the torch model, and throughput.
+
+Embeds a sample of chunks from the bundled workbooks (corpus) and the questions
+of their Q&A rows (queries) with the torch baseline and with each candidate
+backend, then reports:
+
+- overlap@k: share of the baseline's top-k chunks the candidate also returns,
+  both with everything re-embedded ("full") and with only the queries embedded
+  by the candidate against a torch-built index ("query_only", i.e. switching
+  backends without re-running ingest);
+- corpus throughput (chunks/s) and single-query latency percentiles.
+
+Candidates are `backend[:onnx_file]`, e.g. after export_embedding_onnx.py:
+
+    python -m benchmarks.bench_embedding_backends --model ./models/text2vec-onnx \\
+        --candidates onnx:onnx/model.onnx,onnx:onnx/model_qint8_avx2.onnx --threads 4
+"""
+import argparse
+import os
+import random
+
+import numpy as np
+
+import ingest
+from services.embedding_service import DEFAULT_MODEL, EmbeddingService
+from benchmarks.common import Timer, dump, summarize
+
+
+def load_sample(n_corpus: int, n_queries: int, seed: int):
+    files = sorted(f for f in os.listdir(ingest.DATA_DIR) if f.endswith(".xlsx"))
+    rows, _ = ingest.parse_all(files, min(len(files), os.cpu_count() or 1) or 1)
+    rng = random.Random(seed)
+    corpus = [content for _, content, _ in rng.sample(rows, min(n_corpus, len(rows)))]
+    questions = [
+        content.split("\n", 1)[0][len("问题："):] for _, content, _ in rows if content.startswith("问题：")
+    ]
+    queries = rng.sample(questions, min(n_queries, len(questions)))
+    return corpus, queries
+
+
+def top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def overlap(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean([len(set(x) & set(y)) / len(x) for x, y in zip(a, b)]))
+
+
+def normalize(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def run_backend(spec: str, args, corpus, queries) -> dict:
+    backend, _, onnx_file = spec.partition(":")
+    service = EmbeddingService(model_name=args.model, threads=args.threads, cache_size=0, backend=backend, onnx_file=onnx_file)
+    service.embed_documents(corpus[:8]) # load + warm up
+
+    with Timer() as t:
+        corpus_vectors = service.embed_documents(corpus, batch_size=args.batch_size)
+    latencies = []
+    for query in queries:
+        with Timer() as q:
+            service._encode([query])
+        latencies.append(q.elapsed)
+    query_vectors = service._encode(queries)
+
+    return {
+        "backend": service.stats()["backend"],
+        "corpus_chunks_per_s": round(len(corpus) / t.elapsed, 1),
+        "query_latency": summarize(latencies),
+        "corpus": normalize(corpus_vectors),
+        "queries": normalize(query_vectors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL))
+    parser.add_argument("--baseline", default="torch", help="Reference backend spec")
+    parser.add_argument("--candidates", default="onnx", help="Comma-separated backend[:onnx_file] specs")
+    parser.add_argument("--corpus", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    corpus, queries = load_sample(args.corpus, args.queries, args.seed)
+    report = {"benchmark": "embedding_backends", "model": args.model, "corpus": len(corpus),
+              "queries": len(queries), "k": args.k, "threads": args.threads}
+
+    baseline = run_backend(args.baseline, args, corpus, queries)
+    reference = top_k(baseline["queries"], baseline["corpus"], args.k)
+    report["baseline"] = {k: v for k, v in baseline.items() if k not in ("corpus", "queries")}
+
+    report["candidates"] = {}
+    for spec in [s for s in args.candidates.split(",") if s]:
+        result = run_backend(spec, args, corpus, queries)
+        full = top_k(result["queries"], result["corpus"], args.k)
+        query_only = top_k(result["queries"], baseline["corpus"], args.k)
+        report["candidates"][spec] = {
+            **{k: v for k, v in result.items() if k not in ("corpus", "queries")},
+            "overlap_at_k_full": round(overlap(reference, full), 4),
+            "overlap_at_k_query_only": round(overlap(reference, query_only), 4),
+            "speedup_corpus": round(result["corpus_chunks_per_s"] / baseline["corpus_chunks_per_s"], 2),
+        }
+
+    dump(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
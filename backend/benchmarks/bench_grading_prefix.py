@@ -0,0 +1,98 @@
+"""Prompt-prefix cache hit rate for a batch grading run.
+
+Grades synthetic essays against the mock LLM (which simulates a provider-side
+prefix cache) with the current message layout, where persona + rubric form a
+fixed system prefix, and with the legacy layout, where the rubric and essay
+were formatted into one template. Reports cached/prompt tokens per layout.
+
+    python -m benchmarks.bench_grading_prefix --essays 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+
+from benchmarks.common import dump, synth_text
+from benchmarks.mock_llm import MockLLMServer
+
+RUBRIC = {
+    "title": "新闻评论写作评分标准",
+    "items": [
+        {"criterion": "论点", "weight": 30, "description": "论点明确，立场清晰，" * 10},
+        {"criterion": "论据", "weight": 30, "description": "论据充分，引用准确，" * 10},
+        {"criterion": "结构", "weight": 20, "description": "层次分明，过渡自然，" * 10},
+        {"criterion": "表达", "weight": 20, "description": "语言规范，文风得体，" * 10},
+    ],
+}
+REPLY = json.dumps({"student_name": "Unknown", "total_score": 80, "feedback": "良好", "details": {"论点": 25}}, ensure_ascii=False)
+
+
+def legacy_factory(rubric: str):
+    """Pre-change layout: one system message per essay, rubric and essay formatted together."""
+    from routers.grading_agent import GRADING_PERSONA
+    head, _ = GRADING_PERSONA.split("要求：", 1)
+    return lambda content: [
+        {"role": "system", "content": f"{head}【学生作业】：\n{content}\n\n【评分标准】：\n{rubric}"},
+        {"role": "user", "content": "Grade this essay"},
+    ]
+
+
+async def run_batch(build_prompt, essays_dir: str, n: int):
+    from services.extraction import SpooledUpload
+    from services.grading_service import grading_engine
+    uploads = []
+    for i in range(n):
+        src = os.path.join(essays_dir, f"essay_{i}.txt")
+        path = os.path.join(essays_dir, f"run_{i}.txt")
+        with open(src, encoding="utf-8") as f, open(path, "w", encoding="utf-8") as out:
+            out.write(f.read())
+        uploads.append(SpooledUpload(f"essay_{i}.txt", path, os.path.getsize(path)))
+    await grading_engine.grade_batch(uploads, build_prompt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--essays", type=int, default=100)
+    parser.add_argument("--port", type=int, default=9102)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    essays_dir = tempfile.mkdtemp(prefix="bench_grading_")
+    for i in range(args.essays):
+        with open(os.path.join(essays_dir, f"essay_{i}.txt"), "w", encoding="utf-8") as f:
+            f.write("".join(synth_text(rng, 12) for _ in range(20)))
+
+    try:
+        run_layouts(args, essays_dir)
+    finally:
+        shutil.rmtree(essays_dir, ignore_errors=True)
+
+
+def run_layouts(args, essays_dir: str):
+    with MockLLMServer(port=args.port, latency=0.01, reply=REPLY) as llm:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = llm.base_url
+        from routers.grading_agent import build_prompt_factory
+        from services.llm_usage import llm_usage
+
+        rubric = json.dumps(RUBRIC, ensure_ascii=False)
+        report = {"benchmark": "grading_prefix_cache", "essays": args.essays}
+
+        async def run_all():
+            for name, factory in (("legacy", legacy_factory), ("prefix", build_prompt_factory)):
+                llm_usage.agents.clear()
+                await run_batch(factory(rubric), essays_dir, args.essays)
+                report[name] = llm_usage.stats()["agents"]["grading"]
+
+        asyncio.run(run_all())
+
+    dump(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Latency/quality benchmark for the cross-encoder rerank stage.
+
+Runs the labeled queries of eval_hybrid against the configured knowledge base
+(run ingest.py first), once without reranking and once per candidate-pool size,
+and reports hit rate, precision, chunks and context characters per query, and
+retrieve() latency with a cold and a warm pair-score cache.
+
+    python -m benchmarks.bench_rerank --k 3 --pools 10,20,40 --budget-ms 300
+
+`--scorer overlap` swaps the cross-encoder for a character-bigram overlap
+score, so the harness runs where sentence-transformers is not installed.
+"""
+import argparse
+import json
+
+from services.rag_service import rag_service
+from services.reranker import Reranker
+from services.lexical_index import tokenize
+from benchmarks.common import Timer, dump, summarize
+from benchmarks.eval_hybrid import EVAL_SET, score
+
+
+def overlap_scorer(pairs):
+    scores = []
+    for query, doc in pairs:
+        q = set(tokenize(query))
+        scores.append(len(q & set(tokenize(doc))) / (len(q) or 1))
+    return scores
+
+
+def run_pass(cases, k: int) -> dict:
+    latencies, hits, precision, chunks, chars = [], 0, 0.0, 0, 0
+    for case in cases:
+        with Timer() as t:
+            docs = rag_service.retrieve(case["query"], n_results=k, role="student")['documents'][0]
+        latencies.append(t.elapsed)
+        s = score(docs, case["terms"])
+        hits += s["hit"]
+        precision += s["precision"]
+        chunks += len(docs)
+        chars += sum(len(d) for d in docs)
+    n = len(cases)
+    return {
+        "hit_rate": round(hits / n, 3),
+        "precision": round(precision / n, 3),
+        "chunks_per_query": round(chunks / n, 2),
+        "context_chars_per_query": round(chars / n, 1),
+        "retrieve": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--pools", default="10,20,40")
+    parser.add_argument("--budget-ms", type=float, default=300)
+    parser.add_argument("--min-score", type=float, default=float("-inf"))
+    parser.add_argument("--scorer", choices=["model", "overlap"], default="model")
+    parser.add_argument("--eval-set", default=EVAL_SET)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    with open(args.eval_set, encoding="utf-8") as f:
+        cases = json.load(f)
+    if not rag_service.get_collection():
+        raise SystemExit("Knowledge base not found; run ingest.py first.")
+
+    rag_service.reranker = None
+    report = {
+        "benchmark": "rerank",
+        "k": args.k,
+        "queries": len(cases),
+        "scorer": args.scorer,
+        "budget_ms": args.budget_ms,
+        "baseline": run_pass(cases, args.k),
+        "pools": [],
+    }
+
+    for pool in [int(p) for p in args.pools.split(",")]:
+        reranker = Reranker(
+            pool=pool,
+            budget=args.budget_ms / 1000,
+            min_score=args.min_score,
+            score_fn=overlap_scorer if args.scorer == "overlap" else None,
+        )
+        if args.scorer == "model":
+            reranker.scores("warmup", ["warmup"]) # load the model outside the timed passes
+            reranker._cache.clear()
+        rag_service.reranker = reranker
+        cold = run_pass(cases, args.k)
+        warm = run_pass(cases, args.k)
+        report["pools"].append({"pool": pool, "cold": cold, "warm": warm, "rerank": reranker.stats()})
+    rag_service.reranker = None
+
+    dump(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Retrieval visibility benchmark.
+
+Seeds a scratch Chroma collection with system chunks plus many private owners,
+then compares the legacy "over-fetch n*3 and filter in Python" strategy with the
+in-index `where` predicate used by RAGService.retrieve.
+
+    python -m benchmarks.bench_retrieval --owners 10,100,500
+"""
+import argparse
+import random
+import shutil
+import tempfile
+
+from services.rag_service import RAGService, SYSTEM_OWNER
+from benchmarks.common import HashingEmbeddingFunction, Timer, dump, summarize, synth_text
+
+
+def legacy_retrieve(service: RAGService, query: str, n_results: int, user_id: str):
+    """The pre-filter implementation: over-fetch and drop foreign chunks in Python."""
+    results = service.get_collection().query(query_texts=[query], n_results=n_results * 3)
+    docs = []
+    for meta, doc in zip(results['metadatas'][0], results['documents'][0]):
+        owner = meta.get('owner_id')
+        if not owner or owner == SYSTEM_OWNER or owner == user_id:
+            docs.append(doc)
+    return docs[:n_results]
+
+
+def seed(service: RAGService, rng: random.Random, n_owners: int, chunks_per_owner: int, system_chunks: int):
+    collection = service.client.create_collection(name=service.collection_name, embedding_function=service.ef)
+    service.collection = collection
+
+    batch_docs, batch_metas, batch_ids = [], [], []
+
+    def flush():
+        if batch_ids:
+            collection.add(documents=batch_docs, metadatas=batch_metas, ids=batch_ids)
+            batch_docs.clear(); batch_metas.clear(); batch_ids.clear()
+
+    owners = [(SYSTEM_OWNER, system_chunks)] + [(f"teacher_{i}", chunks_per_owner) for i in range(n_owners)]
+    for owner, count in owners:
+        for i in range(count):
+            batch_docs.append(synth_text(rng))
+            batch_metas.append({"source": f"{owner}.pdf", "owner_id": owner})
+            batch_ids.append(f"{owner}_{i}")
+            if len(batch_ids) >= 1000:
+                flush()
+    flush()
+
+
+def run(n_owners: int, args) -> dict:
+    rng = random.Random(args.seed)
+    tmp_dir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    try:
+        service = RAGService(db_path=tmp_dir, collection_name="bench", embedding_function=HashingEmbeddingFunction())
+        seed(service, rng, n_owners, args.chunks_per_owner, args.system_chunks)
+
+        queries = [synth_text(rng, 3) for _ in range(args.queries)]
+        user_id = "student_0" # owns nothing: should only ever see system chunks
+
+        report = {"owners": n_owners, "total_chunks": service.get_collection().count()}
+        for name in ("legacy", "where"):
+            latencies, full = [], 0
+            for q in queries:
+                with Timer() as t:
+                    if name == "legacy":
+                        docs = legacy_retrieve(service, q, args.n_results, user_id)
+                    else:
+                        docs = service.retrieve(q, n_results=args.n_results, user_id=user_id, role="student")['documents'][0]
+                latencies.append(t.elapsed)
+                if len(docs) == args.n_results:
+                    full += 1
+            report[name] = {"recall_full": round(full / len(queries), 3), **summarize(latencies)}
+        return report
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owners", default="10,100,500", help="Comma separated owner counts to sweep")
+    parser.add_argument("--chunks-per-owner", type=int, default=100)
+    parser.add_argument("--system-chunks", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n-results", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="Write JSON results to this path")
+    args = parser.parse_args()
+
+    results = [run(int(n), args) for n in args.owners.split(",")]
+    dump({"benchmark": "retrieval_visibility", "results": results}, args.out)
+
+
+if __name__ == "__main__":
+    main()
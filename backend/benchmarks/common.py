@@ -0,0 +1,76 @@
+"""Shared helpers for the benchmark scripts.
+
+Run the scripts from the backend directory, e.g. `python -m benchmarks.bench_retrieval`.
+"""
+import hashlib
+import json
+import math
+import random
+import time
+
+from chromadb import Documents, EmbeddingFunction, Embeddings
+
+# Vocabulary used to synthesize chunks and queries (journalism theory terms)
+VOCAB = [
+    "议程设置", "框架理论", "使用与满足", "沉默的螺旋", "培养理论", "把关人", "两级传播",
+    "知沟理论", "媒介依赖", "涵化", "拟态环境", "舆论", "受众", "媒介素养", "新媒体",
+    "数据新闻", "可视化", "算法推荐", "信息茧房", "公共领域", "传播效果", "符号互动",
+    "麦库姆斯", "李普曼", "拉扎斯菲尔德", "诺依曼", "格伯纳", "麦克卢汉", "香农", "施拉姆",
+]
+
+
+class HashingEmbeddingFunction(EmbeddingFunction):
+    """Cheap, deterministic character n-gram embedding so benchmarks run offline."""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def __call__(self, input: Documents) -> Embeddings:
+        vectors = []
+        for text in input:
+            vec = [0.0] * self.dim
+            for i in range(len(text) - 1):
+                h = int(hashlib.md5(text[i:i + 2].encode("utf-8")).hexdigest()[:8], 16)
+                vec[h % self.dim] += 1.0
+            norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+            vectors.append([v / norm for v in vec])
+        return vectors
+
+
+def synth_text(rng: random.Random, n_terms: int = 6) -> str:
+    return "，".join(rng.choice(VOCAB) for _ in range(n_terms)) + "。"
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(math.ceil(pct / 100.0 * len(ordered))) - 1))
+    return ordered[k]
+
+
+def summarize(latencies_s) -> dict:
+    ms = [v * 1000 for v in latencies_s]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def dump(result: dict, path: str = None):
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
@@ -0,0 +1,69 @@
+"""Recall eval for hybrid (BM25 + dense, RRF) retrieval vs dense-only.
+
+Uses the configured knowledge base (run ingest.py first) and a small labeled
+set: a hit is relevant when it contains one of the query's key terms
+(theory or author names the workbooks contain verbatim).
+
+    python -m benchmarks.eval_hybrid --k 3
+"""
+import argparse
+import json
+import os
+
+from services.rag_service import rag_service
+from benchmarks.common import Timer, dump, summarize
+
+EVAL_SET = os.path.join(os.path.dirname(__file__), "data", "hybrid_eval.json")
+
+
+def score(documents, terms):
+    relevant = [any(t in doc for t in terms) for doc in documents]
+    return {"hit": any(relevant), "precision": sum(relevant) / len(documents) if documents else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--eval-set", default=EVAL_SET)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    if not rag_service.lexical_index:
+        raise SystemExit("HYBRID_SEARCH is disabled; nothing to compare.")
+
+    with open(args.eval_set, encoding="utf-8") as f:
+        cases = json.load(f)
+    collection = rag_service.get_collection()
+    where = rag_service.build_visibility_filter(role="student")
+
+    totals = {"dense": {"hit": 0, "precision": 0.0}, "hybrid": {"hit": 0, "precision": 0.0}}
+    lexical_latency, per_query = [], []
+    for case in cases:
+        dense = collection.query(query_texts=[case["query"]], n_results=args.k, where=where)['documents'][0]
+        hybrid = rag_service.retrieve(case["query"], n_results=args.k, role="student")['documents'][0]
+        with Timer() as t:
+            rag_service.lexical_index.search(case["query"], args.k * rag_service.hybrid_pool_factor, ["system"])
+        lexical_latency.append(t.elapsed)
+
+        row = {"query": case["query"]}
+        for name, docs in (("dense", dense), ("hybrid", hybrid)):
+            s = score(docs, case["terms"])
+            totals[name]["hit"] += s["hit"]
+            totals[name]["precision"] += s["precision"]
+            row[name] = s
+        per_query.append(row)
+
+    n = len(cases)
+    dump({
+        "benchmark": "hybrid_recall",
+        "k": args.k,
+        "queries": n,
+        "dense": {"hit_rate": round(totals["dense"]["hit"] / n, 3), "precision": round(totals["dense"]["precision"] / n, 3)},
+        "hybrid": {"hit_rate": round(totals["hybrid"]["hit"] / n, 3), "precision": round(totals["hybrid"]["precision"] / n, 3)},
+        "lexical_search": summarize(lexical_latency),
+        "per_query": per_query,
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
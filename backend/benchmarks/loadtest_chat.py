@@ -0,0 +1,64 @@
+"""Concurrency load test for /api/chat against the local mock LLM.
+
+Fires N concurrent chats (use_kb=False) at the FastAPI app in-process and
+compares the blocking client path with the async RAGService API.
+
+    python -m benchmarks.loadtest_chat --concurrency 100 --latency 2.0
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from benchmarks.common import dump, summarize
+from benchmarks.mock_llm import MockLLMServer
+
+
+async def fire(app, concurrency: int) -> dict:
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=600) as client:
+        async def one(i):
+            start = time.perf_counter()
+            resp = await client.post("/api/chat", json={"query": f"什么是议程设置理论 {i}", "use_kb": False})
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    return {"concurrency": concurrency, "wall_s": round(wall, 3), "rps": round(concurrency / wall, 2), **summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    with MockLLMServer(port=args.port, latency=args.latency) as llm:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = llm.base_url
+
+        from main import app
+        from services.rag_service import rag_service
+
+        results = {"benchmark": "chat_concurrency", "llm_latency_s": args.latency}
+        results["async"] = asyncio.run(fire(app, args.concurrency))
+
+        # Baseline: the old behaviour, a blocking client call inside the async handler
+        async def blocking_generate(query, context, history, system_prompt, **cache_kwargs):
+            return rag_service.generate_answer(query, context, history, system_prompt)
+        rag_service.agenerate_answer = blocking_generate
+        results["blocking"] = asyncio.run(fire(app, args.concurrency))
+
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
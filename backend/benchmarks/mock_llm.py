@@ -0,0 +1,159 @@
+"""Local OpenAI-compatible mock LLM server.
+
+Serves `/v1/chat/completions` (plain and `stream=True`) with a configurable
+time-to-first-token and token rate, so benchmarks never hit the real provider.
+Usage includes DeepSeek/OpenAI-style cached-prefix fields: one character is one
+token and prompt prefixes are cached in 64-token blocks, like the real providers.
+Without a fixed `reply`, the answer matches the agent (chat text, quiz /
+question-bank / grading JSON), picked from the prompt.
+
+    python -m benchmarks.mock_llm --port 9100 --latency 2.0 --tokens-per-second 50
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+CACHE_BLOCK = 64
+DEFAULT_REPLY = "议程设置理论认为大众传媒通过选择性报道影响公众对议题重要性的判断。"
+QUESTION = {
+    "id": 1, "type": "single_choice", "stem": "议程设置理论最早由谁提出？",
+    "options": ["麦库姆斯和肖", "李普曼", "拉扎斯菲尔德", "诺依曼"],
+    "answer": "A", "analysis": "1972 年麦库姆斯和肖在教堂山研究中提出。", "difficulty": "medium",
+}
+QUIZ_REPLY = json.dumps({"questions": [QUESTION]}, ensure_ascii=False)
+BANK_REPLY = json.dumps({"topic": "议程设置理论", "questions": [QUESTION]}, ensure_ascii=False)
+GRADING_REPLY = json.dumps(
+    {"student_name": "Unknown", "total_score": 82, "feedback": "论点明确，论据略显单薄。", "details": {"论点": 26, "论据": 22}},
+    ensure_ascii=False,
+)
+
+
+def agent_reply(messages) -> str:
+    """Reply shaped like what the calling agent parses."""
+    system = next((str(m.get("content", "")) for m in messages if m.get("role") == "system"), "")
+    if '"topic"' in system:
+        return BANK_REPLY
+    if '"questions"' in system:
+        return QUIZ_REPLY
+    if '"total_score"' in system:
+        return GRADING_REPLY
+    return DEFAULT_REPLY
+
+
+def create_app(latency: float = 1.0, tokens_per_second: float = 0.0, reply: str = None) -> FastAPI:
+    app = FastAPI()
+    app.state.calls = 0
+    prefix_cache = set()
+
+    def cached_prefix(messages) -> int:
+        prompt = "".join(f"{m.get('role')}\n{m.get('content', '')}\n" for m in messages)
+        digest, hit = hashlib.sha1(), 0
+        for end in range(CACHE_BLOCK, len(prompt) + 1, CACHE_BLOCK):
+            digest.update(prompt[end - CACHE_BLOCK:end].encode("utf-8"))
+            key = digest.hexdigest()
+            if key in prefix_cache and hit == end - CACHE_BLOCK:
+                hit = end
+            prefix_cache.add(key)
+        return hit
+
+    def make_usage(messages, text):
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages)
+        hit = min(cached_prefix(messages), prompt_tokens)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(text),
+            "total_tokens": prompt_tokens + len(text),
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt_tokens - hit,
+            "prompt_tokens_details": {"cached_tokens": hit},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        messages = body.get("messages", [])
+        text = reply if reply is not None else agent_reply(messages)
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        token_delay = 1.0 / tokens_per_second if tokens_per_second else 0.0
+
+        if body.get("stream"):
+            async def event_stream():
+                await asyncio.sleep(latency)
+                for ch in text:
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                        "model": body.get("model"),
+                        "choices": [{"index": 0, "delta": {"content": ch}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    if token_delay:
+                        await asyncio.sleep(token_delay)
+                final = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "usage": make_usage(messages, text),
+                }
+                yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency + token_delay * len(text))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": make_usage(messages, text),
+        }
+
+    return app
+
+
+class MockLLMServer:
+    """Runs the mock app in a background thread (context manager)."""
+
+    def __init__(self, port: int = 9100, **app_kwargs):
+        self.port = port
+        self.app = create_app(**app_kwargs)
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 = emit all tokens at once")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency, args.tokens_per_second), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Offline job: pre-generate validated quiz questions for the question bank.
+
+Walks the bundled (system) chunks of the knowledge base, asks the LLM for a
+short topic label plus a few questions per chunk, validates them against the
+QuizQuestion schema and stores them in services/question_bank.py, indexed by
+the topic label's embedding and the question difficulty. Chunks whose content
+hash is already in the bank are skipped, so re-runs only cover new/changed rows.
+
+    python build_question_bank.py --per-chunk 3 --concurrency 8
+"""
+import os
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from models.schemas import QuestionBankEntry
+from services.rag_service import rag_service, SYSTEM_OWNER
+from services.structured_output import structured_output, StructuredOutputError
+from services.question_bank import question_bank
+
+PAGE_SIZE = 500
+
+BANK_PERSONA = """你是一个新闻传播学领域的专业出题专家，正在为题库批量出题。
+要求：
+1. 只根据用户给出的【知识片段】出题，内容必须严谨准确。
+2. 先用不超过 12 个字概括该片段的主题（如“议程设置理论”），作为 topic。
+3. 题目难度需覆盖 easy、medium、hard，题型为单项选择题。
+4. JSON 结构必须如下：
+{
+  "topic": "主题",
+  "questions": [
+    {
+      "id": 1,
+      "type": "single_choice",
+      "stem": "题干内容",
+      "options": ["选项A", "选项B", "选项C", "选项D"],
+      "answer": "A",
+      "analysis": "答案解析",
+      "difficulty": "medium"
+    }
+  ]
+}
+5. **只返回 JSON 字符串**，不要包含 markdown 格式标记。
+"""
+
+
+def iter_system_chunks(collection, limit: int = None):
+    """Yields (id, text, metadata) for the bundled chunks, paging through Chroma."""
+    offset, seen = 0, 0
+    while True:
+        page = collection.get(
+            where={"owner_id": SYSTEM_OWNER},
+            include=["documents", "metadatas"],
+            limit=PAGE_SIZE,
+            offset=offset,
+        )
+        if not page["ids"]:
+            return
+        for chunk_id, text, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+            if limit is not None and seen >= limit:
+                return
+            seen += 1
+            yield chunk_id, text, meta or {}
+        offset += len(page["ids"])
+
+
+async def build_chunk(chunk_id: str, text: str, meta: dict, per_chunk: int, semaphore: asyncio.Semaphore) -> int:
+    messages = [
+        {"role": "system", "content": BANK_PERSONA},
+        {"role": "user", "content": f"请出 {per_chunk} 道题。\n\n【知识片段】：\n{text}"},
+    ]
+    async with semaphore:
+        entry, _ = await structured_output.generate(messages, QuestionBankEntry.model_validate, agent="question_bank")
+    topic = entry.topic.strip()
+    embedding = await rag_service.aembed_query(topic)
+    return await rag_service.run_blocking(
+        question_bank.add, topic, embedding, entry.questions[:per_chunk],
+        chunk_id, meta.get("content_hash"), meta.get("source"),
+    )
+
+
+async def build_question_bank(per_chunk: int = 3, limit: int = None, concurrency: int = 8, rebuild: bool = False):
+    start = time.perf_counter()
+    collection = rag_service.get_collection()
+    if collection is None:
+        raise SystemExit("Knowledge base collection not found; run ingest.py first.")
+    if rebuild:
+        question_bank.clear()
+
+    pending = [
+        (chunk_id, text, meta) for chunk_id, text, meta in iter_system_chunks(collection, limit)
+        if text and not question_bank.has_chunk(chunk_id, meta.get("content_hash"))
+    ]
+    print(f"{len(pending)} chunks to process.")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(
+        *(build_chunk(chunk_id, text, meta, per_chunk, semaphore) for chunk_id, text, meta in pending),
+        return_exceptions=True,
+    )
+    added = sum(r for r in results if isinstance(r, int))
+    failed = [(p[0], r) for p, r in zip(pending, results) if isinstance(r, Exception)]
+    for chunk_id, error in failed[:10]:
+        kind = "invalid output" if isinstance(error, StructuredOutputError) else "error"
+        print(f"Chunk {chunk_id} {kind}: {error}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Question bank build complete in {elapsed:.1f}s: {added} questions from "
+          f"{len(pending) - len(failed)} chunks, {len(failed)} chunks failed.")
+    return {"questions": added, "chunks": len(pending) - len(failed), "failed": len(failed), **question_bank.stats()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate quiz questions from the bundled knowledge base.")
+    parser.add_argument("--per-chunk", type=int, default=3, help="Questions to generate per chunk")
+    parser.add_argument("--limit", type=int, default=None, help="Only process the first N chunks")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent LLM calls")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the bank (incl. served history) before building")
+    args = parser.parse_args()
+    asyncio.run(build_question_bank(args.per_chunk, args.limit, args.concurrency, args.rebuild))
@@ -0,0 +1,67 @@
+"""Embedding sidecar: one process holds the embedding model for every server worker.
+
+The API workers are started with EMBEDDING_SERVER_URL pointing here (see
+start.sh) and send their forward passes to POST /embed instead of loading the
+model themselves. Single texts go through the shared micro-batcher, so
+concurrent queries from different workers are still encoded together.
+
+    python embedding_server.py --port 8002
+"""
+import os
+import time
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI
+from pydantic import BaseModel
+from dotenv import load_dotenv
+
+load_dotenv()
+# This process is the model host: never forward to itself
+os.environ.pop("EMBEDDING_SERVER_URL", None)
+
+from services.embedding_service import embedding_service
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model before accepting requests: /health answering means ready
+    start = time.perf_counter()
+    await asyncio.to_thread(embedding_service.embed_documents, ["预热"])
+    print(f"Embedding model {embedding_service.model_name} loaded in {time.perf_counter() - start:.1f}s")
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.post("/embed")
+def embed(request: EmbedRequest):
+    if len(request.texts) == 1:
+        return {"embeddings": [embedding_service.embed_query(request.texts[0])]}
+    return {"embeddings": embedding_service.embed_documents(request.texts)}
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+def stats():
+    return embedding_service.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the embedding model to the API workers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("EMBEDDING_SERVER_PORT", "8002")))
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
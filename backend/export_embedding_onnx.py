@@ -0,0 +1,48 @@
+"""Export the embedding model to ONNX, plus an int8 dynamically quantized copy.
+
+Writes a self-contained model directory that the ONNX backend can load:
+
+    python export_embedding_onnx.py --out ./models/text2vec-onnx --quantize avx2
+
+then run the server / ingest with
+
+    EMBEDDING_MODEL=./models/text2vec-onnx EMBEDDING_BACKEND=onnx \\
+    EMBEDDING_ONNX_FILE=onnx/model_qint8_avx2.onnx EMBEDDING_THREADS=4
+
+Check retrieval overlap and speed against the torch model first with
+`python -m benchmarks.bench_embedding_backends`. Requires
+`pip install sentence-transformers[onnx]`.
+"""
+import os
+import argparse
+
+from services.embedding_service import DEFAULT_MODEL
+
+QUANTIZE_CONFIGS = ("arm64", "avx2", "avx512", "avx512_vnni")
+
+
+def export(model_name: str, out_dir: str, quantize: str = None) -> dict:
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    # Loading with backend="onnx" exports the weights when the repo has no ONNX file
+    model = SentenceTransformer(model_name, backend="onnx", model_kwargs={"provider": "CPUExecutionProvider"})
+    model.save_pretrained(out_dir)
+    files = {"onnx": "onnx/model.onnx"}
+    if quantize:
+        export_dynamic_quantized_onnx_model(model, quantize, out_dir)
+        files["int8"] = f"onnx/model_qint8_{quantize}.onnx"
+    for name, path in files.items():
+        size = os.path.getsize(os.path.join(out_dir, path)) / 1e6
+        print(f"{name}: {os.path.join(out_dir, path)} ({size:.0f} MB)")
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the embedding model for the ONNX Runtime backend.")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL))
+    parser.add_argument("--out", required=True, help="Output model directory")
+    parser.add_argument("--quantize", choices=QUANTIZE_CONFIGS, default="avx2",
+                        help="Target CPU for the int8 copy (avx512_vnni on recent Xeons)")
+    parser.add_argument("--no-quantize", action="store_true", help="Only export the fp32 ONNX model")
+    args = parser.parse_args()
+    export(args.model, args.out, None if args.no_quantize else args.quantize)
@@ -1,100 +1,218 @@
 import os
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import chromadb
-from chromadb.utils import embedding_functions
+from services.embedding_service import embedding_service
+from services.lexical_index import LexicalIndex
+from services.chunker import Chunker, count_tokens
+from services.doc_catalog import DocumentCatalog
 
 # Configuration
 DATA_DIR = "../新闻传播学理论知识库"
-DB_PATH = "./chroma_db"
+DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
 COLLECTION_NAME = "journalism_knowledge"
+SYSTEM_OWNER = "system"
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH", "512"))
+
+def content_hash(content: str) -> str:
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def clean_column(series: pd.Series) -> pd.Series:
+    """str() + strip every cell; 'nan'/empty become ''."""
+    text = series.map(str).str.strip()
+    return text.where(text != 'nan', '')
+
+def join_lines(left: pd.Series, right: pd.Series) -> pd.Series:
+    sep = pd.Series(np.where((left != '') & (right != ''), '\n', ''), index=left.index)
+    return left + sep + right
+
+def extract_rows(df: pd.DataFrame, filename: str):
+    """Extract (id, content, metadata) rows from one sheet, column-wise."""
+    if df.empty:
+        return []
+    content = pd.Series('', index=df.index, dtype=object)
+    doc_type = pd.Series('', index=df.index, dtype=object)
+
+    # Type 1: Q&A Style
+    if '问题' in df.columns and '答案' in df.columns:
+        q = clean_column(df['问题'])
+        a = clean_column(df['答案'])
+        mask = (q != '') & (a != '')
+        content[mask] = '问题：' + q[mask] + '\n答案：' + a[mask]
+        doc_type[mask] = 'qa'
+
+    # Type 2: Theory Style (Content Reference)
+    elif '原文内容引用' in df.columns:
+        text = clean_column(df['原文内容引用'])
+        mask = text != ''
+        content[mask] = text[mask]
+        doc_type[mask] = 'theory'
+
+    # Fallback: join every column with a long enough value (heuristic: > 10 chars)
+    # e.g. "传播学教程 智能体.xlsx" might have different structure
+    fallback = content == ''
+    if fallback.any():
+        sub = df[fallback]
+        parts = pd.Series('', index=sub.index, dtype=object)
+        for col in df.columns:
+            val = clean_column(sub[col])
+            piece = (f"{col}: " + val).where(val.str.len() > 10, '')
+            parts = join_lines(parts, piece)
+        content[fallback] = parts
+        doc_type[fallback & (content != '')] = 'general'
+
+    keep = content != ''
+    rows = []
+    for index, text, kind in zip(df.index[keep].tolist(), content[keep].tolist(), doc_type[keep].tolist()):
+        meta = {"source": filename, "row": index, "owner_id": SYSTEM_OWNER, "type": kind, "content_hash": content_hash(text)}
+        rows.append((f"{filename}_{index}", text, meta))
+    return rows
+
+def split_long_rows(rows, row_chunker: Chunker):
+    """Run rows longer than the chunk budget through the chunker.
+
+    The first chunk keeps the row id; later ones get a `#n` suffix.
+    """
+    out = []
+    for doc_id, content, meta in rows:
+        if count_tokens(content) <= row_chunker.max_tokens:
+            out.append((doc_id, content, meta))
+            continue
+        for n, chunk in enumerate(row_chunker.iter_chunks(content)):
+            chunk_meta = dict(meta, chunk=n, content_hash=content_hash(chunk))
+            out.append((doc_id if n == 0 else f"{doc_id}#{n}", chunk, chunk_meta))
+    return out
+
+def parse_workbook(file_path: str, filename: str):
+    """Parse one workbook. Runs in a worker process.
+
+    Every column is read: the fallback branch may need any of them.
+    """
+    return split_long_rows(extract_rows(pd.read_excel(file_path), filename), Chunker(dedup_distance=-1))
+
+def parse_all(files, workers: int):
+    """Parse workbooks in parallel. Returns (rows, failed_filenames)."""
+    rows = []
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            filename: pool.submit(parse_workbook, os.path.join(DATA_DIR, filename), filename)
+            for filename in files
+        }
+        for filename, future in futures.items():
+            try:
+                file_rows = future.result()
+                print(f"Processed {filename}: {len(file_rows)} rows")
+                rows.extend(file_rows)
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+                failed.add(filename)
+    return rows, failed
+
+def upsert_rows(collection, rows):
+    for i in range(0, len(rows), EMBED_BATCH_SIZE):
+        batch = rows[i:i + EMBED_BATCH_SIZE]
+        print(f"Upserting batch {i} to {i + len(batch)}...")
+        documents = [content for _, content, _ in batch]
+        collection.upsert(
+            ids=[doc_id for doc_id, _, _ in batch],
+            documents=documents,
+            embeddings=embedding_service.embed_documents(documents, batch_size=EMBED_BATCH_SIZE),
+            metadatas=[meta for _, _, meta in batch]
+        )
+
+def ingest_data(rebuild: bool = False, workers: int = None):
+    start = time.perf_counter()
 
-def ingest_data():
     # Initialize ChromaDB
     client = chromadb.PersistentClient(path=DB_PATH)
-    
-    # Delete collection if exists to start fresh (optional, good for dev)
-    try:
-        client.delete_collection(name=COLLECTION_NAME)
-        print(f"Deleted existing collection: {COLLECTION_NAME}")
-    except Exception:
-        pass
-
-    # Create collection
+
+    # Full rebuild wipes the whole collection, including user uploads
+    if rebuild:
+        try:
+            client.delete_collection(name=COLLECTION_NAME)
+            print(f"Deleted existing collection: {COLLECTION_NAME}")
+        except Exception:
+            pass
+
     # Use a better Chinese embedding model
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="shibing624/text2vec-base-chinese")
-    collection = client.create_collection(name=COLLECTION_NAME, embedding_function=ef)
-
-    documents = []
-    metadatas = []
-    ids = []
-    
-    files = [f for f in os.listdir(DATA_DIR) if f.endswith('.xlsx')]
+    ef = embedding_service.as_chroma_function()
+    collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=ef)
+    lexical_index = LexicalIndex(os.path.join(DB_PATH, "lexical_index.sqlite3"))
+    catalog = DocumentCatalog(os.path.join(DB_PATH, "doc_catalog.sqlite3"))
+    if rebuild:
+        lexical_index.clear()
+        catalog.clear()
+
+    files = sorted(f for f in os.listdir(DATA_DIR) if f.endswith('.xlsx'))
     print(f"Found {len(files)} Excel files.")
+    rows, failed = parse_all(files, workers or min(len(files), os.cpu_count() or 1) or 1)
 
-    for filename in files:
-        file_path = os.path.join(DATA_DIR, filename)
-        print(f"Processing {filename}...")
-        
-        try:
-            df = pd.read_excel(file_path)
-            
-            # Determine file type and extract content
-            for index, row in df.iterrows():
-                content = ""
-                meta = {"source": filename, "row": index}
-                
-                # Type 1: Q&A Style
-                if '问题' in df.columns and '答案' in df.columns:
-                    q = str(row.get('问题', '')).strip()
-                    a = str(row.get('答案', '')).strip()
-                    if q and a and q != 'nan' and a != 'nan':
-                        content = f"问题：{q}\n答案：{a}"
-                        meta['type'] = 'qa'
-                
-                # Type 2: Theory Style (Content Reference)
-                elif '原文内容引用' in df.columns:
-                    text = str(row.get('原文内容引用', '')).strip()
-                    if text and text != 'nan':
-                        content = text
-                        meta['type'] = 'theory'
-                
-                # Fallback: specific column names observed in file list
-                # e.g. "传播学教程 智能体.xlsx" might have different structure
-                # We can try to concat all text columns if specific ones aren't found
-                if not content:
-                    # Naive fallback: join all string columns
-                    parts = []
-                    for col in df.columns:
-                        val = str(row[col]).strip()
-                        if val and val != 'nan' and len(val) > 10: # heuristic
-                            parts.append(f"{col}: {val}")
-                    if parts:
-                        content = "\n".join(parts)
-                        meta['type'] = 'general'
-
-                if content:
-                    documents.append(content)
-                    metadatas.append(meta)
-                    ids.append(f"{filename}_{index}")
-
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
-
-    # Add to ChromaDB in batches
-    batch_size = 100 # Small batch size to be safe
-    total_docs = len(documents)
-    print(f"Total documents to ingest: {total_docs}")
-
-    for i in range(0, total_docs, batch_size):
-        end = min(i + batch_size, total_docs)
-        print(f"Upserting batch {i} to {end}...")
-        collection.add(
-            documents=documents[i:end],
-            metadatas=metadatas[i:end],
-            ids=ids[i:end]
-        )
+    # Compare against the hashes already stored for bundled (system) rows
+    existing = collection.get(where={"owner_id": SYSTEM_OWNER}, include=["metadatas"])
+    existing_hashes = {
+        doc_id: (meta or {}).get("content_hash")
+        for doc_id, meta in zip(existing["ids"], existing["metadatas"])
+    }
+    existing_sources = {
+        doc_id: (meta or {}).get("source")
+        for doc_id, meta in zip(existing["ids"], existing["metadatas"])
+    }
+
+    added, updated, skipped = [], [], 0
+    for row in rows:
+        doc_id, _, meta = row
+        if doc_id not in existing_hashes:
+            added.append(row)
+        elif existing_hashes[doc_id] != meta["content_hash"]:
+            updated.append(row)
+        else:
+            skipped += 1
+
+    # Rows that vanished from their workbook (keep rows of workbooks that failed to parse)
+    seen = {doc_id for doc_id, _, _ in rows}
+    removed = [
+        doc_id for doc_id in existing_hashes
+        if doc_id not in seen and existing_sources[doc_id] not in failed
+    ]
+
+    print(f"Total documents parsed: {len(rows)}")
+    upsert_rows(collection, added + updated)
+    if removed:
+        for i in range(0, len(removed), EMBED_BATCH_SIZE):
+            collection.delete(ids=removed[i:i + EMBED_BATCH_SIZE])
+        lexical_index.delete(removed)
+
+    # Document catalog: recount every bundled workbook that parsed
+    totals = {}
+    for _, content, meta in rows:
+        chunks, size = totals.get(meta["source"], (0, 0))
+        totals[meta["source"]] = (chunks + 1, size + len(content.encode("utf-8")))
+    for source, (chunks, size) in totals.items():
+        catalog.set_document(SYSTEM_OWNER, source, chunks, size)
+    for source in set(catalog.sources(SYSTEM_OWNER)) - set(totals) - failed:
+        catalog.remove(SYSTEM_OWNER, source)
+    if rebuild:
+        catalog.mark_initialized()
+
+    # Lexical index: changed rows plus any row it has never seen (e.g. first run after upgrade)
+    changed = {doc_id for doc_id, _, _ in added + updated}
+    lexical_rows = [row for row in rows if row[0] in changed or row[0] not in lexical_index.doc_index]
+    if lexical_rows:
+        lexical_index.add(*map(list, zip(*lexical_rows)))
 
-    print("Ingestion complete!")
+    elapsed = time.perf_counter() - start
+    print(f"Ingestion complete in {elapsed:.1f}s: {len(added)} added, {len(updated)} updated, "
+          f"{skipped} skipped, {len(removed)} deleted, {len(failed)} files failed.")
+    return {"added": len(added), "updated": len(updated), "skipped": skipped, "deleted": len(removed), "failed": sorted(failed)}
 
 if __name__ == "__main__":
-    ingest_data()
+    parser = argparse.ArgumentParser(description="Ingest the bundled Excel knowledge base into ChromaDB.")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the collection (including user uploads) and re-embed everything")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: one per CPU)")
+    args = parser.parse_args()
+    ingest_data(rebuild=args.rebuild, workers=args.workers)
@@ -1,6 +1,11 @@
+import time
+STARTED = time.perf_counter()
+
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -9,8 +14,23 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from routers import quiz_agent, qa_agent, grading_agent, kb_agent
+from services.ingest_jobs import ingest_jobs
+from services.llm_usage import llm_usage
+from services.structured_output import structured_output
+from services.tracing import tracer, TracingMiddleware
+from services.startup import startup
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background KB ingestion workers, then model/collection warmup (see /ready)
+    await asyncio.to_thread(ingest_jobs.instance)
+    ingest_jobs.start()
+    startup.start(import_seconds=time.perf_counter() - STARTED)
+    yield
+    await startup.stop()
+    await ingest_jobs.stop()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS Configuration
 app.add_middleware(
@@ -21,6 +41,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request stage tracing (METRICS=0 leaves the middleware out entirely)
+if tracer.enabled:
+    app.add_middleware(TracingMiddleware, tracer=tracer)
+
 # Include Routers
 app.include_router(qa_agent.router)
 app.include_router(quiz_agent.router)
@@ -32,6 +56,32 @@ app.include_router(kb_agent.router)
 async def read_index():
     return FileResponse("../index.html")
 
+# Liveness: the process is up (may still be warming up)
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+# Readiness: 503 until warmup has finished; includes the startup timings
+@app.get("/ready")
+def readiness_check():
+    return JSONResponse(startup.report(), status_code=200 if startup.ready else 503)
+
+# Provider-reported token usage per agent, incl. prompt-prefix cache hit rate
+@app.get("/api/llm/usage")
+def llm_usage_stats():
+    return llm_usage.stats()
+
+# JSON generations per agent: valid first time / repaired / failed
+@app.get("/api/llm/structured")
+def structured_output_stats():
+    return structured_output.stats()
+
+# Prometheus scrape endpoint: stage latencies, request durations, LLM tokens/cost per agent and role
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(tracer.render(), media_type="text/plain; version=0.0.4")
+
+# Most recent requests slower than SLOW_REQUEST_MS, with their stage breakdown
+@app.get("/api/metrics/slow")
+def slow_requests():
+    return list(tracer.slow_requests)
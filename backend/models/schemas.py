@@ -12,6 +12,7 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[str]
+    prompt_tokens: Optional[int] = None # tokens sent to the LLM (system + history + context + query)
 
 class QuizQuestion(BaseModel):
     id: int
@@ -22,6 +23,15 @@ class QuizQuestion(BaseModel):
     analysis: str
     difficulty: str = "medium"
 
+class QuizQuestionSet(BaseModel):
+    """Shape of the LLM's quiz reply."""
+    questions: List[QuizQuestion]
+
+class QuestionBankEntry(BaseModel):
+    """Shape of the LLM's reply when pre-generating questions for the question bank."""
+    topic: str # short topic label, e.g. "议程设置理论"
+    questions: List[QuizQuestion]
+
 class QuizResponse(BaseModel):
     title: str
     questions: List[QuizQuestion]
@@ -30,6 +40,7 @@ class QuizResponse(BaseModel):
 class QuizGenerationResponse(BaseModel):
     questions: List[QuizQuestion]
     sources: List[str]
+    prompt_tokens: Optional[int] = None
 
 class RubricItem(BaseModel):
     criterion: str
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import FileResponse
 from models.schemas import ChatRequest, Rubric, RubricItem, GradingResult, GradingReport, RubricGenerationResponse
-from services.rag_service import rag_service
+from services.rag_service import rag_service, split_topics, ENUMERATION_MARKS
+from services.grading_service import grading_engine, grading_jobs
+from services.extraction import extraction_service, ExtractionError
+from services.prompt_packer import prompt_packer
+from services.structured_output import structured_output
+from services.export_service import export_service, REPORT_FORMATS
+from services.tracing import tracer
+import re
 import json
 from typing import List
-import pypdf
-import docx
-import io
 
 router = APIRouter(prefix="/api/grading", tags=["grading_agent"])
 
@@ -29,85 +34,98 @@ RUBRIC_PERSONA = """你是一个专业的教育评估专家。
 3. 包含 3-5 个评分维度，总权重必须为 100。
 """
 
-GRADING_PROMPT_TEMPLATE = """你是一个公正的阅卷老师。
-请根据以下【评分标准】对【学生作业】进行评分。
-
-【评分标准】：
-{rubric_json}
-
-【学生作业】：
-{student_text}
+# Static system prompts: persona + output format (+ rubric) form a prefix that is
+# byte-identical for every essay in a batch; the essay itself is the user message.
+GRADING_PERSONA = """你是一个公正的阅卷老师。
+请根据【评分标准】对用户发送的【学生作业】进行评分。
 
 要求：
 1. 返回严格的 JSON 格式。
 2. 对每个维度打分，并计算总分。
 3. 提供总体评语（feedback）。
 4. JSON 结构如下：
-{{
+{
   "student_name": "Unknown", 
   "total_score": 85,
   "feedback": "总体评价...",
-  "details": {{
+  "details": {
     "维度1": 25,
     "维度2": 30
-  }}
-}}
+  }
+}
 5. **只返回 JSON 字符串**。
+
+【评分标准】：
 """
 
+# Default Rubric/Prompt for Student Self-Check
+DEFAULT_STUDENT_PROMPT = """你是一个学术写作指导老师。
+请对用户发送的【学生论文草稿】进行诊断。
+不需要打分，请重点从以下几个方面进行定性评价并给出修改建议：
+1. 论点清晰度 (Thesis Clarity)
+2. 论据充分性 (Evidence & Argumentation)
+3. 逻辑结构 (Logical Structure)
+4. 学术规范 (Academic Integrity)
+
+要求：
+1. 返回严格的 JSON 格式。
+2. JSON 结构如下：
+{
+  "student_name": "Unknown", 
+  "total_score": 0,
+  "feedback": "总体评价...",
+  "details": {
+    "论点": "评价...",
+    "论据": "评价...",
+    "逻辑": "评价...",
+    "规范": "评价..."
+  }
+}
+3. **只返回 JSON 字符串**。
+"""
+
+RUBRIC_TAG = re.compile(r'<RUBRIC_JSON>(.*?)</RUBRIC_JSON>', re.DOTALL)
+RUBRIC_INSTRUCTION = "\n请根据用户的要求（以及【背景知识】中的参考资料，如有），生成或优化评分标准。"
+
 @router.post("/rubric", response_model=RubricGenerationResponse)
 async def generate_rubric(request: ChatRequest):
+    tracer.tag(role=request.role)
     try:
         context_str = ""
         
         # 1. Retrieve relevant documents (Only if use_kb is True)
         if request.use_kb:
             # For rubric generation, we might want to retrieve curriculum standards
-            results = rag_service.retrieve(request.query, role=request.role, target_user_ids=request.target_user_ids)
-            if results['documents']:
-                context_str = "\n".join(results['documents'][0])
-        
-        # 2. Construct Prompt
-        if request.use_kb and context_str:
-            prompt = RUBRIC_PERSONA + f"\n请根据用户的要求和以下【参考资料】，为【{request.query}】生成或优化评分标准。\n\n【参考资料】：\n{context_str}"
-        else:
-            prompt = RUBRIC_PERSONA + f"\n请根据用户的要求，为【{request.query}】生成或优化评分标准。"
+            # A rubric covering several topics retrieves for each of them in one batch
+            topics = split_topics(request.query, separators=ENUMERATION_MARKS)
+            queries = topics if len(topics) > 1 else [request.query]
+            results = await rag_service.aretrieve_many(queries, role=request.role, target_user_ids=request.target_user_ids)
+            context_str, _, _ = prompt_packer.pack_context(results)
         
-        # Call LLM
-        response_text = rag_service.generate_answer(
-            query=request.query,
-            context="", # Context is already embedded in prompt
-            history=request.history,
-            system_prompt=prompt
-        )
+        # 2. Static system prompt; the query and reference material go in the user message
+        system_prompt = RUBRIC_PERSONA + RUBRIC_INSTRUCTION
+        messages = rag_service.build_messages(request.query, context_str, prompt_packer.trim_history(request.history), system_prompt)
+        response_text = await rag_service.acomplete(messages, agent="rubric")
         
-        # Parse Hybrid Output
+        # Parse Hybrid Output: free text, plus the rubric JSON inside <RUBRIC_JSON> tags
         rubric_data = None
         message = response_text
         
-        import re
-        json_match = re.search(r'<RUBRIC_JSON>(.*?)</RUBRIC_JSON>', response_text, re.DOTALL)
-        
+        json_match = RUBRIC_TAG.search(response_text)
         if json_match:
-            json_str = json_match.group(1).strip()
-            # Clean potential markdown inside tags
-            if json_str.startswith("```json"):
-                json_str = json_str.replace("```json", "").replace("```", "")
-            elif json_str.startswith("```"):
-                json_str = json_str.replace("```", "")
+            rubric_data, error = structured_output.validate(json_match.group(1), Rubric.model_validate)
+            outcome = "ok"
+            if error:
+                # One targeted repair call for the JSON part only
+                _, (rubric_data, error) = await structured_output.repair(messages, response_text, error, Rubric.model_validate, "rubric")
+                outcome = "repaired" if not error else "failed"
+            structured_output.record("rubric", outcome)
             
-            try:
-                data = json.loads(json_str)
-                rubric_data = Rubric(**data)
-                # Remove the JSON part from the message to avoid clutter, or keep it?
-                # Let's keep the message clean, remove the tags and content
-                message = re.sub(r'<RUBRIC_JSON>.*?</RUBRIC_JSON>', '', response_text, flags=re.DOTALL).strip()
+            if rubric_data:
+                # Keep the message clean: drop the tags and their content
+                message = RUBRIC_TAG.sub('', response_text).strip()
                 if not message:
                     message = "已为您生成评分标准，请在右侧查看。"
-            except json.JSONDecodeError:
-                print(f"JSON Decode Error in Rubric: {json_str}")
-                # Fallback: return text only with error hint?
-                pass
 
         return RubricGenerationResponse(message=message, rubric=rubric_data)
         
@@ -115,111 +133,105 @@ async def generate_rubric(request: ChatRequest):
         print(f"Rubric Generation Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def build_prompt_factory(rubric: str):
+    """Return a callable mapping extracted student text (already cut to the essay token budget) to chat messages.
+
+    The system message is the same string for every essay of the batch.
+    """
+    if rubric:
+        system_prompt = GRADING_PERSONA + json.dumps(json.loads(rubric), ensure_ascii=False)
+        label = "【学生作业】"
+    else:
+        system_prompt = DEFAULT_STUDENT_PROMPT
+        label = "【学生论文草稿】"
+    return lambda content: [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"{label}：\n{content}"},
+    ]
+
+async def spool_uploads(files: List[UploadFile]):
+    # Spool to temp files up front: UploadFile handles are closed once the request ends
+    uploads = []
+    try:
+        for file in files:
+            uploads.append(await extraction_service.spool(file))
+    except Exception:
+        for upload in uploads:
+            upload.cleanup()
+        raise
+    return uploads
+
 @router.post("/batch", response_model=GradingReport)
 async def batch_grade(
     files: List[UploadFile] = File(...),
     rubric: str = Form(None)
 ):
-    results = []
-    total_score_sum = 0
-    
-    # Default Rubric/Prompt for Student Self-Check
-    DEFAULT_STUDENT_PROMPT = """你是一个学术写作指导老师。
-请对以下【学生论文草稿】进行诊断。
-不需要打分，请重点从以下几个方面进行定性评价并给出修改建议：
-1. 论点清晰度 (Thesis Clarity)
-2. 论据充分性 (Evidence & Argumentation)
-3. 逻辑结构 (Logical Structure)
-4. 学术规范 (Academic Integrity)
+    try:
+        build_prompt = build_prompt_factory(rubric)
+        uploads = await spool_uploads(files)
+        return await grading_engine.grade_batch(uploads, build_prompt)
 
-【学生论文草稿】：
-{student_text}
+    except ExtractionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        print(f"Batch Grading Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-要求：
-1. 返回严格的 JSON 格式。
-2. JSON 结构如下：
-{{
-  "student_name": "Unknown", 
-  "total_score": 0,
-  "feedback": "总体评价...",
-  "details": {{
-    "论点": "评价...",
-    "论据": "评价...",
-    "逻辑": "评价...",
-    "规范": "评价..."
-  }}
-}}
-3. **只返回 JSON 字符串**。
-"""
-    
+@router.post("/jobs")
+async def submit_grading_job(
+    files: List[UploadFile] = File(...),
+    rubric: str = Form(None)
+):
+    """Job mode for large batches: returns a job id immediately."""
     try:
-        rubric_json_str = ""
-        if rubric:
-            rubric_obj = json.loads(rubric)
-            rubric_json_str = json.dumps(rubric_obj, ensure_ascii=False)
-        
-        for file in files:
-            content = ""
-            filename = file.filename
-            
-            # Parse File
-            if filename.endswith(".pdf"):
-                pdf_reader = pypdf.PdfReader(file.file)
-                for page in pdf_reader.pages:
-                    content += page.extract_text()
-            elif filename.endswith(".docx"):
-                doc = docx.Document(file.file)
-                for para in doc.paragraphs:
-                    content += para.text + "\n"
-            else:
-                content = (await file.read()).decode("utf-8")
-                
-            # Grade
-            if rubric:
-                prompt = GRADING_PROMPT_TEMPLATE.format(
-                    rubric_json=rubric_json_str,
-                    student_text=content[:3000]
-                )
-            else:
-                prompt = DEFAULT_STUDENT_PROMPT.format(
-                    student_text=content[:3000]
-                )
-            
-            json_str = rag_service.generate_answer(
-                query="Grade this essay",
-                context="",
-                history=[],
-                system_prompt=prompt
-            )
-            
-            # Clean JSON
-            if json_str.startswith("```json"):
-                json_str = json_str.replace("```json", "").replace("```", "")
-            elif json_str.startswith("```"):
-                json_str = json_str.replace("```", "")
-            
-            try:
-                grade_data = json.loads(json_str)
-                # Ensure student name uses filename if not detected
-                if grade_data.get("student_name") == "Unknown":
-                    grade_data["student_name"] = filename
-                
-                result = GradingResult(**grade_data, filename=filename, extracted_text=content[:2000])
-                results.append(result)
-                total_score_sum += result.total_score
-            except Exception as e:
-                print(f"Error grading {filename}: {e}")
-                results.append(GradingResult(
-                    student_name=filename,
-                    filename=filename,
-                    total_score=0,
-                    feedback=f"Error: {str(e)}",
-                    details={}
-                ))
-
-        average = total_score_sum / len(results) if results else 0
-        return GradingReport(results=results, average_score=average)
+        build_prompt = build_prompt_factory(rubric)
+        uploads = await spool_uploads(files)
+        job = grading_jobs.submit(uploads, build_prompt)
+        return job.to_dict()
+    except ExtractionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        print(f"Grading Job Submit Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}")
+async def get_grading_job(job_id: str):
+    job = grading_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.get("/jobs/{job_id}/result", response_model=GradingReport)
+async def get_grading_job_result(job_id: str):
+    job = grading_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job.report
 
+async def export_report(report: GradingReport, format: str):
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format} (expected one of {', '.join(REPORT_FORMATS)})")
+    try:
+        export = await export_service.export("report", format, report, "grading_report")
     except Exception as e:
-        print(f"Batch Grading Error: {e}")
+        print(f"Report Export Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return FileResponse(export.path, media_type=export.media_type, filename=export.filename)
+
+@router.post("/report/export")
+async def export_grading_report(report: GradingReport, format: str = "xlsx"):
+    """One row per student with per-criterion score columns (xlsx / csv), or a docx table."""
+    return await export_report(report, format)
+
+@router.get("/jobs/{job_id}/export")
+async def export_grading_job(job_id: str, format: str = "xlsx"):
+    job = grading_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return await export_report(job.report, format)
@@ -1,51 +1,82 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
 from services.rag_service import rag_service
-import pypdf
-import docx
+from services.embedding_service import embedding_service
+from services.extraction import extraction_service, ExtractionError
+from services.ingest_jobs import ingest_jobs
 
 router = APIRouter(prefix="/api/kb", tags=["kb_agent"])
 
 @router.post("/upload")
+@router.put("/documents")
 async def upload_to_kb(
     file: UploadFile = File(...),
     user_id: str = Form(...)
 ):
     try:
-        content = ""
         filename = file.filename
+        upload = await extraction_service.spool(file)
         
-        # Parse File
-        if filename.endswith(".pdf"):
-            pdf_reader = pypdf.PdfReader(file.file)
-            for page in pdf_reader.pages:
-                content += page.extract_text()
-        elif filename.endswith(".docx"):
-            doc = docx.Document(file.file)
-            for para in doc.paragraphs:
-                content += para.text + "\n"
-        else:
-            content = (await file.read()).decode("utf-8")
-            
-        if not content.strip():
-            raise HTTPException(status_code=400, detail="File is empty or could not be read")
-            
-        # Add to Chroma
-        num_chunks = rag_service.add_document(content, filename, user_id)
+        # Extraction, chunking and embedding run in the background job queue
+        job_id = await asyncio.to_thread(ingest_jobs.enqueue, upload, user_id)
         
-        return {"status": "success", "message": f"Successfully added {filename} ({num_chunks} chunks) to Knowledge Base"}
+        return {
+            "status": "queued",
+            "job_id": job_id,
+            "message": f"{filename} has been queued for the Knowledge Base (job {job_id})",
+            "timings": upload.timings
+        }
         
+    except ExtractionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         print(f"KB Upload Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.delete("/documents")
+async def delete_document(
+    user_id: str = Form(...),
+    filename: str = Form(...)
+):
+    try:
+        removed = await rag_service.adelete_document(user_id, filename)
+        if not removed:
+            raise HTTPException(status_code=404, detail="Document not found")
+        return {"status": "success", "message": f"Removed {filename} ({removed} chunks) from Knowledge Base"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"KB Delete Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    job = await asyncio.to_thread(ingest_jobs.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @router.post("/list")
 async def list_files(
     user_id: str = Form(None),
-    role: str = Form(None)
+    role: str = Form(None),
+    limit: int = Form(None),
+    offset: int = Form(0)
 ):
+    # Without `limit` the whole list is returned (what the panel expects); pass limit/offset to page
     try:
-        files_map = rag_service.list_documents(user_id, role)
-        return {"files": files_map}
+        limit = min(max(limit, 1), 1000) if limit is not None else None
+        return await rag_service.alist_documents(user_id, role, limit=limit, offset=max(offset, 0))
     except Exception as e:
         print(f"KB List Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/embedding/stats")
+async def embedding_stats():
+    return embedding_service.stats()
+
+@router.get("/rerank/stats")
+async def rerank_stats():
+    if not rag_service.reranker:
+        return {"enabled": False}
+    return {"enabled": True, **rag_service.reranker.stats()}
@@ -1,6 +1,11 @@
+import json
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from models.schemas import ChatRequest, ChatResponse
 from services.rag_service import rag_service
+from services.response_cache import ResponseCache
+from services.prompt_packer import prompt_packer
+from services.tracing import tracer
 
 router = APIRouter(prefix="/api", tags=["qa_agent"])
 
@@ -17,52 +22,103 @@ STUDENT_PERSONA = """你是一个新闻传播学领域的智能学习伴侣，
 3. 引导式思维：不仅给答案，还要引导学生思考，建立知识关联。
 """
 
+async def build_chat_prompt(request: ChatRequest):
+    """Retrieve context, pick the persona prompt and pack both into the token budget.
+
+    Returns (packed, system_prompt); see PromptPacker.
+    """
+    tracer.tag(role=request.role)
+    results = None
+    
+    # 1. Retrieve relevant documents (Only if use_kb is True)
+    if request.use_kb:
+        results = await rag_service.aretrieve(
+            query=request.query, 
+            user_id=request.user_id,
+            role=request.role,
+            target_user_ids=request.target_user_ids
+        )
+    
+    # 2. Select Persona based on Role
+    base_persona = TEACHER_PERSONA if request.role == "teacher" else STUDENT_PERSONA
+    
+    # 3. Construct System Prompt based on KB usage
+    if request.use_kb:
+        system_prompt = base_persona + "\n请基于【背景知识】回答问题。必须严格引用来源，不要编造。"
+    else:
+        system_prompt = base_persona + "\n请基于你的专业知识进行回答。虽然没有提供特定背景材料，但请依然保持上述的专业风格。"
+
+    # 4. Dedup + budget the chunks, trim the history
+    packed = rag_service.pack_prompt(request.query, results, request.history, system_prompt)
+    return packed, system_prompt
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     try:
-        context_str = ""
-        sources = []
-        
-        # 1. Retrieve relevant documents (Only if use_kb is True)
-        if request.use_kb:
-            results = rag_service.retrieve(
-                query=request.query, 
-                user_id=request.user_id,
-                role=request.role,
-                target_user_ids=request.target_user_ids
-            )
-            
-            documents = results['documents'][0]
-            metadatas = results['metadatas'][0]
-            
-            context_parts = []
-            for doc, meta in zip(documents, metadatas):
-                source_name = meta.get('source', 'Unknown')
-                context_parts.append(f"Source ({source_name}):\n{doc}")
-                if source_name not in sources:
-                    sources.append(source_name)
-            
-            context_str = "\n\n".join(context_parts)
+        packed, system_prompt = await build_chat_prompt(request)
         
-        # 2. Select Persona based on Role
-        base_persona = TEACHER_PERSONA if request.role == "teacher" else STUDENT_PERSONA
-        
-        # 3. Construct System Prompt based on KB usage
-        if request.use_kb:
-            system_prompt = base_persona + "\n请基于【背景知识】回答问题。必须严格引用来源，不要编造。"
-        else:
-            system_prompt = base_persona + "\n请基于你的专业知识进行回答。虽然没有提供特定背景材料，但请依然保持上述的专业风格。"
-        
-        # 4. Generate Answer
-        answer = rag_service.generate_answer(
+        # 5. Generate Answer
+        answer = await rag_service.agenerate_answer(
             query=request.query,
-            context=context_str,
-            history=request.history,
-            system_prompt=system_prompt
+            context=packed.context,
+            history=packed.history,
+            system_prompt=system_prompt,
+            cache_scope=ResponseCache.make_scope(request.user_id, request.role, request.target_user_ids),
+            context_ids=packed.context_ids
         )
         
-        return ChatResponse(answer=answer, sources=sources)
+        return ChatResponse(answer=answer, sources=packed.sources, prompt_tokens=packed.tokens["total"])
+
+    except Exception as e:
+        print(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Server-sent events variant of /chat.
+
+    Emits one `sources` event, then `delta` events with token text, then `done`
+    (carrying the prompt token count).
+    Failures after the stream has started are reported as an `error` event.
+    """
+    try:
+        packed, system_prompt = await build_chat_prompt(request)
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        yield sse_event("sources", packed.sources)
+        try:
+            async for delta in rag_service.astream_answer(
+                query=request.query,
+                context=packed.context,
+                history=packed.history,
+                system_prompt=system_prompt,
+                cache_scope=ResponseCache.make_scope(request.user_id, request.role, request.target_user_ids),
+                context_ids=packed.context_ids
+            ):
+                yield sse_event("delta", {"content": delta})
+            yield sse_event("done", {"prompt_tokens": packed.tokens["total"]})
+        except Exception as e:
+            print(f"Stream Error: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/chat/cache/stats")
+async def chat_cache_stats():
+    if not rag_service.response_cache:
+        return {"enabled": False}
+    return {"enabled": True, **rag_service.response_cache.stats()}
+
+@router.get("/chat/prompt/stats")
+async def chat_prompt_stats():
+    return prompt_packer.stats()
@@ -1,10 +1,19 @@
+import os
 from fastapi import APIRouter, HTTPException
-from models.schemas import ChatRequest, QuizResponse, QuizQuestion, QuizGenerationResponse
+from fastapi.responses import StreamingResponse, FileResponse
+from models.schemas import ChatRequest, QuizResponse, QuizQuestion, QuizQuestionSet, QuizGenerationResponse
 from services.rag_service import rag_service
-import json
+from services.structured_output import structured_output, JsonArrayStreamer, StructuredOutputError
+from services.question_bank import question_bank, parse_quiz_request, quiz_topics
+from services.export_service import export_service
+from services.tracing import tracer
+from routers.qa_agent import sse_event
 
 router = APIRouter(prefix="/api", tags=["quiz_agent"])
 
+# Serve student practice requests from the pre-generated bank (QUESTION_BANK=0 disables it)
+USE_QUESTION_BANK = os.getenv("QUESTION_BANK", "1") == "1"
+
 TEACHER_PERSONA = """你是一个新闻传播学领域的专业出题专家。
 要求：
 1. 根据用户指令（如“出3道关于议程设置的选择题”）生成相应数量和类型的题目。
@@ -48,102 +57,153 @@ STUDENT_PERSONA = """你是一个新闻传播学领域的智能辅导员。
 5. **只返回 JSON 字符串**，不要包含 markdown 格式标记。
 """
 
+async def serve_from_bank(request: ChatRequest):
+    """(questions, sources) from the question bank, or None to fall back to live generation.
+
+    Only student practice requests grounded in the knowledge base are eligible;
+    the bank must hold enough questions on a close topic that the user has not seen.
+    """
+    if not (USE_QUESTION_BANK and request.use_kb and request.role != "teacher" and question_bank.topic_ids):
+        return None
+    try:
+        topic, count, difficulty = parse_quiz_request(request.query)
+        embedding = await rag_service.aembed_query(topic)
+        return await rag_service.run_blocking(question_bank.serve, request.user_id, embedding, count, difficulty)
+    except Exception as e:
+        print(f"Question Bank Error: {e}")
+        return None
+
+async def build_quiz_messages(request: ChatRequest):
+    """Retrieve context, pick the persona prompt and pack both. Returns (packed, messages)."""
+    tracer.tag(role=request.role)
+    results = None
+    
+    # 1. Retrieve relevant documents (Only if use_kb is True)
+    if request.use_kb:
+        # Multi-topic requests retrieve per topic in one batch, so every topic gets context
+        topics = quiz_topics(request.query)
+        queries = topics if len(topics) > 1 else [request.query]
+        results = await rag_service.aretrieve_many(queries, role=request.role, target_user_ids=request.target_user_ids)
+    
+    # 2. Select Persona based on Role
+    base_persona = TEACHER_PERSONA if request.role == "teacher" else STUDENT_PERSONA
+    
+    # 3. Construct System Prompt based on KB usage
+    if request.use_kb:
+        system_prompt = base_persona + "\n请基于【背景知识】和用户的【指令】，生成一组试题。内容必须基于背景知识，严谨准确。"
+    else:
+        system_prompt = base_persona + "\n请基于用户的【指令】和你的专业知识，生成一组试题。"
+    
+    # 4. Dedup + budget the chunks, trim the history
+    packed = rag_service.pack_prompt(request.query, results, request.history, system_prompt)
+    messages = rag_service.build_messages(request.query, packed.context, packed.history, system_prompt)
+    return packed, messages
+
 @router.post("/quiz/generate", response_model=QuizGenerationResponse)
 async def generate_quiz(request: ChatRequest):
     try:
-        context_str = ""
-        sources = []
-        
-        # 1. Retrieve relevant documents (Only if use_kb is True)
-        if request.use_kb:
-            results = rag_service.retrieve(request.query, role=request.role, target_user_ids=request.target_user_ids)
-            
-            documents = results['documents'][0]
-            metadatas = results['metadatas'][0]
-            
-            context_parts = []
-            for doc, meta in zip(documents, metadatas):
-                source_name = meta.get('source', 'Unknown')
-                context_parts.append(f"Source ({source_name}):\n{doc}")
-                if source_name not in sources:
-                    sources.append(source_name)
-            
-            context_str = "\n\n".join(context_parts)
-        
-        # 2. Select Persona based on Role
-        base_persona = TEACHER_PERSONA if request.role == "teacher" else STUDENT_PERSONA
-        
-        # 3. Construct System Prompt based on KB usage
-        if request.use_kb:
-            system_prompt = base_persona + "\n请基于【背景知识】和用户的【指令】，生成一组试题。内容必须基于背景知识，严谨准确。"
-        else:
-            system_prompt = base_persona + "\n请基于用户的【指令】和你的专业知识，生成一组试题。"
-        
-        # 4. Generate Answer (Force JSON)
-        json_str = rag_service.generate_answer(
-            query=request.query,
-            context=context_str,
-            history=request.history,
-            system_prompt=system_prompt
-        )
+        banked = await serve_from_bank(request)
+        if banked:
+            questions, sources = banked
+            return QuizGenerationResponse(questions=questions, sources=sources, prompt_tokens=0)
+
+        packed, messages = await build_quiz_messages(request)
         
-        # Clean up potential markdown code blocks if LLM adds them
-        if json_str.startswith("```json"):
-            json_str = json_str.replace("```json", "").replace("```", "")
-        elif json_str.startswith("```"):
-            json_str = json_str.replace("```", "")
-            
-        try:
-            quiz_data = json.loads(json_str)
-        except json.JSONDecodeError:
-            print(f"JSON Decode Error. Raw output: {json_str}")
-            # Fallback: try to find JSON object in text
-            start = json_str.find("{")
-            end = json_str.rfind("}") + 1
-            if start != -1 and end != -1:
-                try:
-                    quiz_data = json.loads(json_str[start:end])
-                except:
-                     raise ValueError("Failed to generate valid JSON quiz.")
-            else:
-                raise ValueError("Failed to generate valid JSON quiz.")
+        # 5. Generate (JSON mode, schema-validated, one repair call on failure)
+        quiz, _ = await structured_output.generate(messages, QuizQuestionSet.model_validate, agent="quiz")
 
         return QuizGenerationResponse(
-            questions=[QuizQuestion(**q) for q in quiz_data.get("questions", [])],
-            sources=sources
+            questions=quiz.questions,
+            sources=packed.sources,
+            prompt_tokens=packed.tokens["total"]
         )
 
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-from fastapi.responses import StreamingResponse
-from docx import Document
-import io
+@router.post("/quiz/generate/stream")
+async def generate_quiz_stream(request: ChatRequest):
+    """Server-sent events variant of /quiz/generate.
 
-# ... (existing code)
+    Emits `sources`, then one `question` event per question as soon as it is
+    complete in the model's output, then `done` (question count, prompt tokens).
+    Failures after the stream has started are reported as an `error` event.
+    """
+    banked = await serve_from_bank(request)
+    if banked:
+        questions, sources = banked
+
+        async def bank_stream():
+            yield sse_event("sources", sources)
+            for question in questions:
+                yield sse_event("question", question.model_dump())
+            yield sse_event("done", {"count": len(questions), "prompt_tokens": 0})
+
+        return StreamingResponse(
+            bank_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    try:
+        packed, messages = await build_quiz_messages(request)
+    except Exception as e:
+        print(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        yield sse_event("sources", packed.sources)
+        try:
+            streamer = JsonArrayStreamer("questions")
+            parts, sent = [], 0
+            async for delta in rag_service.astream_complete(messages, agent="quiz", json_mode=True):
+                parts.append(delta)
+                for item in streamer.feed(delta):
+                    question, error = structured_output.validate(item, QuizQuestion.model_validate, extract=lambda x: x)
+                    if question:
+                        sent += 1
+                        yield sse_event("question", question.model_dump())
+
+            if sent:
+                structured_output.record("quiz", "ok")
+            else:
+                # Nothing usable streamed: validate the whole reply, repair once if needed
+                reply = "".join(parts)
+                quiz, error = structured_output.validate(reply, QuizQuestionSet.model_validate)
+                outcome = "ok"
+                if error:
+                    reply, (quiz, error) = await structured_output.repair(messages, reply, error, QuizQuestionSet.model_validate, "quiz")
+                    outcome = "repaired"
+                if error:
+                    structured_output.record("quiz", "failed")
+                    raise StructuredOutputError(f"Model output failed validation after repair: {error[:300]}")
+                structured_output.record("quiz", outcome)
+                for question in quiz.questions:
+                    sent += 1
+                    yield sse_event("question", question.model_dump())
+            yield sse_event("done", {"count": sent, "prompt_tokens": packed.tokens["total"]})
+        except Exception as e:
+            print(f"Quiz Stream Error: {e}")
+            yield sse_event("error", {"detail": str(e)})
 
-@router.post("/quiz/export")
-async def export_quiz(quiz: QuizResponse):
-    doc = Document()
-    doc.add_heading(quiz.title, 0)
-    
-    for i, q in enumerate(quiz.questions):
-        doc.add_paragraph(f"{i+1}. {q.stem}")
-        for j, opt in enumerate(q.options):
-            doc.add_paragraph(f"{chr(65+j)}. {opt}")
-        
-        doc.add_paragraph(f"正确答案: {q.answer}")
-        doc.add_paragraph(f"解析: {q.analysis}")
-        doc.add_paragraph("") # Spacing
-
-    # Save to memory
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    
     return StreamingResponse(
-        buffer, 
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        headers={"Content-Disposition": "attachment; filename=quiz.docx"}
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
+
+# Question bank size and serve hit rate
+@router.get("/quiz/bank/stats")
+async def question_bank_stats():
+    return question_bank.stats()
+
+@router.post("/quiz/export")
+async def export_quiz(quiz: QuizResponse):
+    try:
+        export = await export_service.export("quiz", "docx", quiz, "quiz")
+    except Exception as e:
+        print(f"Quiz Export Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return FileResponse(export.path, media_type=export.media_type, filename=export.filename)
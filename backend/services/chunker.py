@@ -0,0 +1,145 @@
+import os
+import re
+import hashlib
+from typing import Iterable, Iterator, List, Union
+
+import numpy as np
+
+# Sentence ends: Chinese/ASCII terminal punctuation (kept with the sentence) and line breaks
+SENTENCE_END = re.compile(r"(?<=[。！？!?；;…])|\n+")
+# Lines that open a new section: 第X章/节/部分, markdown headings, "1." / "1.2 " / "一、" numbering
+HEADING = re.compile(r"^\s*(第[一二三四五六七八九十百零\d]+[章节部分篇]|#{1,6}\s|\d+(\.\d+)*[\.、\s]|[一二三四五六七八九十]+、)")
+TOKEN = re.compile(r"[一-鿿]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_一-鿿]")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count: one per CJK character, ASCII word or punctuation mark."""
+    return len(TOKEN.findall(text))
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_END.split(text) if s and s.strip()]
+
+
+def join_text(parts: List[str]) -> str:
+    """Concatenate sentences/tokens, inserting a space only between two ASCII word characters."""
+    out = ""
+    for part in parts:
+        if out and part and out[-1].isascii() and out[-1].isalnum() and part[0].isascii() and part[0].isalnum():
+            out += " "
+        out += part
+    return out
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over character bigrams, for near-duplicate detection."""
+    text = re.sub(r"\s+", "", text)
+    grams = [text[i:i + 2] for i in range(max(len(text) - 1, 1))]
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big") for g in grams],
+        dtype=np.uint64
+    )
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    positive = bits.sum(axis=0) * 2 > len(grams)
+    return sum(1 << int(bit) for bit in np.flatnonzero(positive))
+
+
+class SimHashIndex:
+    """Near-duplicate lookup over 64-bit SimHashes in about constant time per chunk.
+
+    Fingerprints are cut into `distance + 1` bands (4 x 16 bits for the default
+    distance of 3). Two fingerprints within `distance` bits agree exactly on at
+    least one band, so only fingerprints sharing a band value are compared.
+    """
+
+    def __init__(self, distance: int):
+        self.distance = distance
+        n = min(distance + 1, 64)
+        bounds = [round(i * 64 / n) for i in range(n + 1)]
+        self.bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds, bounds[1:])]
+        self.buckets = [{} for _ in self.bands]
+
+    def add(self, fingerprint: int) -> bool:
+        """Index the fingerprint; False (and not indexed) if a near-duplicate is already in."""
+        keys = [(fingerprint >> shift) & mask for shift, mask in self.bands]
+        for bucket, key in zip(self.buckets, keys):
+            if any((fingerprint ^ other).bit_count() <= self.distance for other in bucket.get(key, ())):
+                return False
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, []).append(fingerprint)
+        return True
+
+
+class Chunker:
+    """Structure-aware chunker with overlap.
+
+    Splits on Chinese sentence punctuation and starts a new chunk at headings,
+    packs sentences up to `max_tokens`, carries the last `overlap` tokens into the
+    next chunk, and drops near-identical chunks (SimHash distance <= `dedup_distance`).
+    `iter_chunks` is a generator, so input blocks (pages, paragraphs) are consumed lazily.
+    """
+
+    def __init__(self, max_tokens: int = None, overlap: int = None, dedup_distance: int = None):
+        self.max_tokens = max_tokens or int(os.getenv("CHUNK_TOKENS", "400"))
+        self.overlap = overlap if overlap is not None else int(os.getenv("CHUNK_OVERLAP", "60"))
+        self.dedup_distance = dedup_distance if dedup_distance is not None else int(os.getenv("CHUNK_DEDUP_DISTANCE", "3"))
+
+    def _pieces(self, sentence: str) -> Iterator[str]:
+        # A single sentence longer than the budget is hard-split
+        if count_tokens(sentence) <= self.max_tokens:
+            yield sentence
+            return
+        tokens = TOKEN.findall(sentence)
+        for i in range(0, len(tokens), self.max_tokens):
+            yield join_text(tokens[i:i + self.max_tokens])
+
+    def _raw_chunks(self, blocks: Iterable[str]) -> Iterator[str]:
+        current, current_tokens = [], 0
+        carried = 0 # number of leading sentences in `current` that came from overlap
+
+        def tail(sentences):
+            kept, total = [], 0
+            for s in reversed(sentences):
+                n = count_tokens(s)
+                if total + n > self.overlap:
+                    break
+                kept.insert(0, s)
+                total += n
+            return kept, total
+
+        for block in blocks:
+            for line in block.splitlines() or [block]:
+                if HEADING.match(line) and len(current) > carried:
+                    yield join_text(current).strip()
+                    current, current_tokens, carried = [], 0, 0
+                new_line = bool(current)
+                for sentence in split_sentences(line):
+                    for piece in self._pieces(sentence):
+                        n = count_tokens(piece)
+                        if new_line:
+                            # Keep paragraph breaks inside a chunk
+                            piece, new_line = "\n" + piece, False
+                        if current_tokens + n > self.max_tokens and len(current) > carried:
+                            yield join_text(current).strip()
+                            current, current_tokens = tail(current)
+                            carried = len(current)
+                        current.append(piece)
+                        current_tokens += n
+        if len(current) > carried:
+            yield join_text(current).strip()
+
+    def iter_chunks(self, content: Union[str, Iterable[str]]) -> Iterator[str]:
+        blocks = [content] if isinstance(content, str) else content
+        seen = SimHashIndex(self.dedup_distance) if self.dedup_distance >= 0 else None
+        for chunk in self._raw_chunks(blocks):
+            if not chunk.strip():
+                continue
+            if seen is not None and not seen.add(simhash(chunk)):
+                continue
+            yield chunk
+
+    def chunk(self, content: Union[str, Iterable[str]]) -> List[str]:
+        return list(self.iter_chunks(content))
+
+
+chunker = Chunker()
@@ -0,0 +1,138 @@
+import time
+import sqlite3
+import threading
+from typing import List, Optional
+
+
+class DocumentCatalog:
+    """Per-document summary of the knowledge base, keyed by (owner_id, source).
+
+    Holds chunk counts, byte sizes and upload times so listing documents is an
+    indexed, paginated query instead of a scan over every chunk's metadata.
+    Kept in sync by RAGService.add_document/delete_document and ingest.py.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                owner_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                uploaded_at REAL,
+                updated_at REAL,
+                content_hash TEXT,
+                pending_chunks INTEGER, -- chunk indexes written so far by an unfinished replace
+                PRIMARY KEY (owner_id, source)
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(documents)")}
+        for column in ("content_hash TEXT", "pending_chunks INTEGER"):
+            if column.split()[0] not in columns:
+                self.conn.execute(f"ALTER TABLE documents ADD COLUMN {column}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    @property
+    def initialized(self) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM catalog_meta WHERE key = 'initialized'").fetchone()
+        return bool(row)
+
+    def mark_initialized(self):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO catalog_meta VALUES ('initialized', ?)", (str(time.time()),))
+            self.conn.commit()
+
+    def set_document(self, owner_id: str, source: str, chunks: int, size: int, content_hash: str = None):
+        """Create or overwrite a document's entry.
+
+        content_hash is the hash of the uploaded file; it is empty for documents whose
+        chunks do not follow RAGService.chunk_id (legacy uploads, bundled workbooks).
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO documents (owner_id, source, chunks, bytes, uploaded_at, updated_at, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(owner_id, source) DO UPDATE SET
+                    chunks = excluded.chunks,
+                    bytes = excluded.bytes,
+                    updated_at = excluded.updated_at,
+                    content_hash = excluded.content_hash,
+                    pending_chunks = NULL
+            """, (owner_id, source, chunks, size, now, now, content_hash))
+            self.conn.commit()
+
+    def mark_pending(self, owner_id: str, source: str, chunks: int):
+        """Record that a replace of an existing document has written chunk indexes up to `chunks`.
+
+        Until set_document() finishes the replace, the entry no longer vouches for its
+        content_hash, and the document may hold chunks up to the larger of both counts.
+        """
+        with self.lock:
+            self.conn.execute(
+                "UPDATE documents SET pending_chunks = MAX(COALESCE(pending_chunks, 0), ?) WHERE owner_id = ? AND source = ?",
+                (chunks, owner_id, source)
+            )
+            self.conn.commit()
+
+    def remove(self, owner_id: str, source: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM documents WHERE owner_id = ? AND source = ?", (owner_id, source))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM documents")
+            self.conn.commit()
+
+    def sources(self, owner_id: str) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT source FROM documents WHERE owner_id = ?", (owner_id,)).fetchall()
+        return [r["source"] for r in rows]
+
+    def get(self, owner_id: str, source: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM documents WHERE owner_id = ? AND source = ?", (owner_id, source)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list(self, owner_id: str = None, limit: int = 100, offset: int = 0) -> List[dict]:
+        """Documents ordered by (owner_id, source); restricted to one owner when given. limit=-1: no limit."""
+        with self.lock:
+            if owner_id is not None:
+                rows = self.conn.execute(
+                    "SELECT * FROM documents WHERE owner_id = ? ORDER BY source LIMIT ? OFFSET ?",
+                    (owner_id, limit, offset)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT * FROM documents ORDER BY owner_id, source LIMIT ? OFFSET ?",
+                    (limit, offset)
+                ).fetchall()
+        return [dict(r) for r in rows]
+
+    def rebuild(self, collection, page_size: int = 5000):
+        """One-off backfill from the chunk metadata of an existing collection."""
+        counts = {}
+        offset = 0
+        while True:
+            page = collection.get(include=['metadatas', 'documents'], limit=page_size, offset=offset)
+            if not page['ids']:
+                break
+            for meta, doc in zip(page['metadatas'], page['documents']):
+                meta = meta or {}
+                key = (meta.get('owner_id', 'system'), meta.get('source', 'Unknown'))
+                chunks, size = counts.get(key, (0, 0))
+                counts[key] = (chunks + 1, size + len((doc or "").encode("utf-8")))
+            offset += len(page['ids'])
+        for (owner_id, source), (chunks, size) in counts.items():
+            existing = self.get(owner_id, source)
+            self.set_document(owner_id, source, chunks, size, existing["content_hash"] if existing else None)
+        self.mark_initialized()
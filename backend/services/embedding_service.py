@@ -0,0 +1,242 @@
+import os
+import time
+import queue
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List
+
+from chromadb import Documents, EmbeddingFunction, Embeddings
+
+DEFAULT_MODEL = "shibing624/text2vec-base-chinese"
+
+
+class Histogram:
+    """Fixed-bucket histogram (cumulative counts are computed on read)."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            labels = [str(b) for b in self.buckets] + ["+Inf"]
+            return {
+                "buckets": dict(zip(labels, self.counts)),
+                "count": self.count,
+                "sum": round(self.total, 4),
+            }
+
+
+class EmbeddingService:
+    """Shared text2vec embedding model for ingest and retrieval.
+
+    - Query embeddings are LRU-cached.
+    - Concurrent single-query calls are micro-batched into one forward pass:
+      the batcher thread waits up to `batch_window` seconds for more queries.
+    - Document embeddings (ingest, uploads) go straight through in large batches.
+    The model itself is loaded lazily on first use. With EMBEDDING_SERVER_URL set,
+    forward passes are sent to the embedding sidecar (embedding_server.py) instead,
+    so several server workers share one copy of the model.
+
+    EMBEDDING_BACKEND selects the runtime: "torch" (default) or "onnx" (ONNX
+    Runtime via sentence-transformers' backend support; needs
+    `pip install sentence-transformers[onnx]`). EMBEDDING_ONNX_FILE picks a file
+    inside the model, e.g. the int8 export written by export_embedding_onnx.py.
+    EMBEDDING_THREADS sets the CPU thread count for either runtime.
+    """
+
+    def __init__(self, model_name: str = None, threads: int = None, cache_size: int = None,
+                 batch_window: float = None, max_batch: int = None, backend: str = None, onnx_file: str = None):
+        self.model_name = model_name or os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL)
+        self.backend = backend or os.getenv("EMBEDDING_BACKEND", "torch")
+        self.onnx_file = onnx_file if onnx_file is not None else os.getenv("EMBEDDING_ONNX_FILE", "")
+        self.threads = threads or int(os.getenv("EMBEDDING_THREADS", "0")) # 0 = library default
+        self.cache_size = cache_size if cache_size is not None else int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+        self.batch_window = batch_window if batch_window is not None else float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5")) / 1000
+        self.max_batch = max_batch or int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+        self.server_url = os.getenv("EMBEDDING_SERVER_URL", "").rstrip("/")
+        self._http = None
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._batcher = None
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.latency = Histogram([0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+        if self.backend == "onnx":
+            try:
+                model_kwargs = {"provider": "CPUExecutionProvider"}
+                if self.onnx_file:
+                    model_kwargs["file_name"] = self.onnx_file
+                if self.threads:
+                    import onnxruntime
+                    options = onnxruntime.SessionOptions()
+                    options.intra_op_num_threads = self.threads
+                    model_kwargs["session_options"] = options
+                return SentenceTransformer(self.model_name, backend="onnx", model_kwargs=model_kwargs)
+            except Exception as e:
+                print(f"Warning: ONNX embedding backend unavailable ({e}), falling back to torch.")
+                self.backend = "torch"
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+        return SentenceTransformer(self.model_name)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        if self.server_url:
+            vectors = self._encode_remote(list(texts))
+        else:
+            vectors = [v.tolist() for v in self.model.encode(list(texts), convert_to_numpy=True, batch_size=max(len(texts), 1))]
+        self.latency.observe(time.perf_counter() - start)
+        self.batch_sizes.observe(len(texts))
+        return vectors
+
+    def _encode_remote(self, texts: List[str]) -> List[List[float]]:
+        if self._http is None:
+            import httpx
+            self._http = httpx.Client(base_url=self.server_url, timeout=float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "60")))
+        resp = self._http.post("/embed", json={"texts": texts})
+        resp.raise_for_status()
+        return resp.json()["embeddings"]
+
+    def embed_documents(self, texts: List[str], batch_size: int = 256) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), batch_size):
+            vectors.extend(self._encode(texts[i:i + batch_size]))
+        return vectors
+
+    def _cache_get(self, text: str):
+        with self._cache_lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+            return vector
+
+    def _cache_put(self, text: str, vector: List[float]):
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _ensure_batcher(self):
+        if self._batcher is None:
+            with self._model_lock:
+                if self._batcher is None:
+                    self._batcher = threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True)
+                    self._batcher.start()
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(texts, self._encode(texts)))
+                for text, future in batch:
+                    self._cache_put(text, vectors[text])
+                    future.set_result(vectors[text])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Blocking; call from a worker thread. Cached, and micro-batched with concurrent callers."""
+        vector = self._cache_get(text)
+        if vector is not None:
+            return vector
+        self._ensure_batcher()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one forward pass (cached entries are reused)."""
+        vectors = [self._cache_get(t) for t in texts]
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            fresh = dict(zip(missing, self._encode(missing)))
+            for text, vector in fresh.items():
+                self._cache_put(text, vector)
+            vectors = [v if v is not None else fresh[t] for t, v in zip(texts, vectors)]
+        return vectors
+
+    def as_chroma_function(self) -> "ServiceEmbeddingFunction":
+        return ServiceEmbeddingFunction(self)
+
+    def stats(self) -> dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "model": self.model_name,
+            "backend": self.backend + (f" ({self.onnx_file})" if self.backend == "onnx" and self.onnx_file else ""),
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+            "batch_size": self.batch_sizes.snapshot(),
+            "latency_seconds": self.latency.snapshot(),
+        }
+
+
+class ServiceEmbeddingFunction(EmbeddingFunction):
+    """Chroma adapter: single texts go through the query path, lists through the document path."""
+
+    def __init__(self, service: EmbeddingService):
+        self.service = service
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if len(input) == 1:
+            return [self.service.embed_query(input[0])]
+        return self.service.embed_documents(list(input))
+
+    def embed_query(self, input: Documents) -> Embeddings:
+        """Chroma's query hook: a batch of queries is encoded together but still cached per query."""
+        if len(input) == 1:
+            return [self.service.embed_query(input[0])]
+        return self.service.embed_queries(list(input))
+
+
+embedding_service = EmbeddingService()
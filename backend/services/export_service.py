@@ -0,0 +1,205 @@
+import os
+import csv
+import time
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from models.schemas import QuizResponse, GradingReport
+
+MEDIA_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+}
+QUIZ_FORMATS = ("docx",)
+REPORT_FORMATS = ("xlsx", "csv", "docx")
+
+
+class ExportFile:
+    """A finished export on disk, ready to be streamed with FileResponse."""
+
+    def __init__(self, path: str, fmt: str, filename: str, cached: bool = False):
+        self.path = path
+        self.media_type = MEDIA_TYPES[fmt]
+        self.filename = filename
+        self.cached = cached
+
+
+# --- Builders (run in the export worker thread; write straight to `path`) ---
+
+def write_quiz_docx(quiz: QuizResponse, path: str):
+    from docx import Document
+    doc = Document()
+    doc.add_heading(quiz.title, 0)
+
+    for i, q in enumerate(quiz.questions):
+        doc.add_paragraph(f"{i+1}. {q.stem}")
+        for j, opt in enumerate(q.options):
+            doc.add_paragraph(f"{chr(65+j)}. {opt}")
+
+        doc.add_paragraph(f"正确答案: {q.answer}")
+        doc.add_paragraph(f"解析: {q.analysis}")
+        doc.add_paragraph("") # Spacing
+    doc.save(path)
+
+
+def report_criteria(report: GradingReport) -> List[str]:
+    """Per-criterion columns: every criterion seen in any result, in first-seen order."""
+    return list(dict.fromkeys(c for r in report.results for c in (r.details or {})))
+
+
+def report_rows(report: GradingReport, criteria: List[str]):
+    """Header, then one row per student."""
+    yield ["学生姓名", "文件名", "总分", *criteria, "评语"]
+    for r in report.results:
+        details = r.details or {}
+        yield [r.student_name, r.filename, r.total_score, *(details.get(c, "") for c in criteria), r.feedback]
+
+
+def write_report_csv(report: GradingReport, path: str):
+    # utf-8-sig so Excel opens the Chinese headers correctly
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        csv.writer(f).writerows(report_rows(report, report_criteria(report)))
+
+
+def write_report_xlsx(report: GradingReport, path: str):
+    from openpyxl import Workbook
+    # write_only streams rows to disk instead of keeping a cell grid in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("成绩")
+    for row in report_rows(report, report_criteria(report)):
+        ws.append(row)
+    ws.append([])
+    ws.append(["平均分", "", report.average_score])
+    wb.save(path)
+
+
+def write_report_docx(report: GradingReport, path: str):
+    from docx import Document
+    doc = Document()
+    doc.add_heading("批改报告", 0)
+    doc.add_paragraph(f"学生人数: {len(report.results)}    平均分: {report.average_score}")
+
+    rows = list(report_rows(report, report_criteria(report)))
+    table = doc.add_table(rows=len(rows), cols=len(rows[0]))
+    table.style = "Table Grid"
+    for cells, row in zip(table.rows, rows):
+        for cell, value in zip(cells.cells, row):
+            cell.text = str(value)
+    doc.save(path)
+
+
+BUILDERS = {
+    ("quiz", "docx"): write_quiz_docx,
+    ("report", "csv"): write_report_csv,
+    ("report", "xlsx"): write_report_xlsx,
+    ("report", "docx"): write_report_docx,
+}
+
+
+class ExportService:
+    """DOCX/XLSX/CSV exports for quizzes and grading reports.
+
+    - Documents are built in a small worker pool, never on the event loop.
+    - Builders write straight to a file in EXPORT_CACHE_DIR, which is then
+      streamed from disk, so a large export is never held in a BytesIO copy.
+    - Files are keyed by a hash of (kind, format, payload): an identical export
+      is served from the cache, and concurrent identical requests share one build.
+      The least recently used files are evicted beyond EXPORT_CACHE_SIZE, except
+      those used in the last EXPORT_CACHE_GRACE seconds: a path export() has
+      returned must still exist when the FileResponse opens it.
+    """
+
+    def __init__(self, cache_dir: str = None, cache_size: int = None, workers: int = None, grace: float = None):
+        self.cache_dir = cache_dir or os.getenv("EXPORT_CACHE_DIR", "./export_cache")
+        self.cache_size = cache_size or int(os.getenv("EXPORT_CACHE_SIZE", "64"))
+        self.grace = grace if grace is not None else float(os.getenv("EXPORT_CACHE_GRACE", "60"))
+        self.workers = workers or int(os.getenv("EXPORT_WORKERS", "2"))
+        self.executor = None
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self.executor is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export")
+        return self.executor
+
+    @staticmethod
+    def cache_key(kind: str, fmt: str, payload) -> str:
+        # extracted_text is not exported, so it does not take part in the key
+        data = payload.model_dump_json(exclude={"results": {"__all__": {"extracted_text"}}}) if kind == "report" else payload.model_dump_json()
+        return hashlib.sha256(f"{kind}\x00{fmt}\x00{data}".encode("utf-8")).hexdigest()
+
+    def _build(self, kind: str, fmt: str, payload, path: str):
+        start = time.perf_counter()
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            BUILDERS[(kind, fmt)](payload, tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        print(f"Export {kind}.{fmt} built in {time.perf_counter() - start:.2f}s ({os.path.getsize(path)} bytes)")
+        self._evict()
+
+    def _evict(self):
+        try:
+            entries = [e for e in os.scandir(self.cache_dir) if e.is_file() and not e.name.endswith(".tmp")]
+        except OSError:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        recent = time.time() - self.grace
+        for entry in entries[self.cache_size:]:
+            if entry.stat().st_mtime >= recent:
+                continue # just built or served: a response may be about to stream it
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    async def export(self, kind: str, fmt: str, payload, filename: str) -> ExportFile:
+        """Build (or reuse) the export; raises ValueError for an unsupported format."""
+        if (kind, fmt) not in BUILDERS:
+            raise ValueError(f"Unsupported {kind} export format: {fmt}")
+        executor = self._get_executor()
+        key = self.cache_key(kind, fmt, payload)
+        path = os.path.join(self.cache_dir, f"{key}.{fmt}")
+        download_name = f"{filename}.{fmt}"
+
+        try:
+            os.utime(path) # LRU touch, and keeps it out of eviction for the grace period
+            self.hits += 1
+            return ExportFile(path, fmt, download_name, cached=True)
+        except FileNotFoundError:
+            pass
+
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is None:
+                self.misses += 1
+                future = loop.run_in_executor(executor, self._build, kind, fmt, payload, path)
+                self.inflight[key] = future
+                future.add_done_callback(lambda _: self.inflight.pop(key, None))
+            else:
+                self.hits += 1
+        await asyncio.shield(future)
+        return ExportFile(path, fmt, download_name)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "inflight": len(self.inflight),
+        }
+
+
+export_service = ExportService()
@@ -0,0 +1,174 @@
+import os
+import time
+import hashlib
+import codecs
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_UPLOAD_PAGES = int(os.getenv("MAX_UPLOAD_PAGES", "1000"))
+PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "16"))
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+
+class ExtractionError(ValueError):
+    """Upload rejected (too large, too many pages, unreadable)."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SpooledUpload:
+    """An upload copied to a temp file, so workers can read it by path and it never sits in RAM."""
+
+    def __init__(self, filename: str, path: str, size: int, content_hash: str = None):
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash # sha256 of the raw upload
+        self.timings = {}
+
+    def cleanup(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# --- Worker functions (run in the process pool; keep imports local and light) ---
+
+def count_pages(path: str) -> int:
+    import pypdf
+    return len(pypdf.PdfReader(path).pages)
+
+
+def extract_units(path: str, filename: str, start: int = 0, stop: Optional[int] = None) -> List[str]:
+    """Text of PDF pages [start, stop) or of every DOCX paragraph."""
+    if filename.endswith(".pdf"):
+        import pypdf
+        pdf_reader = pypdf.PdfReader(path)
+        return [page.extract_text() or "" for page in pdf_reader.pages[start:stop]]
+    import docx
+    doc = docx.Document(path)
+    return [para.text + "\n" for para in doc.paragraphs]
+
+
+class ExtractionService:
+    """Shared PDF/DOCX/TXT extraction for the KB upload and grading routers.
+
+    Uploads are spooled to disk with a size limit, then parsed in a process pool:
+    PDFs in page ranges (several ranges in flight), DOCX in one task, TXT read
+    incrementally in the calling thread. Blocks are yielded in document order.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self._pool = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: the server process already runs threads (embedding batcher,
+            # tokenizer loader, executors) whose held locks a forked child would inherit
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def spool(self, upload, max_bytes: int = None) -> SpooledUpload:
+        """Copy a FastAPI UploadFile to a temp file in 1 MB reads, enforcing the size limit."""
+        max_bytes = max_bytes or MAX_UPLOAD_BYTES
+        start = time.perf_counter()
+        suffix = os.path.splitext(upload.filename or "")[1]
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, prefix="upload_")
+        size = 0
+        digest = hashlib.sha256()
+        try:
+            with tmp:
+                while True:
+                    data = await upload.read(SPOOL_CHUNK_BYTES)
+                    if not data:
+                        break
+                    size += len(data)
+                    if size > max_bytes:
+                        raise ExtractionError(f"{upload.filename} exceeds the upload limit ({max_bytes} bytes)", status_code=413)
+                    digest.update(data)
+                    tmp.write(data)
+        except Exception:
+            os.remove(tmp.name)
+            raise
+        spooled = SpooledUpload(upload.filename, tmp.name, size, digest.hexdigest())
+        spooled.timings["spool_s"] = round(time.perf_counter() - start, 4)
+        return spooled
+
+    def iter_blocks(self, upload: SpooledUpload, max_chars: int = None) -> Iterator[str]:
+        """Blocking generator over pages/paragraphs; call from a worker thread.
+
+        Stops early once `max_chars` characters have been produced.
+        Time spent waiting on extraction is recorded in upload.timings["extract_s"].
+        """
+        waited = 0.0
+        produced = 0
+        filename = upload.filename
+        try:
+            if filename.endswith(".pdf"):
+                start = time.perf_counter()
+                pages = self.pool.submit(count_pages, upload.path).result()
+                waited += time.perf_counter() - start
+                if pages > MAX_UPLOAD_PAGES:
+                    raise ExtractionError(f"{filename} has {pages} pages (limit {MAX_UPLOAD_PAGES})", status_code=413)
+                upload.timings["pages"] = pages
+
+                ranges = deque((i, min(i + PAGES_PER_TASK, pages)) for i in range(0, pages, PAGES_PER_TASK))
+                in_flight = deque()
+                while ranges or in_flight:
+                    while ranges and len(in_flight) < self.workers:
+                        begin, end = ranges.popleft()
+                        in_flight.append(self.pool.submit(extract_units, upload.path, filename, begin, end))
+                    start = time.perf_counter()
+                    texts = in_flight.popleft().result()
+                    waited += time.perf_counter() - start
+                    for text in texts:
+                        yield text
+                        produced += len(text)
+                        if max_chars and produced >= max_chars:
+                            for future in in_flight:
+                                future.cancel()
+                            return
+            elif filename.endswith(".docx"):
+                start = time.perf_counter()
+                paragraphs = self.pool.submit(extract_units, upload.path, filename).result()
+                waited += time.perf_counter() - start
+                for text in paragraphs:
+                    yield text
+                    produced += len(text)
+                    if max_chars and produced >= max_chars:
+                        return
+            else:
+                decoder = codecs.getincrementaldecoder("utf-8")()
+                with open(upload.path, "rb") as f:
+                    while True:
+                        start = time.perf_counter()
+                        data = f.read(64 * 1024)
+                        text = decoder.decode(data, final=not data)
+                        waited += time.perf_counter() - start
+                        if text:
+                            yield text
+                            produced += len(text)
+                            if max_chars and produced >= max_chars:
+                                return
+                        if not data:
+                            break
+        finally:
+            upload.timings["extract_s"] = round(waited, 4)
+            upload.timings["chars"] = produced
+
+    def extract_text(self, upload: SpooledUpload, max_chars: int = None) -> str:
+        """Blocking; returns the (optionally truncated) text of the upload."""
+        text = "".join(self.iter_blocks(upload, max_chars))
+        return text[:max_chars] if max_chars else text
+
+
+extraction_service = ExtractionService()
@@ -0,0 +1,272 @@
+import os
+import json
+import uuid
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+from typing import Callable, List, Optional
+
+import openai
+from models.schemas import GradingResult, GradingReport
+from services.rag_service import rag_service
+from services.extraction import extraction_service, SpooledUpload
+from services.prompt_packer import prompt_packer
+from services.structured_output import structured_output
+from services.tracing import tracer
+from services.lazy import Lazy
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class GradingEngine:
+    """Grades a batch of uploaded essays.
+
+    Text extraction runs in the shared extraction process pool, LLM calls run
+    concurrently under a semaphore with retry/backoff on 429/5xx, and results
+    keep the input order.
+    """
+
+    def __init__(self, max_concurrency: int = None, max_retries: int = None, essay_tokens: int = None):
+        self.max_concurrency = max_concurrency or int(os.getenv("GRADING_CONCURRENCY", "8"))
+        # Only the head of each essay (this many tokens) reaches the prompt, so extraction stops early
+        self.essay_tokens = essay_tokens or int(os.getenv("GRADING_ESSAY_TOKENS", "2000"))
+        self.max_chars = self.essay_tokens * 4
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("GRADING_MAX_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("GRADING_BACKOFF_BASE", "1.0"))
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def extract(self, upload: SpooledUpload) -> str:
+        with tracer.span("extraction"):
+            return await rag_service.run_blocking(extraction_service.extract_text, upload, self.max_chars)
+
+    async def call_llm(self, messages: List[dict], agent: str = "grading", json_mode: bool = False) -> str:
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    return await rag_service.acomplete(messages, agent=agent, json_mode=json_mode)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff_base * (2 ** attempt) + random.uniform(0, self.backoff_base)
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                print(f"LLM call failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def grade_one(self, upload: SpooledUpload, build_prompt: Callable[[str], List[dict]]) -> GradingResult:
+        filename = upload.filename
+        try:
+            content = prompt_packer.truncate(await self.extract(upload), self.essay_tokens)
+            messages = build_prompt(content)
+            upload.timings["prompt_tokens"] = prompt_packer.measure(messages, record=False)["total"]
+
+            def parse(grade_data: dict) -> GradingResult:
+                # Ensure student name uses filename if not detected
+                if grade_data.get("student_name") in (None, "Unknown"):
+                    grade_data["student_name"] = filename
+                return GradingResult(**{**grade_data, "filename": filename, "extracted_text": content[:2000]})
+
+            start = time.perf_counter()
+            # JSON mode + schema validation; an invalid reply gets one repair call (same retry/backoff)
+            result, _ = await structured_output.generate(messages, parse, agent="grading", complete=self.call_llm)
+            upload.timings["llm_s"] = round(time.perf_counter() - start, 4)
+            return result
+        except Exception as e:
+            print(f"Error grading {filename}: {e}")
+            return GradingResult(
+                student_name=filename,
+                filename=filename,
+                total_score=0,
+                feedback=f"Error: {str(e)}",
+                details={}
+            )
+
+    async def grade_batch(self, uploads: List[SpooledUpload], build_prompt: Callable[[str], List[dict]], on_result: Callable = None) -> GradingReport:
+        async def run(index, upload):
+            try:
+                result = await self.grade_one(upload, build_prompt)
+            finally:
+                upload.cleanup()
+            if on_result:
+                on_result(index, result, upload.timings)
+            return result
+
+        # gather keeps input order regardless of completion order
+        results = await asyncio.gather(*(run(i, upload) for i, upload in enumerate(uploads)))
+        average = sum(r.total_score for r in results) / len(results) if results else 0
+        return GradingReport(results=list(results), average_score=average)
+
+
+class GradingJob:
+    def __init__(self, filenames: List[str], job_id: str = None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.status = "pending" # pending -> running -> done / failed
+        self.created_at = time.time()
+        self.finished_at = None
+        self.files = [{"filename": name, "status": "pending"} for name in filenames]
+        self.report: Optional[GradingReport] = None
+        self.error = None
+        self.task = None
+
+    def on_result(self, index: int, result: GradingResult, timings: dict):
+        self.files[index]["status"] = "error" if result.feedback.startswith("Error:") else "done"
+        self.files[index]["timings"] = timings
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": len(self.files),
+            "completed": sum(1 for f in self.files if f["status"] != "pending"),
+            "files": self.files,
+            "error": self.error,
+        }
+
+
+class GradingJobStore:
+    """Background grading jobs (submit / poll / fetch), persisted in SQLite.
+
+    A job runs as a task in the process that took the submit, but its progress
+    and report are written to GRADING_JOBS_DB, so with several server workers
+    any of them can answer the poll, result and export requests. Jobs whose
+    process is gone (restart/crash) are marked failed when a store opens.
+    """
+
+    def __init__(self, engine: GradingEngine, db_path: str = None, max_jobs: int = 200):
+        self.engine = engine
+        self.max_jobs = max_jobs
+        self.db_path = db_path or os.getenv("GRADING_JOBS_DB", "./grading_jobs.sqlite3")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS grading_jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL, -- pending -> running -> done / failed
+                pid INTEGER,
+                files TEXT NOT NULL,
+                report TEXT,
+                error TEXT,
+                created_at REAL,
+                finished_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_grading_jobs_finished ON grading_jobs(finished_at)")
+        self.conn.commit()
+        self._fail_orphans()
+        # asyncio only keeps weak references to tasks: running jobs are held here until they finish
+        self._tasks = set()
+
+    def _execute(self, sql: str, params=()):
+        with self.lock:
+            cur = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cur
+
+    def _fail_orphans(self):
+        # The uploads of a job live in its process: a job left running by a dead process cannot finish
+        rows = self._execute("SELECT id, pid FROM grading_jobs WHERE status IN ('pending', 'running')").fetchall()
+        for row in rows:
+            if row["pid"] != os.getpid() and not pid_alive(row["pid"]):
+                self._execute(
+                    "UPDATE grading_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                    ("Server restarted before the job finished", time.time(), row["id"])
+                )
+
+    def _save(self, job: GradingJob):
+        self._execute(
+            "UPDATE grading_jobs SET status = ?, files = ?, report = ?, error = ?, finished_at = ? WHERE id = ?",
+            (job.status, json.dumps(job.files, ensure_ascii=False),
+             job.report.model_dump_json() if job.report else None, job.error, job.finished_at, job.job_id)
+        )
+
+    def submit(self, uploads: List[SpooledUpload], build_prompt: Callable[[str], List[dict]]) -> GradingJob:
+        self._evict()
+        job = GradingJob([upload.filename for upload in uploads])
+        self._execute(
+            "INSERT INTO grading_jobs (id, status, pid, files, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job.job_id, job.status, os.getpid(), json.dumps(job.files, ensure_ascii=False), job.created_at)
+        )
+
+        def on_result(index: int, result: GradingResult, timings: dict):
+            job.on_result(index, result, timings)
+            self._save(job)
+
+        async def run():
+            job.status = "running"
+            self._save(job)
+            try:
+                job.report = await self.engine.grade_batch(uploads, build_prompt, on_result=on_result)
+                job.status = "done"
+            except Exception as e:
+                print(f"Grading Job {job.job_id} Error: {e}")
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                self._save(job)
+
+        job.task = asyncio.create_task(run())
+        self._tasks.add(job.task)
+        job.task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[GradingJob]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM grading_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = GradingJob([], job_id=row["id"])
+        job.status = row["status"]
+        job.files = json.loads(row["files"])
+        job.report = GradingReport.model_validate_json(row["report"]) if row["report"] else None
+        job.error = row["error"]
+        job.created_at = row["created_at"]
+        job.finished_at = row["finished_at"]
+        return job
+
+    def _evict(self):
+        # Drop the oldest finished jobs once the store is full
+        self._execute("""
+            DELETE FROM grading_jobs WHERE id IN (
+                SELECT id FROM grading_jobs WHERE finished_at IS NOT NULL
+                ORDER BY finished_at
+                LIMIT MAX(0, (SELECT COUNT(*) FROM grading_jobs) - ? + 1)
+            )
+        """, (self.max_jobs,))
+
+
+grading_engine = GradingEngine()
+grading_jobs = Lazy(lambda: GradingJobStore(grading_engine))
@@ -0,0 +1,200 @@
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import threading
+from typing import List, Optional
+
+from services.rag_service import rag_service
+from services.extraction import extraction_service, SpooledUpload
+from services.grading_service import pid_alive
+from services.lazy import Lazy
+
+
+class IngestJobQueue:
+    """Background KB ingestion jobs, persisted in SQLite so they survive restarts.
+
+    /api/kb/upload spools the file into INGEST_SPOOL_DIR and enqueues a job;
+    INGEST_WORKERS asyncio workers extract, chunk, embed and add it in batches.
+    A worker claims every pending job of one user at once and runs them back to
+    back, so one user's uploads never contend with each other for the embedding
+    model. Jobs left `running` by a crash are re-queued on start; chunk ids are
+    deterministic, so re-running a job overwrites rather than duplicates.
+    Re-uploading an identical file (same content hash) is skipped.
+    """
+
+    def __init__(self, db_path: str = None, spool_dir: str = None, workers: int = None):
+        self.db_path = db_path or os.getenv("INGEST_JOBS_DB", "./ingest_jobs.sqlite3")
+        self.spool_dir = spool_dir or os.getenv("INGEST_SPOOL_DIR", "./upload_spool")
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", "2"))
+        self.poll_interval = float(os.getenv("INGEST_POLL_INTERVAL", "1.0"))
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                path TEXT NOT NULL,
+                bytes INTEGER,
+                status TEXT NOT NULL, -- pending -> running -> done / failed
+                chunks INTEGER DEFAULT 0,
+                error TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                content_hash TEXT,
+                skipped INTEGER DEFAULT 0,
+                pid INTEGER -- process running the job
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(ingest_jobs)")}
+        for column, ddl in (("content_hash", "TEXT"), ("skipped", "INTEGER DEFAULT 0"), ("pid", "INTEGER")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {column} {ddl}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status, created_at)")
+        self.conn.commit()
+        self._requeue_orphans()
+
+        self._wakeup = None
+        self._tasks = []
+
+    def _execute(self, sql: str, params=()):
+        with self.lock:
+            cur = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cur
+
+    def _requeue_orphans(self):
+        rows = self._execute("SELECT id, pid FROM ingest_jobs WHERE status = 'running'").fetchall()
+        orphans = [(row["id"],) for row in rows if not pid_alive(row["pid"])]
+        if orphans:
+            with self.lock:
+                self.conn.executemany(
+                    "UPDATE ingest_jobs SET status = 'pending', chunks = 0, pid = NULL WHERE id = ? AND status = 'running'",
+                    orphans
+                )
+                self.conn.commit()
+
+    def enqueue(self, upload: SpooledUpload, user_id: str) -> str:
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.spool_dir, job_id + os.path.splitext(upload.filename)[1])
+        shutil.move(upload.path, path)
+        self._execute(
+            "INSERT INTO ingest_jobs (id, user_id, filename, path, bytes, status, created_at, content_hash) VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)",
+            (job_id, user_id, upload.filename, path, upload.size, time.time(), upload.content_hash)
+        )
+        if self._wakeup:
+            self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job.pop("path")
+        end = job["finished_at"] or time.time()
+        elapsed = end - job["started_at"] if job["started_at"] else 0
+        job["elapsed_s"] = round(elapsed, 3)
+        job["chunks_per_s"] = round(job["chunks"] / elapsed, 2) if elapsed else 0.0
+        return job
+
+    def _claim(self) -> List[sqlite3.Row]:
+        """Claim all pending jobs of the user with the oldest pending job (none running for that user)."""
+        with self.lock:
+            # Write lock up front: with several server workers, two processes must not claim the same jobs
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("""
+                SELECT user_id FROM ingest_jobs
+                WHERE status = 'pending'
+                  AND user_id NOT IN (SELECT user_id FROM ingest_jobs WHERE status = 'running')
+                ORDER BY created_at LIMIT 1
+            """).fetchone()
+            if not row:
+                self.conn.rollback()
+                return []
+            jobs = self.conn.execute(
+                "SELECT * FROM ingest_jobs WHERE status = 'pending' AND user_id = ? ORDER BY created_at",
+                (row["user_id"],)
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE ingest_jobs SET status = 'running', pid = ? WHERE id = ?",
+                [(os.getpid(), job["id"]) for job in jobs]
+            )
+            self.conn.commit()
+            return jobs
+
+    async def _run_job(self, job):
+        upload = SpooledUpload(job["filename"], job["path"], job["bytes"], job["content_hash"])
+        self._execute("UPDATE ingest_jobs SET started_at = ? WHERE id = ?", (time.time(), job["id"]))
+
+        # Identical re-upload: nothing to extract or embed
+        if rag_service.document_unchanged(job["user_id"], job["filename"], job["content_hash"]):
+            existing = rag_service.catalog.get(job["user_id"], job["filename"])
+            self._execute(
+                "UPDATE ingest_jobs SET status = 'done', skipped = 1, chunks = ?, finished_at = ? WHERE id = ?",
+                (existing["chunks"], time.time(), job["id"])
+            )
+            upload.cleanup()
+            return
+
+        def on_progress(chunks: int):
+            self._execute("UPDATE ingest_jobs SET chunks = ? WHERE id = ?", (chunks, job["id"]))
+
+        try:
+            chunks = await rag_service.aadd_document(
+                extraction_service.iter_blocks(upload), job["filename"], job["user_id"],
+                on_progress=on_progress, content_hash=job["content_hash"]
+            )
+            if not chunks:
+                raise ValueError("File is empty or could not be read")
+            self._execute(
+                "UPDATE ingest_jobs SET status = 'done', chunks = ?, finished_at = ? WHERE id = ?",
+                (chunks, time.time(), job["id"])
+            )
+        except Exception as e:
+            print(f"KB Ingest Job {job['id']} Error: {e}")
+            self._execute(
+                "UPDATE ingest_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (str(e), time.time(), job["id"])
+            )
+        finally:
+            upload.cleanup()
+
+    async def _worker(self):
+        while True:
+            jobs = await asyncio.to_thread(self._claim)
+            if not jobs:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for job in jobs:
+                await self._run_job(job)
+
+    def start(self):
+        """Start the worker tasks on the running event loop (call from app startup)."""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+# Opened on first use (the app lifespan starts it) rather than at import
+ingest_jobs = Lazy(IngestJobQueue)
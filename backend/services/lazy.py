@@ -0,0 +1,37 @@
+import threading
+
+
+class Lazy:
+    """Module-level singleton that is only constructed on first use.
+
+    `service = Lazy(Factory)` can be imported anywhere for free; the first
+    attribute access (or `service.instance()`) calls the factory once, and
+    every attribute read/write after that goes to the real object. Services
+    that open Chroma or SQLite files use it so that importing a router does
+    not touch the disk before the app lifespan (or a script) asks for them.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def instance(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    object.__setattr__(self, "_instance", self._factory())
+        return self._instance
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.instance(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self.instance(), name)
@@ -0,0 +1,328 @@
+import os
+import re
+import json
+import math
+import uuid
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import jieba
+except ImportError: # optional dependency
+    jieba = None
+
+ASCII_WORD = re.compile(r"[a-z0-9]+")
+CJK_RUN = re.compile(r"[一-鿿]+")
+# Compaction needs at least this many tombstones, so small indexes are not rebuilt on every delete
+COMPACT_MIN_TOMBSTONES = 1000
+
+
+def tokenize(text: str, mode: str = "bigram") -> List[str]:
+    """Tokenize Chinese text for lexical matching.
+
+    - "bigram" (default): overlapping CJK character bigrams plus lowercase ASCII words.
+      Needs no dictionary, so theory and author names ("沉默的螺旋", "麦库姆斯") match verbatim.
+    - "jieba": jieba search-mode segmentation, when jieba is installed.
+    """
+    text = (text or "").lower()
+    if mode == "jieba" and jieba is not None:
+        return [t for t in jieba.lcut_for_search(text) if t.strip() and (len(t) > 1 or CJK_RUN.match(t))]
+
+    tokens = ASCII_WORD.findall(text)
+    for run in CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 inverted index kept next to the Chroma collection.
+
+    Per-document term counts are persisted in SQLite (one row per chunk, so
+    adds and deletes are incremental); postings are rebuilt in memory on load as
+    compact arrays and scored with numpy. Deleted and replaced chunks are
+    tombstoned; once tombstones exceed LEXICAL_COMPACT_RATIO of the arrays they
+    are compacted away (a load or clear() starts from a compact index anyway).
+
+    Every add/delete is also appended to a change log, so several processes
+    (server workers, ingest.py) can share one index file: before a search, a
+    process whose SQLite connection saw another writer's commit applies the
+    logged changes since its last sync. A clear() bumps a generation number
+    and makes the other processes reload.
+    """
+
+    def __init__(self, path: str, tokenizer: str = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.tokenizer = tokenizer or os.getenv("LEXICAL_TOKENIZER", "bigram")
+        if self.tokenizer == "jieba" and jieba is None:
+            print("Warning: jieba is not installed, falling back to bigram tokenization.")
+            self.tokenizer = "bigram"
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = float(os.getenv("LEXICAL_COMPACT_RATIO", "0.25"))
+        self.compact_min = COMPACT_MIN_TOMBSTONES
+        self.lock = threading.RLock()
+
+        self.doc_ids: List[str] = [] # internal int -> chunk id
+        self.doc_index: Dict[str, int] = {} # chunk id -> internal int
+        self.doc_len = array("f")
+        self.doc_owner = array("i")
+        self.alive = array("b")
+        self.owner_codes: Dict[str, int] = {}
+        self.postings: Dict[str, tuple] = {} # term -> (array('i') docs, array('f') tfs)
+        self.total_len = 0.0
+        self.live_docs = 0
+
+        # Cross-process sync state: this instance's writer id, last applied log seq, index generation
+        self.writer = uuid.uuid4().hex
+        self.log_size = int(os.getenv("LEXICAL_LOG_SIZE", "100000"))
+        self.seq = 0
+        self.generation = "0"
+        self.data_version = None
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS lexical_docs (
+                id TEXT PRIMARY KEY,
+                owner_id TEXT,
+                length INTEGER,
+                terms TEXT
+            )
+        """)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS lexical_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS lexical_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                doc_id TEXT,
+                writer TEXT
+            )
+        """)
+        self.conn.commit()
+        self._check_tokenizer()
+        self._load()
+
+    def _check_tokenizer(self):
+        row = self.conn.execute("SELECT value FROM lexical_meta WHERE key = 'tokenizer'").fetchone()
+        if row and row[0] != self.tokenizer:
+            # Stored term counts came from another tokenizer: they are useless, start over
+            print(f"Lexical index tokenizer changed ({row[0]} -> {self.tokenizer}); index cleared, re-run ingest.")
+            self.conn.execute("DELETE FROM lexical_docs")
+            self._bump_generation()
+        self.conn.execute("INSERT OR REPLACE INTO lexical_meta VALUES ('tokenizer', ?)", (self.tokenizer,))
+        self.conn.commit()
+
+    def _reset(self):
+        self.doc_ids = []
+        self.doc_index = {}
+        self.doc_len = array("f")
+        self.doc_owner = array("i")
+        self.alive = array("b")
+        self.owner_codes = {}
+        self.postings = {}
+        self.total_len = 0.0
+        self.live_docs = 0
+
+    def _load(self):
+        self._reset()
+        # One read transaction: the documents and the log position come from the same snapshot
+        self.conn.execute("BEGIN")
+        try:
+            row = self.conn.execute("SELECT value FROM lexical_meta WHERE key = 'generation'").fetchone()
+            self.generation = row[0] if row else "0"
+            self.seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM lexical_changes").fetchone()[0]
+            for doc_id, owner_id, length, terms in self.conn.execute("SELECT id, owner_id, length, terms FROM lexical_docs"):
+                self._index(doc_id, owner_id, length, json.loads(terms))
+        finally:
+            self.conn.commit()
+        self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _bump_generation(self):
+        self.generation = uuid.uuid4().hex
+        self.conn.execute("INSERT OR REPLACE INTO lexical_meta VALUES ('generation', ?)", (self.generation,))
+        self.conn.execute("DELETE FROM lexical_changes")
+
+    def _log(self, ids: List[str]):
+        self.conn.executemany("INSERT INTO lexical_changes (doc_id, writer) VALUES (?, ?)", [(i, self.writer) for i in ids])
+        self.conn.execute("DELETE FROM lexical_changes WHERE seq <= (SELECT MAX(seq) FROM lexical_changes) - ?", (self.log_size,))
+
+    def sync(self):
+        """Apply the changes other processes committed since the last sync."""
+        with self.lock:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self.data_version:
+                return
+            self.data_version = version
+            row = self.conn.execute("SELECT value FROM lexical_meta WHERE key = 'generation'").fetchone()
+            oldest = self.conn.execute("SELECT MIN(seq) FROM lexical_changes").fetchone()[0]
+            if (row[0] if row else "0") != self.generation or (oldest is not None and oldest > self.seq + 1):
+                # Cleared, or the log was trimmed past our position: reload everything
+                self._load()
+                return
+            changes = self.conn.execute(
+                "SELECT seq, doc_id, writer FROM lexical_changes WHERE seq > ? ORDER BY seq", (self.seq,)
+            ).fetchall()
+            if not changes:
+                return
+            self.seq = changes[-1][0]
+            changed = list(dict.fromkeys(doc_id for _, doc_id, writer in changes if writer != self.writer))
+            for i in range(0, len(changed), 500):
+                batch = changed[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                found = set()
+                for doc_id, owner_id, length, terms in self.conn.execute(
+                    f"SELECT id, owner_id, length, terms FROM lexical_docs WHERE id IN ({placeholders})", batch
+                ):
+                    self._index(doc_id, owner_id, length, json.loads(terms))
+                    found.add(doc_id)
+                for doc_id in batch:
+                    if doc_id not in found:
+                        self._tombstone(doc_id)
+            self._maybe_compact()
+
+    def _owner_code(self, owner_id: str) -> int:
+        if owner_id not in self.owner_codes:
+            self.owner_codes[owner_id] = len(self.owner_codes)
+        return self.owner_codes[owner_id]
+
+    def _index(self, doc_id: str, owner_id: str, length: int, terms: Dict[str, int]):
+        self._tombstone(doc_id)
+        n = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.doc_index[doc_id] = n
+        self.doc_len.append(length)
+        self.doc_owner.append(self._owner_code(owner_id))
+        self.alive.append(1)
+        self.total_len += length
+        self.live_docs += 1
+        for term, tf in terms.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array("i"), array("f"))
+            entry[0].append(n)
+            entry[1].append(tf)
+
+    def _tombstone(self, doc_id: str):
+        n = self.doc_index.pop(doc_id, None)
+        if n is not None and self.alive[n]:
+            self.alive[n] = 0
+            self.total_len -= self.doc_len[n]
+            self.live_docs -= 1
+
+    def _maybe_compact(self):
+        dead = len(self.doc_ids) - self.live_docs
+        if dead >= self.compact_min and dead > self.compact_ratio * len(self.doc_ids):
+            self.compact()
+
+    def compact(self):
+        """Drop tombstoned documents from the in-memory arrays and postings (renumbers live docs)."""
+        with self.lock:
+            size = len(self.doc_ids)
+            alive = np.frombuffer(self.alive, dtype=np.int8, count=size).astype(bool)
+            remap = np.cumsum(alive, dtype=np.int32) - 1
+
+            def packed(typecode: str, values: np.ndarray) -> array:
+                out = array(typecode)
+                out.frombytes(values.tobytes())
+                return out
+
+            self.doc_ids = [doc_id for doc_id, keep in zip(self.doc_ids, alive) if keep]
+            self.doc_index = {doc_id: n for n, doc_id in enumerate(self.doc_ids)}
+            self.doc_len = packed("f", np.frombuffer(self.doc_len, dtype=np.float32, count=size)[alive])
+            self.doc_owner = packed("i", np.frombuffer(self.doc_owner, dtype=np.int32, count=size)[alive])
+            self.alive = array("b", [1]) * len(self.doc_ids)
+            postings = {}
+            for term, (docs, tfs) in self.postings.items():
+                docs = np.frombuffer(docs, dtype=np.int32)
+                keep = alive[docs]
+                if keep.any():
+                    postings[term] = (packed("i", remap[docs[keep]]), packed("f", np.frombuffer(tfs, dtype=np.float32)[keep]))
+            self.postings = postings
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[dict]):
+        rows = []
+        with self.lock:
+            for doc_id, text, meta in zip(ids, documents, metadatas):
+                tokens = tokenize(text, self.tokenizer)
+                terms = dict(Counter(tokens))
+                owner_id = (meta or {}).get("owner_id", "system")
+                self._index(doc_id, owner_id, len(tokens), terms)
+                rows.append((doc_id, owner_id, len(tokens), json.dumps(terms, ensure_ascii=False)))
+            self.conn.executemany("INSERT OR REPLACE INTO lexical_docs VALUES (?, ?, ?, ?)", rows)
+            self._log(ids)
+            self.conn.commit()
+            self._maybe_compact()
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            for doc_id in ids:
+                self._tombstone(doc_id)
+            self.conn.executemany("DELETE FROM lexical_docs WHERE id = ?", [(i,) for i in ids])
+            self._log(ids)
+            self.conn.commit()
+            self._maybe_compact()
+
+    def clear(self):
+        with self.lock:
+            self._reset()
+            self.conn.execute("DELETE FROM lexical_docs")
+            self._bump_generation()
+            self.conn.commit()
+
+    def search(self, query: str, n_results: int = 10, owners: Optional[List[str]] = None) -> List[str]:
+        """Return up to n_results chunk ids by BM25 score, restricted to `owners` (None = all)."""
+        self.sync()
+        with self.lock:
+            if not self.live_docs:
+                return []
+            terms = set(tokenize(query, self.tokenizer))
+            size = len(self.doc_ids)
+            doc_len = np.frombuffer(self.doc_len, dtype=np.float32, count=size)
+            avgdl = self.total_len / self.live_docs or 1.0
+            scores = np.zeros(size, dtype=np.float32)
+            mask = np.frombuffer(self.alive, dtype=np.int8, count=size).astype(bool)
+            for term in terms:
+                entry = self.postings.get(term)
+                if not entry:
+                    continue
+                docs = np.frombuffer(entry[0], dtype=np.int32)
+                tfs = np.frombuffer(entry[1], dtype=np.float32)
+                # Tombstoned postings do not count towards the document frequency
+                df = int(np.count_nonzero(mask[docs]))
+                if not df:
+                    continue
+                idf = math.log(1 + (self.live_docs - df + 0.5) / (df + 0.5))
+                norm = tfs + self.k1 * (1 - self.b + self.b * doc_len[docs] / avgdl)
+                scores[docs] += idf * tfs * (self.k1 + 1) / norm
+
+            if owners is not None:
+                codes = [self.owner_codes[o] for o in owners if o in self.owner_codes]
+                mask &= np.isin(np.frombuffer(self.doc_owner, dtype=np.int32, count=size), codes)
+            scores[~mask] = 0
+
+            candidates = np.flatnonzero(scores)
+            if not len(candidates):
+                return []
+            if len(candidates) > n_results:
+                candidates = candidates[np.argpartition(-scores[candidates], n_results - 1)[:n_results]]
+            ordered = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [self.doc_ids[i] for i in ordered]
+
+    def __len__(self):
+        return self.live_docs
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Merge ranked id lists: score(d) = sum(1 / (k + rank)). Ties keep first-seen order."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda d: -scores[d])
@@ -0,0 +1,55 @@
+import threading
+
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens served from the provider's prefix cache.
+
+    DeepSeek reports `prompt_cache_hit_tokens`; OpenAI-style providers report
+    `prompt_tokens_details.cached_tokens`.
+    """
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        hit = getattr(details, "cached_tokens", None) if details is not None else None
+    return int(hit or 0)
+
+
+class LLMUsage:
+    """Provider-reported token usage per agent (chat, quiz, rubric, grading...).
+
+    The prefix-cache hit rate (cached / prompt tokens) shows whether the static
+    persona/rubric prefix is actually being reused across requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.agents = {}
+
+    def record(self, agent: str, usage):
+        if usage is None:
+            return
+        with self.lock:
+            entry = self.agents.setdefault(agent, {
+                "requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+            })
+            entry["requests"] += 1
+            entry["prompt_tokens"] += usage.prompt_tokens or 0
+            entry["cached_tokens"] += cached_tokens(usage)
+            entry["completion_tokens"] += usage.completion_tokens or 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            agents = {name: dict(entry) for name, entry in self.agents.items()}
+        for entry in agents.values():
+            entry["cache_hit_rate"] = round(entry["cached_tokens"] / entry["prompt_tokens"], 4) if entry["prompt_tokens"] else 0.0
+        prompt = sum(e["prompt_tokens"] for e in agents.values())
+        cached = sum(e["cached_tokens"] for e in agents.values())
+        return {
+            "prompt_tokens": prompt,
+            "cached_tokens": cached,
+            "cache_hit_rate": round(cached / prompt, 4) if prompt else 0.0,
+            "agents": agents,
+        }
+
+
+llm_usage = LLMUsage()
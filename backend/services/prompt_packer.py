@@ -0,0 +1,218 @@
+import os
+import threading
+from typing import Callable, List, Optional
+
+from services.chunker import TOKEN, count_tokens, split_sentences, join_text, simhash
+from services.embedding_service import Histogram
+
+DEFAULT_TOKENIZER = "deepseek-ai/DeepSeek-V3"
+MESSAGE_OVERHEAD = 4 # role markers / separators the chat template adds per message
+
+
+def estimated_prefix(text: str, budget: int) -> int:
+    """Length of the longest prefix of `text` within `budget` estimated tokens."""
+    for i, match in enumerate(TOKEN.finditer(text)):
+        if i == budget:
+            return match.start()
+    return len(text)
+
+
+def load_token_counter(name: str):
+    """(count, prefix) functions for the LLM's tokenizer.
+
+    `count(text)` is the number of tokens; `prefix(text, budget)` is the length
+    of the longest prefix within `budget` tokens, read from the token offsets of
+    a single encode. `name` is a Hugging Face tokenizer repo or a local
+    tokenizer.json; empty (or unavailable) falls back to the chunker's estimate
+    (one token per CJK character / ASCII word / punctuation mark).
+    """
+    if not name:
+        return count_tokens, estimated_prefix
+    try:
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_file(name) if os.path.exists(name) else Tokenizer.from_pretrained(name)
+
+        def prefix(text: str, budget: int) -> int:
+            offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+            if len(offsets) <= budget:
+                return len(text)
+            # Cut where the first token over budget starts
+            return offsets[budget][0] if budget > 0 else 0
+
+        return (lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)), prefix
+    except Exception as e:
+        print(f"Warning: tokenizer {name} unavailable ({e}), falling back to estimated token counts.")
+        return count_tokens, estimated_prefix
+
+
+class PackedPrompt:
+    def __init__(self, context: str, context_ids: List[str], sources: List[str], history: List[dict], tokens: dict):
+        self.context = context
+        self.context_ids = context_ids
+        self.sources = sources
+        self.history = history
+        self.tokens = tokens # per-part token counts, "total" = tokens sent
+
+
+class PromptPacker:
+    """Fits retrieved chunks and chat history into token budgets.
+
+    - Chunks: sentences already present in a higher-ranked chunk (the chunker's
+      overlap) are removed and near-duplicate chunks (SimHash) dropped; chunks
+      are then packed in rank order until PROMPT_CONTEXT_TOKENS, the last one
+      truncated to fit.
+    - History: the newest messages that fit PROMPT_HISTORY_TOKENS are kept;
+      a single over-long message is truncated.
+    - Packed chunks are emitted in a stable (source, id) order, so the same
+      retrieved set always yields byte-identical context and a reusable prompt
+      prefix at the provider.
+    Token counts use the LLM's tokenizer (PROMPT_TOKENIZER) once it has loaded.
+    """
+
+    def __init__(self, context_budget: int = None, history_budget: int = None, history_messages: int = None,
+                 tokenizer: str = None, dedup_distance: int = 3):
+        self.context_budget = context_budget or int(os.getenv("PROMPT_CONTEXT_TOKENS", "1500"))
+        self.history_budget = history_budget if history_budget is not None else int(os.getenv("PROMPT_HISTORY_TOKENS", "800"))
+        self.history_messages = history_messages or int(os.getenv("PROMPT_HISTORY_MESSAGES", "4"))
+        self.stable_order = os.getenv("PROMPT_CONTEXT_ORDER", "stable") == "stable"
+        self.tokenizer_name = tokenizer if tokenizer is not None else os.getenv("PROMPT_TOKENIZER", DEFAULT_TOKENIZER)
+        self.dedup_distance = dedup_distance
+
+        self._counter = None
+        self._prefix = None
+        self._loader = None
+        self._counter_lock = threading.Lock()
+        self.requests = 0
+        self.dropped_chunks = 0
+        self.trimmed_messages = 0
+        self.tokens_sent = Histogram([250, 500, 1000, 2000, 4000, 8000, 16000])
+
+    @property
+    def counter(self) -> Callable[[str], int]:
+        # The tokenizer may need a download: load it in the background and
+        # estimate until it is ready, so no request ever waits on it
+        if self._counter is None:
+            self.load(wait=False)
+            return count_tokens
+        return self._counter
+
+    def load(self, wait: bool = True):
+        with self._counter_lock:
+            if self._loader is None:
+                self._loader = threading.Thread(target=self._load_counter, name="tokenizer-loader", daemon=True)
+                self._loader.start()
+        if wait:
+            self._loader.join()
+
+    def _load_counter(self):
+        counter, prefix = load_token_counter(self.tokenizer_name)
+        self._prefix = prefix # set before the counter: truncate() checks the counter
+        self._counter = counter
+
+    def count(self, text: str) -> int:
+        return self.counter(text) if text else 0
+
+    def truncate(self, text: str, budget: int) -> str:
+        """Longest prefix of `text` within `budget` tokens (one tokenizer pass)."""
+        if not text:
+            return text
+        prefix = self._prefix if self._counter is not None else estimated_prefix
+        return text[:prefix(text, max(budget, 0))]
+
+    def dedup(self, documents: List[str]) -> List[Optional[str]]:
+        """Strip sentences seen in earlier chunks; None for chunks with nothing new."""
+        seen_sentences, seen_hashes, out = set(), [], []
+        for doc in documents:
+            fingerprint = simhash(doc)
+            if any((fingerprint ^ other).bit_count() <= self.dedup_distance for other in seen_hashes):
+                out.append(None)
+                continue
+            seen_hashes.append(fingerprint)
+            sentences = split_sentences(doc)
+            fresh = [s for s in sentences if s not in seen_sentences]
+            seen_sentences.update(sentences)
+            if not fresh:
+                out.append(None)
+            elif len(fresh) == len(sentences):
+                out.append(doc)
+            else:
+                out.append(join_text(fresh))
+        return out
+
+    def pack_context(self, results: Optional[dict], budget: int = None):
+        """retrieve() result -> (context_str, context_ids, sources)."""
+        if not results or not results.get('ids') or not results['ids'][0]:
+            return "", [], []
+        budget = budget or self.context_budget
+        ids, documents, metadatas = results['ids'][0], results['documents'][0], results['metadatas'][0]
+
+        packed, used = [], 0
+        for rank, (doc_id, doc, meta) in enumerate(zip(ids, self.dedup(documents), metadatas)):
+            if doc is None:
+                self.dropped_chunks += 1
+                continue
+            source_name = (meta or {}).get('source', 'Unknown')
+            part = f"Source ({source_name}):\n{doc}"
+            n = self.count(part)
+            if used + n > budget:
+                remaining = budget - used
+                if remaining < 50: # not worth a fragment
+                    self.dropped_chunks += len(ids) - rank
+                    break
+                part, n = self.truncate(part, remaining), remaining
+            packed.append((source_name, doc_id, rank, part))
+            used += n
+
+        sources = list(dict.fromkeys(p[0] for p in packed)) # rank order
+        if self.stable_order:
+            packed.sort(key=lambda p: (p[0], p[1]))
+        return "\n\n".join(p[3] for p in packed), [p[1] for p in packed], sources
+
+    def trim_history(self, history: Optional[List[dict]], budget: int = None) -> List[dict]:
+        budget = self.history_budget if budget is None else budget
+        recent = list(history or [])[-self.history_messages:]
+        kept, used = [], 0
+        for msg in reversed(recent):
+            content = msg.get("content") or ""
+            n = self.count(content) + MESSAGE_OVERHEAD
+            if used + n > budget:
+                remaining = budget - used - MESSAGE_OVERHEAD
+                if not kept and remaining > 0:
+                    # The latest message alone is over budget: keep its head
+                    kept.append({**msg, "content": self.truncate(content, remaining)})
+                break
+            kept.append(msg)
+            used += n
+        self.trimmed_messages += len(history or []) - len(kept)
+        return list(reversed(kept))
+
+    def measure(self, messages: List[dict], record: bool = True) -> dict:
+        """Token counts of an assembled message list; `record` adds it to the tokens-sent stats."""
+        tokens = {"system": 0, "history": 0, "user": 0}
+        for i, msg in enumerate(messages):
+            n = self.count(msg.get("content") or "") + MESSAGE_OVERHEAD
+            if msg["role"] == "system":
+                tokens["system"] += n
+            elif i == len(messages) - 1:
+                tokens["user"] += n
+            else:
+                tokens["history"] += n
+        tokens["total"] = sum(tokens.values())
+        if record:
+            self.requests += 1
+            self.tokens_sent.observe(tokens["total"])
+        return tokens
+
+    def stats(self) -> dict:
+        return {
+            "tokenizer": self.tokenizer_name or "estimate",
+            "context_budget": self.context_budget,
+            "history_budget": self.history_budget,
+            "requests": self.requests,
+            "dropped_chunks": self.dropped_chunks,
+            "trimmed_messages": self.trimmed_messages,
+            "tokens_sent": self.tokens_sent.snapshot(),
+        }
+
+
+prompt_packer = PromptPacker()
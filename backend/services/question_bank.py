@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from models.schemas import QuizQuestion
+from services.rag_service import rag_service, split_topics
+from services.lazy import Lazy
+
+# Instruction phrases stripped from a quiz request before matching it to a topic.
+# Single characters (出, 做, 题, 各, 几, 难) only count as part of a phrase such as
+# 出5道题, so topics like 出版, 新闻问题 or 灾难新闻 are kept whole
+QUESTION_NOUNS = r"单项选择题|单选题|多选题|选择题|判断题|填空题|简答题|练习题|测验题|测试题|试题|习题|题目|测验|测试"
+INSTRUCTION_WORDS = re.compile(
+    r"(?:^|(?<=[\s，,。；;：:]))(?:请|麻烦)|帮我|给我|为我|我想要?|我需要|生成|练习|一些|一下|"
+    rf"(?:各\s*)?(?:出|来|做)?\s*(?:[0-9]+|[一二三四五六七八九十两]+|几)\s*[道个]\s*(?:{QUESTION_NOUNS}|题)?|"
+    rf"(?:出|做)\s*(?:{QUESTION_NOUNS}|题)|{QUESTION_NOUNS}|(?:^|(?<=[\s的道个些]))题(?=$|[\s，,。；;？?！!])|"
+    r"关于|有关|涵盖|覆盖|包括|包含|涉及|分别|吧(?=$|[\s，,。；;？?！!])|[。，？?：:；;]"
+)
+COUNT = re.compile(r"([0-9]+|[一二三四五六七八九十两])\s*[道个]")
+CHINESE_DIGITS = {"一": 1, "两": 2, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+# Difficulty words count only as standalone words ("出3道难题", "难度：简单"), not
+# inside a topic ("灾难新闻", "理论基础")
+_BEFORE = r"(?:^|(?<=[\s，,。；;：:道个些出是为要较偏]))"
+_AFTER = r"(?=$|[\s，,。；;？?！!的题点些])"
+DIFFICULTY_WORDS = [
+    ("hard", re.compile(rf"难度(?:为|是|[：:])?\s*(?:较|偏|比较)?高|{_BEFORE}(?:困难|较难|偏难|难)(?:一点|一些)?{_AFTER}")),
+    ("easy", re.compile(rf"难度(?:为|是|[：:])?\s*(?:较|偏|比较)?低|{_BEFORE}(?:简单|容易|基础)(?:一点|一些)?{_AFTER}")),
+    ("medium", re.compile(rf"中等难度|难度(?:为|是|[：:])?\s*(?:中等|适中)|{_BEFORE}(?:中等|适中){_AFTER}")),
+]
+DIFFICULTY_PREFIX = re.compile(r"难度(?:为|是|[：:])?")
+
+
+def quiz_difficulty(query: str) -> Optional[str]:
+    return next((level for level, pattern in DIFFICULTY_WORDS if pattern.search(query)), None)
+
+
+def strip_instructions(text: str) -> str:
+    """Remove difficulty and instruction phrases, leaving the topic words."""
+    for _, pattern in DIFFICULTY_WORDS:
+        text = pattern.sub(" ", text)
+    text = INSTRUCTION_WORDS.sub(" ", DIFFICULTY_PREFIX.sub(" ", text))
+    return re.sub(r"\s+", " ", text).strip(" 的")
+
+
+def parse_quiz_request(query: str, default_count: int = 1, max_count: int = 5):
+    """Quiz instruction -> (topic_text, count, difficulty or None)."""
+    match = COUNT.search(query)
+    count = default_count
+    if match:
+        raw = match.group(1)
+        count = int(raw) if raw.isdigit() else CHINESE_DIGITS[raw]
+    topic = strip_instructions(query) or query
+    return topic, max(1, min(count, max_count)), quiz_difficulty(query)
+
+
+def quiz_topics(query: str) -> List[str]:
+    """Sub-topics listed in a quiz instruction, instruction words removed (may be empty)."""
+    topics = [strip_instructions(part) for part in split_topics(query)]
+    return list(dict.fromkeys(t for t in topics if len(t) >= 2))
+
+
+class QuestionBank:
+    """Pre-generated, validated quiz questions indexed by topic embedding and difficulty.
+
+    Filled offline by build_question_bank.py from the system chunks of the
+    knowledge base. Topic label embeddings are kept in memory as one normalized
+    matrix, so serving is a matrix-vector product plus an indexed SQLite query.
+    Questions already served to a user are not served to them again.
+    """
+
+    def __init__(self, path: str, min_similarity: float = None):
+        self.min_similarity = min_similarity if min_similarity is not None else float(os.getenv("QUESTION_BANK_MIN_SIMILARITY", "0.75"))
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS bank_topics (
+                id INTEGER PRIMARY KEY,
+                topic TEXT UNIQUE NOT NULL,
+                embedding BLOB NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS bank_questions (
+                id TEXT PRIMARY KEY,
+                topic_id INTEGER NOT NULL,
+                chunk_id TEXT,
+                chunk_hash TEXT,
+                source TEXT,
+                difficulty TEXT,
+                data TEXT NOT NULL,
+                created_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_bank_questions_topic ON bank_questions(topic_id, difficulty)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_bank_questions_chunk ON bank_questions(chunk_id)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS bank_chunks (
+                chunk_id TEXT PRIMARY KEY,
+                chunk_hash TEXT
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS bank_served (
+                user_id TEXT NOT NULL,
+                question_id TEXT NOT NULL,
+                served_at REAL,
+                PRIMARY KEY (user_id, question_id)
+            )
+        """)
+        self.conn.commit()
+
+        self.topic_ids: List[int] = []
+        self.matrix = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        rows = self.conn.execute("SELECT id, embedding FROM bank_topics ORDER BY id").fetchall()
+        self.topic_ids = [r["id"] for r in rows]
+        self.matrix = np.vstack([np.frombuffer(r["embedding"], dtype=np.float32) for r in rows]) if rows else None
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def clear(self):
+        with self.lock:
+            for table in ("bank_topics", "bank_questions", "bank_chunks", "bank_served"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self.conn.commit()
+            self._load()
+
+    def has_chunk(self, chunk_id: str, chunk_hash: str) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM bank_chunks WHERE chunk_id = ? AND chunk_hash IS ?", (chunk_id, chunk_hash)
+            ).fetchone()
+        return bool(row)
+
+    def add(self, topic: str, topic_embedding: List[float], questions: List[QuizQuestion],
+            chunk_id: str = None, chunk_hash: str = None, source: str = None) -> int:
+        """Store questions for a topic (replacing earlier ones generated from the same chunk)."""
+        embedding = self._normalize(topic_embedding)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT id FROM bank_topics WHERE topic = ?", (topic,)).fetchone()
+            if row:
+                topic_id = row["id"]
+            else:
+                topic_id = self.conn.execute(
+                    "INSERT INTO bank_topics (topic, embedding) VALUES (?, ?)", (topic, embedding.tobytes())
+                ).lastrowid
+            if chunk_id:
+                self.conn.execute("DELETE FROM bank_questions WHERE chunk_id = ?", (chunk_id,))
+                self.conn.execute("INSERT OR REPLACE INTO bank_chunks VALUES (?, ?)", (chunk_id, chunk_hash))
+            rows = []
+            for q in questions:
+                data = q.model_dump()
+                question_id = hashlib.sha1(f"{q.stem}\x00{json.dumps(q.options, ensure_ascii=False)}".encode("utf-8")).hexdigest()
+                rows.append((question_id, topic_id, chunk_id, chunk_hash, source, q.difficulty, json.dumps(data, ensure_ascii=False), now))
+            # Identical questions from another chunk are kept once
+            added = self.conn.executemany("INSERT OR IGNORE INTO bank_questions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows).rowcount
+            self.conn.commit()
+            if not row:
+                # New objects rather than in-place updates: serve() may hold the previous pair
+                self.topic_ids = self.topic_ids + [topic_id]
+                self.matrix = embedding[None, :] if self.matrix is None else np.vstack([self.matrix, embedding])
+        return added
+
+    def serve(self, user_id: Optional[str], query_embedding: List[float], count: int,
+              difficulty: str = None, max_topics: int = 5):
+        """Up to `count` unseen questions on the nearest topics, or None if the bank cannot fill the request.
+
+        Returns (questions, sources); question ids are renumbered 1..n.
+        """
+        with self.lock:
+            # Another process (build_question_bank.py) committed: reload the topic matrix
+            if self.conn.execute("PRAGMA data_version").fetchone()[0] != self.data_version:
+                self._load()
+            # Consistent snapshot: add() and _load() replace both under the lock
+            matrix, bank_topic_ids = self.matrix, self.topic_ids
+        if matrix is None:
+            self.misses += 1
+            return None
+        similarity = matrix @ self._normalize(query_embedding)
+        ranked = np.argsort(-similarity)[:max_topics]
+        topic_ids = [bank_topic_ids[i] for i in ranked if similarity[i] >= self.min_similarity]
+        if not topic_ids:
+            self.misses += 1
+            return None
+
+        marks = ",".join("?" * len(topic_ids))
+        sql = f"SELECT id, topic_id, source, data FROM bank_questions WHERE topic_id IN ({marks})"
+        params = list(topic_ids)
+        if difficulty:
+            sql += " AND difficulty = ?"
+            params.append(difficulty)
+        if user_id:
+            sql += " AND id NOT IN (SELECT question_id FROM bank_served WHERE user_id = ?)"
+            params.append(user_id)
+        sql += " ORDER BY random()"
+
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            # Nearest topic first; random within a topic
+            order = {topic_id: rank for rank, topic_id in enumerate(topic_ids)}
+            rows = sorted(rows, key=lambda r: order[r["topic_id"]])[:count]
+            if len(rows) < count:
+                self.misses += 1
+                return None
+            if user_id:
+                now = time.time()
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO bank_served VALUES (?, ?, ?)", [(user_id, r["id"], now) for r in rows]
+                )
+                self.conn.commit()
+        self.hits += 1
+
+        questions = []
+        for i, r in enumerate(rows, start=1):
+            questions.append(QuizQuestion(**{**json.loads(r["data"]), "id": i}))
+        sources = list(dict.fromkeys(r["source"] for r in rows if r["source"]))
+        return questions, sources
+
+    def stats(self) -> dict:
+        with self.lock:
+            questions = self.conn.execute("SELECT COUNT(*) FROM bank_questions").fetchone()[0]
+            by_difficulty = dict(self.conn.execute("SELECT difficulty, COUNT(*) FROM bank_questions GROUP BY difficulty").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            "topics": len(self.topic_ids),
+            "questions": questions,
+            "by_difficulty": by_difficulty,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Opened on first use, next to the Chroma files
+question_bank = Lazy(lambda: QuestionBank(os.path.join(rag_service.db_path, "question_bank.sqlite3")))
@@ -1,23 +1,118 @@
 import os
+import re
+import time
+import asyncio
+import hashlib
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import openai
 import chromadb
-from chromadb.utils import embedding_functions
-from openai import OpenAI
-from typing import List, Optional
+from openai import OpenAI, AsyncOpenAI
+from typing import Iterable, List, Optional, Union
+from services.response_cache import ResponseCache
+from services.embedding_service import embedding_service
+from services.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from services.chunker import chunker
+from services.doc_catalog import DocumentCatalog
+from services.reranker import Reranker
+from services.prompt_packer import prompt_packer, PackedPrompt
+from services.llm_usage import llm_usage
+from services.tracing import tracer
+from services.lazy import Lazy
+
+# Owner id for the bundled knowledge base (visible to every user)
+SYSTEM_OWNER = "system"
+
+
+def rejects_json_mode(error: openai.BadRequestError) -> bool:
+    """True when a 400 is about `response_format` (no JSON mode for this provider/model)."""
+    if getattr(error, "param", None) == "response_format":
+        return True
+    message = str(error).lower()
+    return "response_format" in message or "json_object" in message
+
+
+# List punctuation in multi-topic requests ("议程设置、框架理论、使用与满足"). 和/与/and
+# are not separators: they join the parts of one topic ("媒介融合和新闻生产的关系")
+# as often as they join two topics
+TOPIC_SEPARATORS = re.compile(r"[、，,；;/]|以及")
+# Enumeration marks only, for raw requests where a comma separates clauses
+# rather than topics ("请生成评分标准，侧重导语写作")
+ENUMERATION_MARKS = re.compile(r"[、/]")
+
+
+def split_topics(text: str, max_topics: int = 6, separators=TOPIC_SEPARATORS) -> List[str]:
+    """Split a request into its listed sub-topics (a single-topic request gives one item)."""
+    topics = [part.strip(" 的。？?") for part in separators.split(text)]
+    topics = list(dict.fromkeys(t for t in topics if len(t) >= 2))
+    return topics[:max_topics] or [text]
 
 class RAGService:
-    def __init__(self):
+    def __init__(self, db_path: str = None, collection_name: str = None, embedding_function=None):
         # Initialize ChromaDB
-        self.db_path = "./chroma_db"
-        self.collection_name = "journalism_knowledge"
-        self.client = chromadb.PersistentClient(path=self.db_path)
-        self.ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="shibing624/text2vec-base-chinese")
+        self.db_path = db_path or os.getenv("CHROMA_DB_PATH", "./chroma_db")
+        self.collection_name = collection_name or "journalism_knowledge"
+        # Several server workers share one Chroma server (CHROMA_SERVER_HOST); otherwise Chroma runs in-process
+        chroma_host = os.getenv("CHROMA_SERVER_HOST")
+        if chroma_host:
+            self.client = chromadb.HttpClient(host=chroma_host, port=int(os.getenv("CHROMA_SERVER_PORT", "8001")))
+        else:
+            self.client = chromadb.PersistentClient(path=self.db_path)
+        # Shared embedding service: cached + micro-batched query embeddings
+        self.ef = embedding_function or embedding_service.as_chroma_function()
         self.collection = None
+
+        # BM25 index over the same chunks for hybrid retrieval (HYBRID_SEARCH=0 disables it)
+        self.lexical_index = LexicalIndex(os.path.join(self.db_path, "lexical_index.sqlite3")) if os.getenv("HYBRID_SEARCH", "1") == "1" else None
+        self.hybrid_pool_factor = int(os.getenv("HYBRID_POOL_FACTOR", "4"))
+        self.rrf_k = int(os.getenv("RRF_K", "60"))
+        # Total hits kept by retrieve_many across all sub-queries
+        self.multi_query_budget = int(os.getenv("MULTI_QUERY_BUDGET", "8"))
+        self.add_batch_size = int(os.getenv("ADD_BATCH_SIZE", "64"))
+
+        # Optional cross-encoder rerank over a larger candidate pool (RERANK=1 enables it)
+        self.reranker = Reranker() if os.getenv("RERANK", "0") == "1" else None
+
+        # (owner_id, source) -> chunk count / bytes / upload time, for /api/kb/list
+        self.catalog = DocumentCatalog(os.path.join(self.db_path, "doc_catalog.sqlite3"))
         
         # Initialize OpenAI Client
         api_key = os.getenv("OPENAI_API_KEY")
         base_url = os.getenv("OPENAI_BASE_URL", "https://api.deepseek.com")
         self.openai_client = OpenAI(api_key=api_key, base_url=base_url) if api_key else None
         self.model_name = os.getenv("LLM_MODEL", "deepseek-chat")
+        self.json_mode = os.getenv("LLM_JSON_MODE", "1") == "1"
+
+        # Async client with a pooled HTTP connection set, shared by all in-flight requests
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+        self.async_openai_client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections // 4),
+                timeout=httpx.Timeout(float(os.getenv("LLM_TIMEOUT", "120")), connect=10.0),
+            ),
+        ) if api_key else None
+
+        # LLM answer cache (RESPONSE_CACHE=0 disables it)
+        self.response_cache = ResponseCache() if os.getenv("RESPONSE_CACHE", "1") == "1" else None
+
+        # Bounded pool for blocking work (embedding + Chroma) so it never runs on the event loop
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("RAG_EXECUTOR_WORKERS", "8")),
+            thread_name_prefix="rag"
+        )
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Run a blocking call in the bounded executor and await its result.
+
+        The caller's context (e.g. the request trace) is carried into the worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
 
     def get_collection(self):
         if self.collection:
@@ -29,94 +124,214 @@ class RAGService:
             print(f"Warning: Collection not found ({e}).")
             return None
 
+    def visible_owners(self, user_id: str = None, role: str = None, target_user_ids: List[str] = None):
+        """Owner ids whose chunks the caller may see (None = everything).
+
+        - System/public docs (owner_id == "system") are always visible.
+        - internal_test sees everything, or only the selected users' KBs when target_user_ids is given.
+        - Regular users (teacher/student) additionally see their own docs.
+        """
+        if role == 'internal_test':
+            if not target_user_ids:
+                return None # God View: no filter
+            return [SYSTEM_OWNER] + [uid for uid in target_user_ids if uid != SYSTEM_OWNER]
+
+        owners = [SYSTEM_OWNER]
+        if user_id and user_id != SYSTEM_OWNER:
+            owners.append(user_id)
+        return owners
+
+    def build_visibility_filter(self, user_id: str = None, role: str = None, target_user_ids: List[str] = None):
+        """Build the Chroma `where` predicate for the chunks a caller may see."""
+        owners = self.visible_owners(user_id, role, target_user_ids)
+        if owners is None:
+            return None
+        if len(owners) == 1:
+            return {"owner_id": owners[0]}
+        return {"owner_id": {"$in": owners}}
+
     def retrieve(self, query: str, n_results: int = 3, user_id: str = None, role: str = None, target_user_ids: List[str] = None):
         collection = self.get_collection()
         if not collection:
             raise Exception("Knowledge base is initializing. Please try again later.")
         
-        # Query ChromaDB
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results * 3 # Fetch more to allow for filtering
-        )
+        # Visibility rules run inside the index, so every hit is already usable
+        with tracer.span("owner_filter"):
+            owners = self.visible_owners(user_id, role, target_user_ids)
+            where = self.build_visibility_filter(user_id, role, target_user_ids)
+        candidates = max(n_results, self.reranker.pool) if self.reranker else n_results
+        pool = candidates * self.hybrid_pool_factor if self.lexical_index is not None else candidates
         
-        # Post-processing filter
-        filtered_docs = []
-        filtered_metas = []
-        
-        if results['documents']:
-            docs = results['documents'][0]
-            metas = results['metadatas'][0]
-            
-            for doc, meta in zip(docs, metas):
-                doc_owner = meta.get('owner_id')
-                
-                # Filter Logic
-                keep = False
-                
-                # 1. System/Public docs (no owner or "system") -> Always Keep
-                if not doc_owner or doc_owner == 'system':
-                    keep = True
-                
-                # 2. Internal Test Role
-                elif role == 'internal_test':
-                    # If target_user_ids is specified, only keep docs from those users
-                    if target_user_ids:
-                        if doc_owner in target_user_ids:
-                            keep = True
-                    else:
-                        # If no target specified, keep everything (God View)
-                        keep = True
-                        
-                # 3. Regular User (Teacher/Student)
-                elif user_id:
-                    # Only keep own docs
-                    if doc_owner == user_id:
-                        keep = True
-                
-                if keep:
-                    filtered_docs.append(doc)
-                    filtered_metas.append(meta)
-            
-            # Update results
-            results['documents'][0] = filtered_docs[:n_results]
-            results['metadatas'][0] = filtered_metas[:n_results]
+        # Embed separately so embedding and index time show up as distinct stages
+        with tracer.span("embedding"):
+            query_embeddings = self.ef([query])
+
+        # Query ChromaDB
+        with tracer.span("chroma_query"):
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=pool,
+                where=where
+            )
+        return self.rank_hits(collection, query, results, owners, pool, candidates, n_results)
 
+    def rank_hits(self, collection, query: str, dense: dict, owners, pool: int, candidates: int, n_results: int,
+                  lexical_ids: List[str] = None, known: dict = None):
+        """Fuse one query's dense hits with BM25 and rerank them (retrieve()-shaped result).
+
+        `lexical_ids` and `known` (id -> (document, metadata)) let retrieve_many()
+        pass in BM25 hits it has already searched and fetched.
+        """
+        results = dense
+        if self.lexical_index is not None:
+            # Hybrid: fuse dense and BM25 rankings with reciprocal-rank fusion
+            with tracer.span("lexical_search"):
+                if lexical_ids is None:
+                    lexical_ids = self.lexical_index.search(query, pool, owners)
+                results = self.fuse_results(collection, results, lexical_ids, candidates, known)
+        if self.reranker:
+            with tracer.span("rerank"):
+                results = self.reranker.rerank(query, results, n_results)
         return results
 
-    def list_documents(self, user_id: str = None, role: str = None):
+    def retrieve_many(self, queries: List[str], n_results: int = None, user_id: str = None, role: str = None, target_user_ids: List[str] = None):
+        """Retrieve for several sub-queries (e.g. the topics of one quiz request) in one round trip.
+
+        The sub-queries are embedded as one batch (through the query cache) and
+        sent as one batched Chroma query, and the chunks only BM25 found are
+        fetched in one call; each sub-query's hits are then fused and reranked
+        as in retrieve(). The hits
+        are then merged round-robin (best hit of every sub-query first, no
+        duplicates) until `n_results` (default MULTI_QUERY_BUDGET) are kept, so
+        every topic is represented. The result has retrieve()'s shape plus a
+        'topics' list with the sub-query each hit was found for.
+        """
+        queries = list(dict.fromkeys(q.strip() for q in queries if q and q.strip()))
+        budget = n_results or max(3, min(self.multi_query_budget, 2 * len(queries)))
+        if len(queries) <= 1:
+            results = self.retrieve(queries[0] if queries else "", budget, user_id, role, target_user_ids)
+            return {**results, 'topics': [[queries[0] if queries else ""] * len(results['ids'][0])]}
+
         collection = self.get_collection()
         if not collection:
-            return {}
-            
-        # Fetch all metadata to aggregate files
-        # Note: This is inefficient for large datasets but acceptable for prototype
-        all_data = collection.get(include=['metadatas'])
-        metadatas = all_data['metadatas']
-        
-        files_map = {} # owner_id -> set(filenames)
-        
-        for meta in metadatas:
-            owner = meta.get('owner_id', 'system')
-            source = meta.get('source', 'Unknown')
-            
-            # Filter based on role
-            if role != 'internal_test' and user_id:
-                # User requested to NOT see system files in the list, only their own.
-                if owner != user_id:
+            raise Exception("Knowledge base is initializing. Please try again later.")
+
+        with tracer.span("owner_filter"):
+            owners = self.visible_owners(user_id, role, target_user_ids)
+            where = self.build_visibility_filter(user_id, role, target_user_ids)
+        per_query = -(-budget // len(queries))
+        candidates = max(per_query, self.reranker.pool) if self.reranker else per_query
+        pool = candidates * self.hybrid_pool_factor if self.lexical_index is not None else candidates
+
+        with tracer.span("embedding"):
+            query_embeddings = self.ef.embed_query(queries)
+        with tracer.span("chroma_query"):
+            dense = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=pool,
+                where=where
+            )
+
+        keys = ('ids', 'documents', 'metadatas', 'distances')
+        lexical = [None] * len(queries)
+        known = None
+        if self.lexical_index is not None:
+            with tracer.span("lexical_search"):
+                lexical = [self.lexical_index.search(query, pool, owners) for query in queries]
+                known = {}
+                for i in range(len(queries)):
+                    for doc_id, doc, meta in zip(dense['ids'][i], dense['documents'][i], dense['metadatas'][i]):
+                        known[doc_id] = (doc, meta)
+                fused = {
+                    doc_id
+                    for i in range(len(queries))
+                    for doc_id in reciprocal_rank_fusion([dense['ids'][i], lexical[i]], k=self.rrf_k)[:candidates]
+                }
+                missing = [doc_id for doc_id in fused if doc_id not in known]
+                if missing:
+                    extra = collection.get(ids=missing, include=['documents', 'metadatas'])
+                    for doc_id, doc, meta in zip(extra['ids'], extra['documents'], extra['metadatas']):
+                        known[doc_id] = (doc, meta)
+
+        ranked = [
+            self.rank_hits(collection, query, {key: [dense[key][i]] for key in keys}, owners, pool, candidates, candidates,
+                           lexical[i], known)
+            for i, query in enumerate(queries)
+        ]
+
+        merged = {key: [] for key in keys + ('topics',)}
+        seen = set()
+        for rank in range(max(len(r['ids'][0]) for r in ranked)):
+            for query, results in zip(queries, ranked):
+                if rank >= len(results['ids'][0]) or len(merged['ids']) >= budget:
                     continue
+                doc_id = results['ids'][0][rank]
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                for key in keys:
+                    merged[key].append(results[key][0][rank])
+                merged['topics'].append(query)
+        return {key: [values] for key, values in merged.items()}
+
+    def fuse_results(self, collection, dense, lexical_ids: List[str], n_results: int, known: dict = None):
+        dense_ids = dense['ids'][0] if dense['ids'] else []
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids], k=self.rrf_k)[:n_results]
+
+        hits = {}
+        for i, doc_id in enumerate(dense_ids):
+            hits[doc_id] = (dense['documents'][0][i], dense['metadatas'][0][i], dense['distances'][0][i])
+        for doc_id in fused:
+            if doc_id not in hits and known and doc_id in known:
+                hits[doc_id] = (*known[doc_id], None) # lexical-only hit: no vector distance
+        missing = [doc_id for doc_id in fused if doc_id not in hits]
+        if missing:
+            extra = collection.get(ids=missing, include=['documents', 'metadatas'])
+            for doc_id, doc, meta in zip(extra['ids'], extra['documents'], extra['metadatas']):
+                hits[doc_id] = (doc, meta, None) # lexical-only hit: no vector distance
+
+        fused = [doc_id for doc_id in fused if doc_id in hits]
+        return {
+            'ids': [fused],
+            'documents': [[hits[d][0] for d in fused]],
+            'metadatas': [[hits[d][1] for d in fused]],
+            'distances': [[hits[d][2] for d in fused]],
+        }
+
+    def list_documents(self, user_id: str = None, role: str = None, limit: int = None, offset: int = 0):
+        """Page through the document catalog (limit=None: everything from `offset` on).
+
+        Returns {"files": owner_id -> [sources], "documents": [...], "has_more": bool}.
+        internal_test (or no user) sees every owner; other users only their own uploads.
+        """
+        collection = self.get_collection()
+        if not collection:
+            return {"files": {}, "documents": [], "has_more": False}
+
+        if not self.catalog.initialized:
+            # First run on a database built before the catalog existed
+            self.catalog.rebuild(collection)
+
+        owner_id = user_id if role != 'internal_test' and user_id else None
+        if limit is None:
+            rows, has_more = self.catalog.list(owner_id, limit=-1, offset=offset), False
+        else:
+            rows = self.catalog.list(owner_id, limit=limit + 1, offset=offset)
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        
+        files_map = {} # owner_id -> [filenames]
+        for row in rows:
+            files_map.setdefault(row['owner_id'], []).append(row['source'])
             
-            if owner not in files_map:
-                files_map[owner] = set()
-            files_map[owner].add(source)
-            
-        # Convert sets to lists
-        return {k: list(v) for k, v in files_map.items()}
+        return {"files": files_map, "documents": rows, "has_more": has_more}
 
-    def generate_answer(self, query: str, context: str, history: List[dict], system_prompt: str):
-        if not self.openai_client:
-            raise Exception("OpenAI API Key not configured.")
+    def build_messages(self, query: str, context: str, history: List[dict], system_prompt: str):
+        """System prompt first, then history, then the per-request context and query.
 
+        Keep system_prompt static per agent/role (no query, context or per-request
+        data in it): the provider caches the longest byte-identical prefix.
+        """
         user_prompt = f"""
 【背景知识】：
 {context}
@@ -127,37 +342,263 @@ class RAGService:
         
         messages = [{"role": "system", "content": system_prompt}]
         if history:
-            for msg in history[-4:]:
+            for msg in history:
                 messages.append(msg)
         messages.append({"role": "user", "content": user_prompt})
+        return messages
+
+    def pack_prompt(self, query: str, results: Optional[dict], history: List[dict], system_prompt: str) -> PackedPrompt:
+        """Fit retrieved chunks and history into the prompt budgets and count the tokens to be sent."""
+        with tracer.span("prompt_build"):
+            context, context_ids, sources = prompt_packer.pack_context(results)
+            history = prompt_packer.trim_history(history)
+            tokens = prompt_packer.measure(self.build_messages(query, context, history, system_prompt), record=False)
+        return PackedPrompt(context, context_ids, sources, history, tokens)
+
+    def generate_answer(self, query: str, context: str, history: List[dict], system_prompt: str):
+        if not self.openai_client:
+            raise Exception("OpenAI API Key not configured.")
+
+        messages = self.build_messages(query, context, prompt_packer.trim_history(history), system_prompt)
+        prompt_packer.measure(messages)
 
         completion = self.openai_client.chat.completions.create(
             model=self.model_name,
             messages=messages,
             temperature=0.7 # Default temperature, can be adjusted if needed or passed as arg
         )
+        llm_usage.record("sync", completion.usage)
+        tracer.record_usage("sync", completion.usage)
         
         return completion.choices[0].message.content
 
-    def add_document(self, content: str, filename: str, user_id: str):
+    # --- Async API (used by the routers) ---
+
+    async def aretrieve(self, query: str, n_results: int = 3, user_id: str = None, role: str = None, target_user_ids: List[str] = None):
+        return await self.run_blocking(self.retrieve, query, n_results=n_results, user_id=user_id, role=role, target_user_ids=target_user_ids)
+
+    async def aretrieve_many(self, queries: List[str], n_results: int = None, user_id: str = None, role: str = None, target_user_ids: List[str] = None):
+        return await self.run_blocking(self.retrieve_many, queries, n_results=n_results, user_id=user_id, role=role, target_user_ids=target_user_ids)
+
+    async def adelete_document(self, user_id: str, filename: str):
+        return await self.run_blocking(self.delete_document, user_id, filename)
+
+    async def alist_documents(self, user_id: str = None, role: str = None, limit: int = None, offset: int = 0):
+        return await self.run_blocking(self.list_documents, user_id, role, limit, offset)
+
+    async def aadd_document(self, content: Union[str, Iterable[str]], filename: str, user_id: str, on_progress=None, content_hash: str = None):
+        return await self.run_blocking(self.add_document, content, filename, user_id, on_progress, content_hash)
+
+    async def aembed_query(self, query: str):
+        def embed():
+            with tracer.span("embedding"):
+                return list(self.ef([query])[0])
+        return await self.run_blocking(embed)
+
+    async def cache_lookup(self, query: str, history: List[dict], system_prompt: str, cache_scope: str, context_ids: List[str], context: str):
+        """Returns (group, embedding, cached_answer); group is None when caching is off for this call."""
+        if cache_scope is None or not self.response_cache:
+            return None, None, None
+        group = ResponseCache.group_key(
+            cache_scope,
+            system_prompt,
+            # Ids plus text: a replaced document reuses its chunk ids with new content
+            (context_ids or []) + [context],
+            history
+        )
+        embedding = await self.aembed_query(query) if self.response_cache.similarity > 0 else None
+        return group, embedding, self.response_cache.get(group, query, embedding)
+
+    def completion_kwargs(self, json_mode: bool) -> dict:
+        # JSON mode (LLM_JSON_MODE=0 disables it)
+        return {"response_format": {"type": "json_object"}} if json_mode and self.json_mode else {}
+
+    async def create_completion(self, json_mode: bool, **kwargs):
+        """chat.completions.create, in JSON mode when asked.
+
+        If the provider rejects `response_format` itself, this call is retried
+        without it (the prompts ask for JSON anyway). Any other 400 is raised.
+        """
+        extra = self.completion_kwargs(json_mode)
+        try:
+            return await self.async_openai_client.chat.completions.create(model=self.model_name, **kwargs, **extra)
+        except openai.BadRequestError as e:
+            if not extra or not rejects_json_mode(e):
+                raise
+            print(f"Warning: provider rejected JSON mode ({e}); retrying without it.")
+            return await self.async_openai_client.chat.completions.create(model=self.model_name, **kwargs)
+
+    async def acomplete(self, messages: List[dict], agent: str = "chat", temperature: float = 0.7, json_mode: bool = False) -> str:
+        """One chat completion; records tokens sent and the provider's usage (incl. cached prefix tokens) under `agent`."""
+        if not self.async_openai_client:
+            raise Exception("OpenAI API Key not configured.")
+
+        prompt_packer.measure(messages)
+        with tracer.span("llm_total", agent):
+            completion = await self.create_completion(json_mode, messages=messages, temperature=temperature)
+        llm_usage.record(agent, completion.usage)
+        tracer.record_usage(agent, completion.usage)
+        return completion.choices[0].message.content
+
+    async def astream_complete(self, messages: List[dict], agent: str = "chat", temperature: float = 0.7, json_mode: bool = False):
+        """Streaming acomplete: yields content deltas as they arrive."""
+        if not self.async_openai_client:
+            raise Exception("OpenAI API Key not configured.")
+
+        prompt_packer.measure(messages)
+        start = time.perf_counter()
+        first = True
+        stream = await self.create_completion(
+            json_mode,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                llm_usage.record(agent, chunk.usage)
+                tracer.record_usage(agent, chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first:
+                    tracer.observe("llm_ttft", time.perf_counter() - start, agent)
+                    first = False
+                yield delta
+        tracer.observe("llm_total", time.perf_counter() - start, agent)
+
+    async def agenerate_answer(self, query: str, context: str, history: List[dict], system_prompt: str,
+                               cache_scope: str = None, context_ids: List[str] = None, agent: str = "chat"):
+        """Async generate_answer. Pass cache_scope (see ResponseCache.make_scope) to enable the answer cache."""
+        if not self.async_openai_client:
+            raise Exception("OpenAI API Key not configured.")
+
+        history = prompt_packer.trim_history(history)
+        group, embedding, cached = await self.cache_lookup(query, history, system_prompt, cache_scope, context_ids, context)
+        if cached is not None:
+            return cached
+
+        answer = await self.acomplete(self.build_messages(query, context, history, system_prompt), agent=agent)
+
+        if group:
+            self.response_cache.put(group, query, answer, embedding)
+        return answer
+
+    async def astream_answer(self, query: str, context: str, history: List[dict], system_prompt: str,
+                             cache_scope: str = None, context_ids: List[str] = None, agent: str = "chat"):
+        """Streaming variant of agenerate_answer: yields content deltas as they arrive."""
+        if not self.async_openai_client:
+            raise Exception("OpenAI API Key not configured.")
+
+        history = prompt_packer.trim_history(history)
+        group, embedding, cached = await self.cache_lookup(query, history, system_prompt, cache_scope, context_ids, context)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        async for delta in self.astream_complete(self.build_messages(query, context, history, system_prompt), agent=agent):
+            parts.append(delta)
+            yield delta
+
+        if group:
+            self.response_cache.put(group, query, "".join(parts), embedding)
+
+    @staticmethod
+    def chunk_id(user_id: str, filename: str, index: int) -> str:
+        """Deterministic chunk id: re-uploading a document overwrites its chunks instead of duplicating them."""
+        doc_key = hashlib.sha1(f"{user_id}\x00{filename}".encode("utf-8")).hexdigest()[:16]
+        return f"{user_id}/{doc_key}/{index}"
+
+    def document_unchanged(self, user_id: str, filename: str, content_hash: str) -> bool:
+        entry = self.catalog.get(user_id, filename)
+        # A replace that failed partway left a mix of versions: not unchanged whatever the hash says
+        return bool(entry and content_hash and not entry.get("pending_chunks") and entry.get("content_hash") == content_hash)
+
+    def document_chunk_ids(self, collection, user_id: str, filename: str) -> List[str]:
+        entry = self.catalog.get(user_id, filename)
+        if entry and entry.get("content_hash"):
+            # Indexed with deterministic ids: the ids follow from the chunk count (or the
+            # indexes an unfinished replace got to, if that is higher)
+            count = max(entry["chunks"], entry.get("pending_chunks") or 0)
+            return [self.chunk_id(user_id, filename, i) for i in range(count)]
+        # Legacy (random uuid) chunks: indexed metadata lookup
+        where = {"$and": [{"owner_id": user_id}, {"source": filename}]}
+        return collection.get(where=where, include=[])['ids']
+
+    def add_document(self, content: Union[str, Iterable[str]], filename: str, user_id: str, on_progress=None, content_hash: str = None):
+        """Chunk and index a document, replacing any previous version with the same (user_id, filename).
+
+        `content` may be a string or an iterable of text blocks (pages/paragraphs);
+        blocks are chunked and embedded as a stream and upserted under deterministic ids.
+        `on_progress(chunks_added)` is called after every batch.
+        """
         collection = self.get_collection()
         if not collection:
             raise Exception("Knowledge base is initializing.")
-            
-        # Simple chunking (can be improved)
-        import uuid
-        chunk_size = 500
-        chunks = [content[i:i+chunk_size] for i in range(0, len(content), chunk_size)]
-        
-        ids = [str(uuid.uuid4()) for _ in chunks]
-        metadatas = [{"source": filename, "owner_id": user_id} for _ in chunks]
-        
-        collection.add(
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
-        return len(chunks)
 
-# Singleton instance
-rag_service = RAGService()
+        replacing = self.catalog.get(user_id, filename) is not None
+        old_ids = self.document_chunk_ids(collection, user_id, filename)
+        total = 0
+        size = 0
+        batch = []
+
+        def flush(start):
+            if replacing:
+                # Before writing: if this replace dies partway, a retry or delete still finds every chunk
+                self.catalog.mark_pending(user_id, filename, start + len(batch))
+            ids = [self.chunk_id(user_id, filename, start + i) for i in range(len(batch))]
+            metadatas = [{"source": filename, "owner_id": user_id, "chunk": start + i} for i in range(len(batch))]
+            collection.upsert(
+                documents=batch,
+                metadatas=metadatas,
+                ids=ids
+            )
+            if self.lexical_index is not None:
+                self.lexical_index.add(ids, batch, metadatas)
+
+        for chunk in chunker.iter_chunks(content):
+            batch.append(chunk)
+            total += 1
+            size += len(chunk.encode("utf-8"))
+            if len(batch) >= self.add_batch_size:
+                flush(total - len(batch))
+                batch = []
+                if on_progress:
+                    on_progress(total)
+        if batch:
+            flush(total - len(batch))
+            if on_progress:
+                on_progress(total)
+
+        # Drop chunks of the previous version that were not overwritten
+        new_ids = {self.chunk_id(user_id, filename, i) for i in range(total)}
+        stale = [doc_id for doc_id in old_ids if doc_id not in new_ids]
+        self.delete_chunks(collection, stale)
+
+        if total:
+            self.catalog.set_document(user_id, filename, total, size, content_hash or "")
+        else:
+            self.catalog.remove(user_id, filename)
+        return total
+
+    def delete_chunks(self, collection, ids: List[str]):
+        for i in range(0, len(ids), 1000):
+            collection.delete(ids=ids[i:i + 1000])
+        if ids and self.lexical_index is not None:
+            self.lexical_index.delete(ids)
+
+    def delete_document(self, user_id: str, filename: str) -> int:
+        """Remove every chunk of one document. Returns the number of chunks removed."""
+        collection = self.get_collection()
+        if not collection:
+            raise Exception("Knowledge base is initializing.")
+        ids = self.document_chunk_ids(collection, user_id, filename)
+        self.delete_chunks(collection, ids)
+        self.catalog.remove(user_id, filename)
+        return len(ids)
+
+# Singleton instance, built on first use (the app lifespan warms it up) rather than at import
+rag_service = Lazy(RAGService)
@@ -0,0 +1,134 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from services.embedding_service import Histogram
+
+DEFAULT_MODEL = "BAAI/bge-reranker-base"
+
+
+class Reranker:
+    """Cross-encoder rerank stage for retrieve().
+
+    Scores (query, chunk) pairs with a small local cross-encoder on CPU, in
+    batches, and keeps the best `n_results`. Pair scores are LRU-cached by
+    (query, chunk text). If scoring a candidate pool takes longer than
+    `budget` seconds, the remaining batches are skipped and the incoming
+    (dense/fused) order is kept. The model is loaded lazily on first use.
+
+    `score_fn(pairs) -> scores` replaces the model (benchmarks, tests).
+    """
+
+    def __init__(self, model_name: str = None, pool: int = None, budget: float = None, batch_size: int = None,
+                 min_score: float = None, cache_size: int = None, score_fn: Callable = None):
+        self.model_name = model_name or os.getenv("RERANK_MODEL", DEFAULT_MODEL)
+        self.pool = pool or int(os.getenv("RERANK_POOL", "20"))
+        self.budget = budget if budget is not None else float(os.getenv("RERANK_BUDGET_MS", "300")) / 1000
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH", "16"))
+        # Candidates scoring below this are dropped (the best one is always kept)
+        self.min_score = min_score if min_score is not None else float(os.getenv("RERANK_MIN_SCORE", "-inf"))
+        self.cache_size = cache_size if cache_size is not None else int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+        self.score_fn = score_fn
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        self.reranked = 0
+        self.fallbacks = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.latency = Histogram([0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5])
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _score(self, pairs: List[tuple]) -> List[float]:
+        if self.score_fn:
+            return [float(s) for s in self.score_fn(pairs)]
+        return [float(s) for s in self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+    @staticmethod
+    def _key(query: str, document: str) -> str:
+        return hashlib.sha1(f"{query}\x00{document}".encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[float]:
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+            return score
+
+    def _cache_put(self, key: str, score: float):
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def scores(self, query: str, documents: List[str]) -> Optional[List[float]]:
+        """Cross-encoder score per document, or None if the time budget ran out."""
+        start = time.perf_counter()
+        keys = [self._key(query, doc) for doc in documents]
+        scores = [self._cache_get(k) for k in keys]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        try:
+            for b in range(0, len(missing), self.batch_size):
+                if b and time.perf_counter() - start > self.budget:
+                    return None
+                batch = missing[b:b + self.batch_size]
+                for i, score in zip(batch, self._score([(query, documents[i]) for i in batch])):
+                    scores[i] = score
+                    self._cache_put(keys[i], score)
+            if time.perf_counter() - start > self.budget:
+                return None
+            return scores
+        finally:
+            self.latency.observe(time.perf_counter() - start)
+
+    def rerank(self, query: str, results: dict, n_results: int) -> dict:
+        """Reorder a retrieve()-shaped result (one query) and cut it to n_results."""
+        ids = results['ids'][0] if results['ids'] else []
+        documents = results['documents'][0] if ids else []
+        scores = self.scores(query, documents) if len(ids) > 1 else None
+
+        if scores is None:
+            if len(ids) > 1:
+                self.fallbacks += 1
+            order = list(range(len(ids)))[:n_results]
+        else:
+            self.reranked += 1
+            order = sorted(range(len(ids)), key=lambda i: -scores[i])[:n_results]
+            order = order[:1] + [i for i in order[1:] if scores[i] >= self.min_score]
+
+        reranked = {key: [[results[key][0][i] for i in order]] for key in ('ids', 'documents', 'metadatas', 'distances')}
+        reranked['rerank_scores'] = [[scores[i] for i in order] if scores is not None else []]
+        return reranked
+
+    def stats(self) -> dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "model": self.model_name if not self.score_fn else "custom",
+            "pool": self.pool,
+            "budget_ms": round(self.budget * 1000, 1),
+            "reranked": self.reranked,
+            "fallbacks": self.fallbacks,
+            "cache_entries": len(self._cache),
+            "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+            "latency_seconds": self.latency.snapshot(),
+        }
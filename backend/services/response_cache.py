@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop whitespace and trailing punctuation so trivial variants share a key."""
+    text = re.sub(r"\s+", "", query or "").lower()
+    return text.rstrip("?？。.!！~～")
+
+
+def cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+class MemoryBackend:
+    """LRU dict bounded by entry count and total answer bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> entry dict
+        self.groups = {} # group_key -> set(keys)
+        self.bytes = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry:
+            self.entries.move_to_end(key)
+        return entry
+
+    def group(self, group_key: str):
+        return [self.entries[k] for k in self.groups.get(group_key, ())]
+
+    def put(self, entry: dict):
+        self.delete(entry["key"])
+        self.entries[entry["key"]] = entry
+        self.groups.setdefault(entry["group"], set()).add(entry["key"])
+        self.bytes += entry["size"]
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self.delete(next(iter(self.entries)))
+
+    def delete(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.bytes -= entry["size"]
+            keys = self.groups.get(entry["group"])
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.groups[entry["group"]]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteBackend:
+    """On-disk variant so the cache survives restarts and is shared between workers.
+
+    Bounded like MemoryBackend: least recently accessed entries go first once
+    the entry count or the total answer bytes exceed the limits.
+    """
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                grp TEXT NOT NULL,
+                query TEXT,
+                embedding TEXT,
+                answer TEXT,
+                created REAL,
+                accessed REAL,
+                size INTEGER
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_grp ON response_cache(grp)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_accessed ON response_cache(accessed)")
+        self.conn.commit()
+
+    def _row(self, row):
+        key, grp, query, embedding, answer, created, accessed, size = row
+        return {
+            "key": key, "group": grp, "query": query,
+            "embedding": json.loads(embedding) if embedding else None,
+            "answer": answer, "created": created, "size": size,
+        }
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.conn.execute("UPDATE response_cache SET accessed = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+        return self._row(row) if row else None
+
+    def group(self, group_key: str):
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM response_cache WHERE grp = ?", (group_key,)).fetchall()
+        return [self._row(r) for r in rows]
+
+    def put(self, entry: dict):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry["key"], entry["group"], entry["query"],
+                 json.dumps(entry["embedding"]) if entry["embedding"] else None,
+                 entry["answer"], entry["created"], time.time(), entry["size"])
+            )
+            count, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+                total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # Oldest first until the remaining answers fit
+                evict = []
+                for key, size in self.conn.execute("SELECT key, size FROM response_cache ORDER BY accessed"):
+                    if total <= self.max_bytes:
+                        break
+                    evict.append((key,))
+                    total -= size
+                self.conn.executemany("DELETE FROM response_cache WHERE key = ?", evict)
+            self.conn.commit()
+
+    def delete(self, key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Cache of LLM answers keyed by scope, system prompt, retrieved chunk ids and normalized query.
+
+    Entries sharing the same scope/prompt/context form a group; within a group a
+    paraphrased query can hit when its embedding is similar enough to a cached one.
+    The scope (role + user + target KBs) is part of every key, so answers built on
+    private documents are never served to another tenant.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None, max_bytes: int = None,
+                 db_path: str = None, similarity: float = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+        max_bytes = max_bytes or int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        db_path = db_path or os.getenv("RESPONSE_CACHE_DB")
+        self.similarity = similarity if similarity is not None else float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+        self.backend = SQLiteBackend(db_path, max_entries, max_bytes) if db_path else MemoryBackend(max_entries, max_bytes)
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_scope(user_id: str = None, role: str = None, target_user_ids: List[str] = None) -> str:
+        targets = ",".join(sorted(target_user_ids)) if target_user_ids else ""
+        return f"{role or ''}|{user_id or ''}|{targets}"
+
+    @staticmethod
+    def group_key(scope: str, system_prompt: str, context_ids: List[str], history: List[dict]) -> str:
+        payload = json.dumps([scope, system_prompt, context_ids or [], history or []], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def entry_key(group: str, query: str) -> str:
+        return hashlib.sha256(f"{group}|{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _fresh(self, entry) -> bool:
+        return entry is not None and (not self.ttl or time.time() - entry["created"] < self.ttl)
+
+    def get(self, group: str, query: str, embedding: Optional[List[float]] = None) -> Optional[str]:
+        key = self.entry_key(group, query)
+        entry = self.backend.get(key)
+        if self._fresh(entry):
+            self.hits += 1
+            return entry["answer"]
+        if entry:
+            self.backend.delete(key)
+
+        if embedding is not None and self.similarity > 0:
+            best, best_score = None, self.similarity
+            for candidate in self.backend.group(group):
+                if not self._fresh(candidate) or not candidate["embedding"]:
+                    continue
+                score = cosine(embedding, candidate["embedding"])
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best:
+                self.semantic_hits += 1
+                return best["answer"]
+
+        self.misses += 1
+        return None
+
+    def put(self, group: str, query: str, answer: str, embedding: Optional[List[float]] = None):
+        self.backend.put({
+            "key": self.entry_key(group, query),
+            "group": group,
+            "query": normalize_query(query),
+            "embedding": [float(v) for v in embedding] if embedding is not None else None,
+            "answer": answer,
+            "created": time.time(),
+            "size": len(answer.encode("utf-8")),
+        })
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,87 @@
+import os
+import time
+import asyncio
+
+from services.rag_service import rag_service
+from services.prompt_packer import prompt_packer
+from services.question_bank import question_bank
+
+
+class Startup:
+    """Warmup and readiness for one server process.
+
+    Warmup runs in the background after the app starts, so /health (liveness)
+    answers immediately while /ready (readiness) returns 503 until the
+    collection is open, the embedding model is loaded and a first retrieval has
+    pulled the vector index into memory. Every step is timed and reported.
+    WARMUP=0 skips it (development) and the process is ready at once.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("WARMUP", "1") == "1"
+        self.tokenizer_timeout = float(os.getenv("WARMUP_TOKENIZER_TIMEOUT", "30"))
+        self.state = "starting" # starting -> ready / failed
+        self.error = None
+        self.timings = {}
+        self.task = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def _step(self, name: str, func, timeout: float = None):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.to_thread(func), timeout)
+        except asyncio.TimeoutError:
+            # Not fatal: the step keeps going in the background
+            print(f"Warmup step {name} still running after {timeout:.0f}s, continuing.")
+        self.timings[name] = round(time.perf_counter() - start, 3)
+
+    def _open_collection(self):
+        if rag_service.get_collection() is None:
+            raise RuntimeError("Knowledge base collection not found; run ingest.py first.")
+
+    def _warm_reranker(self):
+        if rag_service.reranker:
+            rag_service.reranker.scores("预热", ["预热"])
+
+    async def warmup(self):
+        start = time.perf_counter()
+        try:
+            # Opens Chroma, the BM25 index and the catalog off the event loop
+            await self._step("rag_service", rag_service.instance)
+            await self._step("collection", self._open_collection)
+            await self._step("embedding_model", lambda: rag_service.ef(["预热"]))
+            await self._step("first_retrieval", lambda: rag_service.retrieve("预热", role="student"))
+            await self._step("reranker", self._warm_reranker)
+            await self._step("question_bank", question_bank.instance)
+            # The tokenizer may need a download; token counts are estimated until it is loaded
+            await self._step("tokenizer", prompt_packer.load, self.tokenizer_timeout)
+            self.state = "ready"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"Warmup Error: {e}")
+        self.timings["warmup"] = round(time.perf_counter() - start, 3)
+        print(f"Startup {self.state}: {self.timings}")
+
+    def start(self, import_seconds: float = None):
+        """Call from the app lifespan; warmup continues in the background."""
+        if import_seconds is not None:
+            self.timings["imports"] = round(import_seconds, 3)
+        if not self.enabled:
+            self.state = "ready"
+            return
+        self.task = asyncio.create_task(self.warmup())
+
+    async def stop(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def report(self) -> dict:
+        return {"status": self.state, "error": self.error, "timings": self.timings, "pid": os.getpid()}
+
+
+startup = Startup()
@@ -0,0 +1,170 @@
+import json
+import threading
+from typing import Any, Callable, List
+
+from pydantic import ValidationError
+
+from services.rag_service import rag_service
+from services.tracing import tracer
+
+REPAIR_PROMPT = """你上一次的输出无法通过校验：
+{error}
+
+请只返回修正后的完整 JSON，保持原有内容，不要包含 markdown 标记或任何解释。"""
+
+
+class StructuredOutputError(ValueError):
+    """The model output could not be parsed/validated, even after the repair call."""
+
+
+def strip_fences(text: str) -> str:
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def extract_json(text: str) -> Any:
+    """json.loads with the usual LLM noise removed (``` fences, text around the outermost object)."""
+    text = strip_fences(text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}") + 1
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end])
+
+
+class JsonArrayStreamer:
+    """Incremental parser for `{"<key>": [ {...}, {...} ]}` streamed in pieces.
+
+    `feed(text)` returns the array items completed by that piece, so each quiz
+    question can be shown as soon as its closing brace arrives. Anything before
+    the first `{` (e.g. a ``` fence) is ignored.
+    """
+
+    def __init__(self, key: str = "questions"):
+        self.key = key
+        self.buffer = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.item_start = None
+        self.key_start = None
+        self.last_key = None
+        self.array_key = None
+
+    def feed(self, text: str) -> List[Any]:
+        self.buffer += text
+        items = []
+        while self.pos < len(self.buffer):
+            ch = self.buffer[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        self.last_key = self.buffer[self.key_start:self.pos]
+                        self.key_start = None
+            elif ch == '"':
+                self.in_string = True
+                if len(self.stack) == 1 and self.stack[0] == "{":
+                    self.key_start = self.pos + 1 # top-level string: candidate key
+            elif ch in "{[":
+                if ch == "[" and len(self.stack) == 1:
+                    self.array_key = self.last_key
+                if ch == "{" and self.stack == ["{", "["] and self.array_key == self.key:
+                    self.item_start = self.pos
+                self.stack.append(ch)
+            elif ch in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if ch == "}" and self.item_start is not None and self.stack == ["{", "["]:
+                    try:
+                        items.append(json.loads(self.buffer[self.item_start:self.pos + 1]))
+                    except json.JSONDecodeError:
+                        pass # malformed item: left to the final validation
+                    self.item_start = None
+            self.pos += 1
+        return items
+
+
+class StructuredOutput:
+    """JSON generation with validation and a single targeted repair call.
+
+    - JSON mode (`response_format={"type": "json_object"}`) is requested where the
+      provider supports it (see RAGService.acomplete).
+    - The reply is parsed and passed to `parse(data)`, typically a Pydantic model
+      constructor; ValidationError / ValueError / TypeError count as failures.
+    - On failure the bad reply and the error go back to the model once, asking
+      for a corrected JSON, instead of regenerating from scratch.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def record(self, agent: str, outcome: str):
+        """outcome: "ok" (valid first time), "repaired" or "failed"."""
+        with self.lock:
+            entry = self.counts.setdefault(agent, {"ok": 0, "repaired": 0, "failed": 0})
+            entry[outcome] += 1
+
+    @staticmethod
+    def validate(text: str, parse: Callable[[Any], Any], extract: Callable[[str], Any] = extract_json):
+        """Returns (result, error); error is a short description for the repair prompt."""
+        try:
+            with tracer.span("json_parse"):
+                return parse(extract(text)), None
+        except json.JSONDecodeError as e:
+            return None, f"JSON 语法错误：{e}"
+        except ValidationError as e:
+            return None, f"字段校验失败：{e}"
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return None, f"结构错误：{e}"
+
+    async def repair(self, messages: List[dict], reply: str, error: str, parse: Callable[[Any], Any],
+                     agent: str, complete: Callable = None):
+        """One repair round trip; the corrected reply is always requested as bare JSON."""
+        print(f"{agent} output invalid ({error[:200]}), requesting repair")
+        complete = complete or rag_service.acomplete
+        repair_messages = messages + [
+            {"role": "assistant", "content": reply},
+            {"role": "user", "content": REPAIR_PROMPT.format(error=error[:1000])},
+        ]
+        reply = await complete(repair_messages, agent=agent, json_mode=True)
+        return reply, self.validate(reply, parse)
+
+    async def generate(self, messages: List[dict], parse: Callable[[Any], Any], agent: str,
+                       json_mode: bool = True, complete: Callable = None):
+        """Returns (result, raw_reply); raises StructuredOutputError after a failed repair.
+
+        `complete(messages, agent=, json_mode=)` defaults to RAGService.acomplete.
+        """
+        complete = complete or rag_service.acomplete
+        reply = await complete(messages, agent=agent, json_mode=json_mode)
+        result, error = self.validate(reply, parse)
+        if error is None:
+            self.record(agent, "ok")
+            return result, reply
+
+        reply, (result, error) = await self.repair(messages, reply, error, parse, agent, complete)
+        if error is None:
+            self.record(agent, "repaired")
+            return result, reply
+        self.record(agent, "failed")
+        raise StructuredOutputError(f"Model output failed validation after repair: {error[:300]}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {agent: dict(entry) for agent, entry in self.counts.items()}
+
+
+structured_output = StructuredOutput()
@@ -0,0 +1,223 @@
+import os
+import time
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+from services.embedding_service import Histogram
+from services.llm_usage import cached_tokens
+
+STAGE_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+REQUEST_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+class Trace:
+    """Per-request stage timings; stages running concurrently (e.g. a grading batch) add up."""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route = path
+        self.role = None
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def breakdown(self) -> dict:
+        with self.lock:
+            return {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+class NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", stage: str, labels: tuple):
+        self.tracer = tracer
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.observe(self.stage, time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Tracer:
+    """Stage spans, per-agent token/cost counters and a slow-request log, exported as Prometheus text.
+
+    - `span(stage)` times a block into the `stage_seconds{stage}` histogram and into
+      the current request's trace (a ContextVar set by TracingMiddleware; copied
+      into executor threads by RAGService.run_blocking).
+    - LLM usage reported by the provider is counted per agent and per caller role,
+      priced with LLM_PRICE_{INPUT,CACHED,OUTPUT}_PER_M (per million tokens).
+    - Requests slower than SLOW_REQUEST_MS are logged with their stage breakdown.
+
+    With METRICS=0 spans are a shared no-op object, nothing is recorded and the
+    middleware is not installed.
+    """
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = enabled if enabled is not None else os.getenv("METRICS", "1") == "1"
+        self.slow_seconds = float(os.getenv("SLOW_REQUEST_MS", "2000")) / 1000
+        # Defaults: DeepSeek list prices (CNY per million tokens)
+        self.price_input = float(os.getenv("LLM_PRICE_INPUT_PER_M", "2"))
+        self.price_cached = float(os.getenv("LLM_PRICE_CACHED_PER_M", "0.5"))
+        self.price_output = float(os.getenv("LLM_PRICE_OUTPUT_PER_M", "8"))
+        self.lock = threading.Lock()
+        self.histograms = {} # (name, labels) -> Histogram
+        self.counters = {} # (name, labels) -> value
+        self.slow_requests = deque(maxlen=int(os.getenv("SLOW_REQUEST_LOG_SIZE", "100")))
+
+    # --- Recording ---
+
+    def span(self, stage: str, agent: str = None):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, stage, (agent,) if agent else ())
+
+    def observe(self, stage: str, seconds: float, agent: str = None):
+        if not self.enabled:
+            return
+        labels = (("stage", stage), ("agent", agent)) if agent else (("stage", stage),)
+        self._histogram("stage_seconds", labels, STAGE_BUCKETS).observe(seconds)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(stage, seconds)
+
+    def tag(self, role: str = None):
+        """Attach the caller's role to the current request (used to label token counters)."""
+        trace = current_trace.get()
+        if trace is not None and role:
+            trace.role = role
+
+    def record_usage(self, agent: str, usage):
+        if not self.enabled or usage is None:
+            return
+        trace = current_trace.get()
+        labels = (("agent", agent), ("role", (trace.role if trace else None) or "none"))
+        prompt = usage.prompt_tokens or 0
+        cached = min(cached_tokens(usage), prompt)
+        completion = usage.completion_tokens or 0
+        cost = ((prompt - cached) * self.price_input + cached * self.price_cached + completion * self.price_output) / 1e6
+        with self.lock:
+            for name, value in (
+                ("llm_requests_total", 1),
+                ("llm_prompt_tokens_total", prompt),
+                ("llm_cached_tokens_total", cached),
+                ("llm_completion_tokens_total", completion),
+                ("llm_cost_total", cost),
+            ):
+                self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def _histogram(self, name: str, labels: tuple, buckets) -> Histogram:
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def finish(self, trace: Trace, status: int):
+        elapsed = time.perf_counter() - trace.start
+        labels = (("method", trace.method), ("route", trace.route), ("status", str(status)))
+        self._histogram("http_request_duration_seconds", labels, REQUEST_BUCKETS).observe(elapsed)
+        if elapsed >= self.slow_seconds:
+            entry = {
+                "method": trace.method,
+                "path": trace.path,
+                "status": status,
+                "seconds": round(elapsed, 4),
+                "stages": trace.breakdown(),
+                "at": time.time(),
+            }
+            self.slow_requests.append(entry)
+            print(f"Slow request: {trace.method} {trace.path} {status} {elapsed:.2f}s stages={entry['stages']}")
+
+    # --- Export ---
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{k}="{str(v)}"' for k, v in labels] + ([extra] if extra else [])
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self._labels(labels)} {round(value, 6)}")
+
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            snapshot = histogram.snapshot()
+            cumulative = 0
+            for le, count in snapshot["buckets"].items():
+                cumulative += count
+                bucket = 'le="' + le + '"'
+                lines.append(f"{name}_bucket{self._labels(labels, bucket)} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {snapshot['sum']}")
+            lines.append(f"{name}_count{self._labels(labels)} {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class TracingMiddleware:
+    """ASGI middleware: one Trace per HTTP request, finished when the response (incl. SSE streams) ends."""
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace = Trace(scope["method"], scope["path"])
+        token = current_trace.set(trace)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Route template (e.g. /api/grading/jobs/{job_id}) keeps label cardinality bounded
+            route = scope.get("route")
+            trace.route = getattr(route, "path", None) or "unmatched"
+            current_trace.reset(token)
+            self.tracer.finish(trace, status)
+
+
+tracer = Tracer()
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Run from anywhere: the services import each other as top-level packages of backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep every on-disk store of the app in a scratch directory, never in the real chroma_db/
+SCRATCH = tempfile.mkdtemp(prefix="backend-tests-")
+for name, value in {
+    "CHROMA_DB_PATH": os.path.join(SCRATCH, "chroma_db"),
+    "INGEST_JOBS_DB": os.path.join(SCRATCH, "ingest_jobs.sqlite3"),
+    "INGEST_SPOOL_DIR": os.path.join(SCRATCH, "upload_spool"),
+    "GRADING_JOBS_DB": os.path.join(SCRATCH, "grading_jobs.sqlite3"),
+    "EXPORT_CACHE_DIR": os.path.join(SCRATCH, "export_cache"),
+    "RESPONSE_CACHE": "0",
+    "WARMUP": "0",
+    "METRICS": "0",
+    "RERANK": "0",
+    "OPENAI_API_KEY": "",
+    "PROMPT_TOKENIZER": "", # estimated token counts, no tokenizer download
+}.items():
+    os.environ[name] = value
+
+
+@pytest.fixture
+def rag(tmp_path):
+    """A RAGService on an empty scratch collection with the offline hashing embedder."""
+    from benchmarks.common import HashingEmbeddingFunction
+    from services.rag_service import RAGService
+
+    service = RAGService(db_path=str(tmp_path / "chroma_db"), embedding_function=HashingEmbeddingFunction())
+    service.collection = service.client.get_or_create_collection(name=service.collection_name, embedding_function=service.ef)
+    return service
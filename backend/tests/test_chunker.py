@@ -0,0 +1,48 @@
+import random
+
+from services.chunker import Chunker, SimHashIndex, count_tokens
+
+
+def sentences(n: int, prefix: str = "句子") -> str:
+    return "".join(f"这是第{i}个{prefix}，讨论传播学中的不同理论与方法。" for i in range(n))
+
+
+def test_chunks_respect_the_token_budget():
+    chunks = Chunker(max_tokens=60, overlap=0, dedup_distance=-1).chunk(sentences(30))
+    assert len(chunks) > 1
+    assert all(count_tokens(c) <= 60 for c in chunks)
+
+
+def test_overlap_carries_the_tail_into_the_next_chunk():
+    chunks = Chunker(max_tokens=60, overlap=25, dedup_distance=-1).chunk(sentences(30))
+    for previous, current in zip(chunks, chunks[1:]):
+        first_sentence = current.split("。")[0] + "。"
+        assert first_sentence in previous
+        assert count_tokens(first_sentence) <= 25
+
+
+def test_heading_starts_a_new_chunk():
+    chunks = Chunker(max_tokens=400, overlap=0).chunk("引言内容。\n第二章 议程设置\n议程设置的内容。")
+    assert chunks == ["引言内容。", "第二章 议程设置\n议程设置的内容。"]
+
+
+def test_duplicate_and_near_duplicate_chunks_are_dropped():
+    page = sentences(12, "段落")
+    near = page.replace("第3个", "第三个", 1)
+    chunker = Chunker(max_tokens=1000, overlap=0, dedup_distance=3)
+    assert chunker.chunk([page, "\n第二节\n" + page, "\n第三节\n" + near]) == [page]
+    assert len(Chunker(max_tokens=1000, overlap=0, dedup_distance=-1).chunk([page, "\n第二节\n" + page])) == 2
+
+
+def test_simhash_index_matches_brute_force():
+    rng = random.Random(0)
+    base = [rng.getrandbits(64) for _ in range(200)]
+    # Variants of the base fingerprints with 0-5 flipped bits
+    queries = [b ^ sum(1 << bit for bit in rng.sample(range(64), rng.randrange(6))) for b in base for _ in range(3)]
+    for distance in (0, 3, 6):
+        index, kept = SimHashIndex(distance), []
+        for fingerprint in base + queries:
+            expected = not any((fingerprint ^ other).bit_count() <= distance for other in kept)
+            assert index.add(fingerprint) == expected
+            if expected:
+                kept.append(fingerprint)
@@ -0,0 +1,94 @@
+def add(rag, user_id: str, *filenames: str):
+    for filename in filenames:
+        rag.add_document(f"{filename} 的内容：议程设置理论。", filename, user_id)
+
+
+def test_unpaged_list_returns_every_document(rag):
+    add(rag, "alice", *(f"doc{i}.txt" for i in range(120)))
+    listing = rag.list_documents("alice", "student")
+    assert len(listing["files"]["alice"]) == 120 and not listing["has_more"]
+
+
+def test_paged_list(rag):
+    add(rag, "alice", "a.txt", "b.txt", "c.txt")
+    first = rag.list_documents("alice", "student", limit=2)
+    rest = rag.list_documents("alice", "student", limit=2, offset=2)
+    assert first["files"] == {"alice": ["a.txt", "b.txt"]} and first["has_more"]
+    assert rest["files"] == {"alice": ["c.txt"]} and not rest["has_more"]
+
+
+def long_text(n: int, topic: str) -> str:
+    return "".join(f"第{i}条：{topic}的要点{i}，涉及媒介与受众的关系{i * 7}。" for i in range(n))
+
+
+def chunk_ids(rag, user_id: str, filename: str):
+    where = {"$and": [{"owner_id": user_id}, {"source": filename}]}
+    return set(rag.get_collection().get(where=where, include=[])["ids"])
+
+
+def test_replace_removes_stale_chunks(rag):
+    first = rag.add_document(long_text(200, "议程设置"), "notes.txt", "alice")
+    second = rag.add_document(long_text(20, "框架理论"), "notes.txt", "alice")
+    assert first > second > 0
+
+    ids = chunk_ids(rag, "alice", "notes.txt")
+    assert ids == {rag.chunk_id("alice", "notes.txt", i) for i in range(second)}
+    assert rag.catalog.get("alice", "notes.txt")["chunks"] == second
+    assert not set(rag.lexical_index.search("议程设置", 100)) - ids # no stale BM25 hits
+
+
+def test_delete_removes_every_chunk_of_one_document_only(rag):
+    rag.add_document(long_text(50, "议程设置"), "notes.txt", "alice")
+    kept = rag.add_document(long_text(50, "议程设置"), "notes.txt", "bob")
+
+    removed = rag.delete_document("alice", "notes.txt")
+    assert removed > 0
+    assert chunk_ids(rag, "alice", "notes.txt") == set()
+    assert rag.catalog.get("alice", "notes.txt") is None
+    assert all(hit.startswith("bob/") for hit in rag.lexical_index.search("议程设置", 100))
+    assert len(chunk_ids(rag, "bob", "notes.txt")) == kept
+    assert rag.delete_document("alice", "notes.txt") == 0
+
+
+
+def fail_replace_partway(rag, monkeypatch, batch_size: int):
+    """Replace alice's notes.txt with a longer version whose third upsert batch fails."""
+    collection = rag.get_collection()
+    upsert = collection.upsert
+    calls = []
+
+    def failing_upsert(**kwargs):
+        calls.append(kwargs["ids"])
+        if len(calls) == 3:
+            raise RuntimeError("disk full")
+        return upsert(**kwargs)
+
+    monkeypatch.setattr(rag, "add_batch_size", batch_size)
+    monkeypatch.setattr(collection, "upsert", failing_upsert)
+    try:
+        rag.add_document(long_text(200, "框架理论"), "notes.txt", "alice", content_hash="v2")
+    except RuntimeError:
+        pass
+    monkeypatch.setattr(collection, "upsert", upsert)
+
+
+def test_failed_replace_is_retried_and_leaves_no_orphans(rag, monkeypatch):
+    original = long_text(30, "议程设置")
+    kept = rag.add_document(original, "notes.txt", "alice", content_hash="v1")
+    fail_replace_partway(rag, monkeypatch, kept)
+    assert len(chunk_ids(rag, "alice", "notes.txt")) == 2 * kept # the new version got past the old chunk count
+
+    # Re-uploading the original is not skipped, and drops every chunk of the failed version
+    assert not rag.document_unchanged("alice", "notes.txt", "v1")
+    assert rag.add_document(original, "notes.txt", "alice", content_hash="v1") == kept
+    assert chunk_ids(rag, "alice", "notes.txt") == {rag.chunk_id("alice", "notes.txt", i) for i in range(kept)}
+    assert rag.document_unchanged("alice", "notes.txt", "v1")
+
+
+def test_delete_after_a_failed_replace_removes_every_chunk(rag, monkeypatch):
+    kept = rag.add_document(long_text(30, "议程设置"), "notes.txt", "alice", content_hash="v1")
+    fail_replace_partway(rag, monkeypatch, kept)
+
+    rag.delete_document("alice", "notes.txt")
+    assert chunk_ids(rag, "alice", "notes.txt") == set()
+    assert not rag.lexical_index.search("框架理论", 100)
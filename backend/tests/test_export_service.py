@@ -0,0 +1,25 @@
+import asyncio
+import os
+
+from models.schemas import GradingReport
+from services.export_service import ExportService
+
+
+def export_reports(service: ExportService, *scores: float):
+    async def scenario():
+        return [await service.export("report", "csv", GradingReport(results=[], average_score=s), "report") for s in scores]
+    return asyncio.run(scenario())
+
+
+def test_recently_returned_exports_are_not_evicted(tmp_path):
+    service = ExportService(cache_dir=str(tmp_path), cache_size=1, workers=1)
+    exports = export_reports(service, 1.0, 2.0, 3.0)
+    assert all(os.path.exists(export.path) for export in exports)
+    assert export_reports(service, 1.0)[0].cached
+
+
+def test_least_recently_used_exports_are_evicted_after_the_grace_period(tmp_path):
+    service = ExportService(cache_dir=str(tmp_path), cache_size=1, workers=1, grace=0)
+    first, second = export_reports(service, 1.0, 2.0)
+    assert not os.path.exists(first.path) and os.path.exists(second.path)
+    assert not export_reports(service, 1.0)[0].cached
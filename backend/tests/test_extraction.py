@@ -0,0 +1,12 @@
+import os
+
+from services.extraction import ExtractionService
+
+
+def test_pool_spawns_fresh_workers():
+    service = ExtractionService(workers=1)
+    try:
+        assert service.pool._mp_context.get_start_method() == "spawn"
+        assert service.pool.submit(os.getpid).result(timeout=60) != os.getpid()
+    finally:
+        service.pool.shutdown()
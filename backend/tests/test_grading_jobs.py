@@ -0,0 +1,38 @@
+import asyncio
+
+from models.schemas import GradingReport
+from services.grading_service import GradingJobStore
+
+
+class SlowEngine:
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def grade_batch(self, uploads, build_prompt, on_result=None):
+        await self.release.wait()
+        return GradingReport(results=[], average_score=0.0)
+
+
+def test_store_holds_running_jobs_until_they_finish(tmp_path):
+    async def scenario():
+        engine = SlowEngine()
+        store = GradingJobStore(engine, db_path=str(tmp_path / "jobs.sqlite3"))
+        job_id = store.submit([], lambda text: []).job_id
+        await asyncio.sleep(0)
+        assert len(store._tasks) == 1 and store.get(job_id).status == "running"
+
+        engine.release.set()
+        await asyncio.gather(*store._tasks)
+        await asyncio.sleep(0)
+        return store, job_id
+
+    store, job_id = asyncio.run(scenario())
+    assert not store._tasks
+    assert store.get(job_id).status == "done"
+
+
+def test_importing_the_kb_router_opens_no_job_queue():
+    import routers.kb_agent
+    from services.ingest_jobs import ingest_jobs
+
+    assert not ingest_jobs.loaded
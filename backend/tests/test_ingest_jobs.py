@@ -0,0 +1,80 @@
+import sys
+import asyncio
+import hashlib
+import subprocess
+
+import pytest
+
+import services.ingest_jobs as ingest_jobs_module
+from services.extraction import SpooledUpload
+from services.ingest_jobs import IngestJobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return IngestJobQueue(db_path=str(tmp_path / "jobs.sqlite3"), spool_dir=str(tmp_path / "spool"), workers=1)
+
+
+def spool(tmp_path, name: str, text: str = "议程设置理论。") -> SpooledUpload:
+    path = tmp_path / f"upload-{name}"
+    path.write_text(text, encoding="utf-8")
+    data = path.read_bytes()
+    return SpooledUpload(name, str(path), len(data), hashlib.sha256(data).hexdigest())
+
+
+def test_claim_takes_every_pending_job_of_the_oldest_user(tmp_path, queue):
+    a1 = queue.enqueue(spool(tmp_path, "a1.txt"), "alice")
+    b1 = queue.enqueue(spool(tmp_path, "b1.txt"), "bob")
+    a2 = queue.enqueue(spool(tmp_path, "a2.txt"), "alice")
+
+    assert [job["id"] for job in queue._claim()] == [a1, a2]
+    assert queue.get(a1)["status"] == "running"
+    assert [job["id"] for job in queue._claim()] == [b1]
+    assert queue._claim() == []
+
+
+def test_user_with_a_running_job_is_not_claimed_again(tmp_path, queue):
+    queue.enqueue(spool(tmp_path, "a1.txt"), "alice")
+    queue._claim()
+    queue.enqueue(spool(tmp_path, "a2.txt"), "alice")
+    assert queue._claim() == []
+
+
+def test_running_jobs_of_dead_processes_are_requeued_on_restart(tmp_path, queue):
+    orphan = queue.enqueue(spool(tmp_path, "a1.txt"), "alice")
+    queue._claim()
+    live = queue.enqueue(spool(tmp_path, "b1.txt"), "bob")
+    queue._claim()
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    queue._execute("UPDATE ingest_jobs SET pid = ? WHERE id = ?", (dead.pid, orphan))
+
+    restarted = IngestJobQueue(db_path=queue.db_path, spool_dir=queue.spool_dir, workers=1)
+    assert restarted.get(orphan)["status"] == "pending"
+    # Held by a live process (another server worker): not run a second time
+    assert restarted.get(live)["status"] == "running"
+    assert [job["id"] for job in restarted._claim()] == [orphan]
+
+
+def test_worker_indexes_uploads_and_skips_identical_reuploads(tmp_path, queue, rag, monkeypatch):
+    monkeypatch.setattr(ingest_jobs_module, "rag_service", rag)
+
+    async def run(upload):
+        job_id = queue.enqueue(upload, "alice")
+        while queue.get(job_id)["status"] not in ("done", "failed"):
+            await asyncio.sleep(0.05)
+        return queue.get(job_id)
+
+    async def scenario():
+        queue.start()
+        try:
+            first = await run(spool(tmp_path, "notes.txt", "议程设置理论。框架理论。"))
+            again = await run(spool(tmp_path, "notes.txt", "议程设置理论。框架理论。"))
+        finally:
+            await queue.stop()
+        return first, again
+
+    first, again = asyncio.run(scenario())
+    assert first["status"] == "done" and first["chunks"] > 0 and not first["skipped"]
+    assert again["status"] == "done" and again["skipped"] and again["chunks"] == first["chunks"]
+    assert rag.catalog.get("alice", "notes.txt")["chunks"] == first["chunks"]
@@ -0,0 +1,82 @@
+from services.chunker import count_tokens
+from services.prompt_packer import PromptPacker
+
+
+def results(*docs, sources=None):
+    ids = [f"system/doc/{i}" for i in range(len(docs))]
+    metas = [{"source": (sources or ["a.xlsx"] * len(docs))[i]} for i in range(len(docs))]
+    return {"ids": [ids], "documents": [list(docs)], "metadatas": [metas], "distances": [[0.0] * len(docs)]}
+
+
+def sentences(n: int, topic: str) -> str:
+    return "".join(f"{topic}的第{i}个观点涉及媒介和受众之间的关系。" for i in range(n))
+
+
+def packer(**kwargs) -> PromptPacker:
+    return PromptPacker(tokenizer="", **kwargs) # chunker estimate, no download
+
+
+def test_context_stays_within_budget_and_truncates_the_last_chunk():
+    p = packer(context_budget=300)
+    context, ids, _ = p.pack_context(results(sentences(10, "议程设置"), sentences(10, "框架理论"), sentences(10, "培养理论")))
+    assert count_tokens(context) <= 300
+    assert len(ids) == 2 # the second chunk is cut to fit, the third is dropped
+
+
+def test_small_remainder_is_not_worth_a_fragment():
+    first = sentences(10, "议程设置")
+    p = packer(context_budget=p_budget(first) + 30)
+    _, ids, _ = p.pack_context(results(first, sentences(10, "框架理论")))
+    assert ids == ["system/doc/0"]
+
+
+def p_budget(doc: str) -> int:
+    return count_tokens(f"Source (a.xlsx):\n{doc}")
+
+
+def test_overlapping_sentences_and_duplicates_are_removed():
+    shared = "议程设置理论由麦库姆斯和肖提出。"
+    first = shared + "媒体决定公众想什么。"
+    second = shared + "框架理论关注如何想。"
+    context, ids, _ = packer().pack_context(results(first, second, first))
+    assert context.count(shared) == 1
+    assert ids == ["system/doc/0", "system/doc/1"]
+
+
+def test_stable_order_is_independent_of_rank():
+    docs = [sentences(2, "议程设置"), sentences(2, "框架理论")]
+    a, _, _ = packer().pack_context(results(*docs, sources=["b.xlsx", "a.xlsx"]))
+    b, _, sources = packer().pack_context({k: [list(reversed(v[0]))] for k, v in results(*docs, sources=["b.xlsx", "a.xlsx"]).items()})
+    assert sorted(a.split("\n\n")) == sorted(b.split("\n\n"))
+    assert a.index("a.xlsx") < a.index("b.xlsx")
+    assert sources == ["a.xlsx", "b.xlsx"] # rank order
+
+
+def test_history_keeps_the_newest_messages_that_fit():
+    history = [{"role": "user", "content": sentences(3, f"问题{i}")} for i in range(6)]
+    p = packer(history_budget=2 * (count_tokens(history[0]["content"]) + 4), history_messages=4)
+    assert p.trim_history(history) == history[-2:]
+
+
+def test_an_overlong_latest_message_is_truncated():
+    p = packer(history_budget=50)
+    kept = p.trim_history([{"role": "user", "content": sentences(20, "议程设置")}])
+    assert len(kept) == 1 and count_tokens(kept[0]["content"]) == 50 - 4
+
+
+def test_truncate_uses_token_offsets_of_the_real_tokenizer(tmp_path):
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+
+    tokenizer = Tokenizer(models.BPE(unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    text = "议程设置理论 agenda setting theory，由麦库姆斯提出。" * 20
+    tokenizer.train_from_iterator([text], trainers.BpeTrainer(vocab_size=200, special_tokens=["[UNK]"]))
+    path = tmp_path / "tokenizer.json"
+    tokenizer.save(str(path))
+
+    p = PromptPacker(tokenizer=str(path))
+    p.load()
+    for budget in (1, 7, 33, 10_000):
+        cut = p.truncate(text, budget)
+        assert p.count(cut) <= budget
+        assert cut == text or p.count(text[:len(cut) + 1]) > budget
@@ -0,0 +1,43 @@
+import pytest
+
+from models.schemas import QuizQuestion
+from services.question_bank import QuestionBank, parse_quiz_request, quiz_topics
+
+
+@pytest.mark.parametrize("query, topic, count, difficulty", [
+    ("请出5道简单的题，关于议程设置", "议程设置", 5, "easy"),
+    ("出3道难题，关于框架理论", "框架理论", 3, "hard"),
+    ("出几道题，难度：中等，关于培养理论", "培养理论", 1, "medium"),
+    ("请生成关于新闻和传播伦理的测验", "新闻和传播伦理", 1, None),
+])
+def test_parse_quiz_request(query, topic, count, difficulty):
+    assert parse_quiz_request(query) == (topic, count, difficulty)
+
+
+@pytest.mark.parametrize("query, topic", [
+    ("出2道关于出版业的题", "出版业"),
+    ("出2道题，关于灾难新闻", "灾难新闻"),
+    ("出2道题，关于传播学理论基础", "传播学理论基础"),
+    ("出2道题，关于新闻报道中的各方信源", "新闻报道中的各方信源"),
+    ("出2道题，关于做新闻的伦理问题", "做新闻的伦理问题"),
+    ("出2道题，关于几何级数式的信息传播", "几何级数式的信息传播"),
+])
+def test_topic_words_that_contain_instruction_characters_are_kept(query, topic):
+    assert parse_quiz_request(query) == (topic, 2, None)
+    assert quiz_topics(query) == [topic]
+
+
+def question(stem: str, difficulty: str = "medium") -> QuizQuestion:
+    return QuizQuestion(id=1, stem=stem, options=["A", "B"], answer="A", analysis="", difficulty=difficulty)
+
+
+def test_serve_nearest_topic_and_never_twice(tmp_path):
+    bank = QuestionBank(str(tmp_path / "bank.sqlite3"), min_similarity=0.5)
+    bank.add("议程设置", [1.0, 0.0], [question("q1"), question("q2", "hard")], chunk_id="c1")
+    bank.add("框架理论", [0.0, 1.0], [question("q3")], chunk_id="c2")
+
+    questions, _ = bank.serve("alice", [0.9, 0.1], 1, difficulty="hard")
+    assert [q.stem for q in questions] == ["q2"]
+    questions, _ = bank.serve("alice", [0.9, 0.1], 1)
+    assert [q.stem for q in questions] == ["q1"]
+    assert bank.serve("alice", [0.9, 0.1], 1) is None # q3 is on a far topic
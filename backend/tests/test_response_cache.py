@@ -0,0 +1,68 @@
+from services.response_cache import ResponseCache, SQLiteBackend, MemoryBackend
+
+
+def make_cache(**kwargs):
+    return ResponseCache(ttl=0, similarity=0, **kwargs)
+
+
+def test_scope_separates_roles_users_and_targets():
+    scopes = {
+        ResponseCache.make_scope("alice", "student"),
+        ResponseCache.make_scope("bob", "student"),
+        ResponseCache.make_scope("alice", "teacher"),
+        ResponseCache.make_scope(None, "internal_test", ["alice"]),
+        ResponseCache.make_scope(None, "internal_test"),
+    }
+    assert len(scopes) == 5
+
+
+def test_scope_ignores_target_order():
+    assert ResponseCache.make_scope(None, "internal_test", ["b", "a"]) == ResponseCache.make_scope(None, "internal_test", ["a", "b"])
+
+
+def test_answer_is_not_served_to_another_scope():
+    cache = make_cache()
+    context = ["system/abc/0"]
+    alice = ResponseCache.group_key(ResponseCache.make_scope("alice", "student"), "prompt", context, [])
+    bob = ResponseCache.group_key(ResponseCache.make_scope("bob", "student"), "prompt", context, [])
+    cache.put(alice, "什么是议程设置？", "answer")
+    assert cache.get(alice, "什么是议程设置") == "answer" # normalized variant hits
+    assert cache.get(bob, "什么是议程设置？") is None
+
+
+def test_group_key_covers_prompt_context_and_history():
+    scope = ResponseCache.make_scope("alice", "student")
+    base = ResponseCache.group_key(scope, "prompt", ["a"], [])
+    assert base != ResponseCache.group_key(scope, "other prompt", ["a"], [])
+    assert base != ResponseCache.group_key(scope, "prompt", ["b"], [])
+    assert base != ResponseCache.group_key(scope, "prompt", ["a"], [{"role": "user", "content": "hi"}])
+
+
+def entry(key: str, size: int) -> dict:
+    return {"key": key, "group": "g", "query": key, "embedding": None, "answer": "x" * size, "created": 0, "size": size}
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2, max_bytes=1000)
+    backend.put(entry("a", 1))
+    backend.put(entry("b", 1))
+    backend.get("a")
+    backend.put(entry("c", 1))
+    assert backend.get("b") is None and backend.get("a") and backend.get("c")
+
+
+def test_sqlite_backend_enforces_max_bytes(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_entries=100, max_bytes=250)
+    for key in ("a", "b", "c"):
+        backend.put(entry(key, 100))
+    assert len(backend) == 2
+    assert backend.get("a") is None
+    backend.put(entry("big", 240))
+    assert len(backend) == 1 and backend.get("big")
+
+
+def test_sqlite_backend_enforces_max_entries(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_entries=2, max_bytes=10 ** 6)
+    for key in ("a", "b", "c"):
+        backend.put(entry(key, 1))
+    assert len(backend) == 2 and backend.get("a") is None
@@ -0,0 +1,95 @@
+import pytest
+
+from services.question_bank import quiz_topics
+from services.rag_service import ENUMERATION_MARKS, SYSTEM_OWNER, split_topics
+
+
+@pytest.mark.parametrize("text", ["媒介融合和新闻生产的关系", "请生成关于新闻和传播伦理的测验", "framing and agenda setting"])
+def test_conjunctions_do_not_split_a_topic(text):
+    assert split_topics(text) == [text]
+    assert split_topics(text, separators=ENUMERATION_MARKS) == [text]
+
+
+def test_list_punctuation_splits_topics():
+    assert split_topics("议程设置、框架理论、使用与满足") == ["议程设置", "框架理论", "使用与满足"]
+    assert quiz_topics("出5道题，涵盖议程设置、框架理论、使用与满足") == ["议程设置", "框架理论", "使用与满足"]
+
+
+def test_rubric_clauses_are_not_topics():
+    assert split_topics("请生成评分标准，侧重导语写作", separators=ENUMERATION_MARKS) == ["请生成评分标准，侧重导语写作"]
+
+
+TOPICS = {
+    "议程设置": "议程设置理论认为媒体通过报道频率影响公众对议题重要性的判断。",
+    "框架理论": "框架理论研究媒体如何选择和强调事实的某些方面来建构意义。",
+    "培养理论": "培养理论指出长期收看电视会塑造观众对社会现实的认知。",
+}
+
+
+@pytest.fixture
+def topics_rag(rag):
+    for topic, text in TOPICS.items():
+        for n in range(3):
+            rag.add_document(f"{text} 第{n}节。", f"{topic}-{n}.txt", SYSTEM_OWNER)
+    return rag
+
+
+def test_every_topic_is_represented_without_duplicates(topics_rag):
+    results = topics_rag.retrieve_many(list(TOPICS), n_results=6, role="student")
+
+    ids = results["ids"][0]
+    assert len(ids) == 6 and len(set(ids)) == 6
+    assert results["topics"][0] == list(TOPICS) * 2
+    for topic, document in zip(results["topics"][0], results["documents"][0]):
+        assert TOPICS[topic][:4] in document
+
+
+def test_single_query_is_plain_retrieve(topics_rag):
+    results = topics_rag.retrieve_many(["议程设置", "议程设置 "], n_results=3, role="student")
+    assert results["ids"] == topics_rag.retrieve("议程设置", 3, role="student")["ids"]
+    assert results["topics"] == [["议程设置"] * 3]
+
+
+def test_topics_share_one_embedding_batch_and_one_fetch(topics_rag, monkeypatch):
+    calls = {"embed": [], "query": 0, "get": []}
+    collection = topics_rag.get_collection()
+    embed, query, get = topics_rag.ef.embed_query, collection.query, collection.get
+
+    def counting_embed(input):
+        calls["embed"].append(list(input))
+        return embed(input)
+
+    def top_dense_hit(*args, **kwargs):
+        # Keep one dense hit per topic so the rest of every topic's hits are BM25-only
+        calls["query"] += 1
+        results = query(*args, **kwargs)
+        return {key: [hits[:1] for hits in results[key]] for key in ("ids", "documents", "metadatas", "distances")}
+
+    def counting_get(*args, **kwargs):
+        calls["get"].append(kwargs["ids"])
+        return get(*args, **kwargs)
+
+    monkeypatch.setattr(topics_rag.ef, "embed_query", counting_embed)
+    monkeypatch.setattr(collection, "query", top_dense_hit)
+    monkeypatch.setattr(collection, "get", counting_get)
+
+    results = topics_rag.retrieve_many(list(TOPICS), n_results=6, role="student")
+    assert calls["embed"] == [list(TOPICS)]
+    assert calls["query"] == 1
+    assert len(calls["get"]) == 1
+    assert len(set(results["ids"][0])) == 6
+    assert all(document for document in results["documents"][0])
+
+
+def test_batched_queries_use_the_query_cache(monkeypatch):
+    from services.embedding_service import EmbeddingService
+
+    service = EmbeddingService()
+    encoded = []
+    monkeypatch.setattr(service, "_encode", lambda texts: encoded.append(list(texts)) or [[float(len(t))] for t in texts])
+    monkeypatch.setattr(service, "embed_documents", lambda texts: pytest.fail("queries went to the document path"))
+    ef = service.as_chroma_function()
+
+    assert ef.embed_query(["议程设置", "框架理论"]) == [[4.0], [4.0]]
+    assert ef.embed_query(["框架理论", "培养理论"]) == [[4.0], [4.0]]
+    assert encoded == [["议程设置", "框架理论"], ["培养理论"]]
@@ -0,0 +1,126 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from models.schemas import QuizQuestionSet
+from services.structured_output import StructuredOutput, StructuredOutputError, JsonArrayStreamer, extract_json
+
+QUESTION = {"id": 1, "type": "single_choice", "stem": "议程设置理论由谁提出？",
+            "options": ["A. 麦库姆斯和肖", "B. 拉扎斯菲尔德", "C. 李普曼", "D. 格伯纳"],
+            "answer": "A", "analysis": "1972 年教堂山研究。", "difficulty": "easy"}
+VALID = json.dumps({"questions": [QUESTION]}, ensure_ascii=False)
+
+
+def scripted(*replies):
+    """A `complete` callable returning the given replies in order and recording its calls."""
+    calls = []
+
+    async def complete(messages, agent, json_mode):
+        calls.append({"messages": messages, "json_mode": json_mode})
+        return replies[len(calls) - 1]
+    return complete, calls
+
+
+def generate(output, complete):
+    return asyncio.run(output.generate([{"role": "user", "content": "出题"}], QuizQuestionSet.model_validate, "quiz", complete=complete))
+
+
+def test_extract_json_strips_fences_and_surrounding_text():
+    assert extract_json("```json\n{\"a\": 1}\n```") == {"a": 1}
+    assert extract_json("好的，结果如下：{\"a\": 1} 希望有帮助") == {"a": 1}
+
+
+def test_valid_reply_needs_no_repair():
+    output = StructuredOutput()
+    complete, calls = scripted(VALID)
+    result, _ = generate(output, complete)
+    assert result.questions[0].answer == "A" and len(calls) == 1
+    assert output.stats()["quiz"]["ok"] == 1
+
+
+def test_invalid_reply_gets_one_repair_call_with_the_error():
+    output = StructuredOutput()
+    complete, calls = scripted('{"questions": [{"id": 1, "stem": "缺少答案"}]}', VALID)
+    result, _ = generate(output, complete)
+    assert len(result.questions) == 1 and len(calls) == 2
+    repair = calls[1]["messages"]
+    assert repair[-2]["role"] == "assistant" and "字段校验失败" in repair[-1]["content"]
+    assert calls[1]["json_mode"] is True
+    assert output.stats()["quiz"]["repaired"] == 1
+
+
+def test_failed_repair_raises():
+    output = StructuredOutput()
+    complete, _ = scripted("不是 JSON", "还是不是")
+    with pytest.raises(StructuredOutputError):
+        generate(output, complete)
+    assert output.stats()["quiz"]["failed"] == 1
+
+
+def test_streamer_emits_each_question_when_it_closes():
+    streamer = JsonArrayStreamer("questions")
+    text = "```json\n" + VALID
+    items = [item for i in range(0, len(text), 7) for item in streamer.feed(text[i:i + 7])]
+    assert items == [QUESTION]
+
+
+def bad_request(param=None, message="Invalid request"):
+    request = httpx.Request("POST", "http://llm/v1/chat/completions")
+    return openai.BadRequestError(message, response=httpx.Response(400, request=request), body={"message": message, "param": param})
+
+
+class FakeCompletions:
+    def __init__(self, error):
+        self.error = error
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if "response_format" in kwargs and self.error:
+            raise self.error
+        usage = SimpleNamespace(prompt_tokens=1, completion_tokens=1, total_tokens=2, prompt_tokens_details=None)
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content="{}"))])
+
+
+def fake_client(rag, error):
+    completions = FakeCompletions(error)
+    rag.async_openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return completions
+
+
+def test_json_mode_rejection_retries_this_call_only(rag):
+    completions = fake_client(rag, bad_request(param="response_format"))
+    assert asyncio.run(rag.acomplete([{"role": "user", "content": "hi"}], json_mode=True)) == "{}"
+    assert ["response_format" in call for call in completions.calls] == [True, False]
+    assert rag.json_mode # not switched off for later requests
+
+
+def test_other_bad_requests_are_raised(rag):
+    completions = fake_client(rag, bad_request(message="This model's maximum context length is 65536 tokens"))
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(rag.acomplete([{"role": "user", "content": "hi"}], json_mode=True))
+    assert len(completions.calls) == 1 and rag.json_mode
+
+
+def test_streaming_has_the_same_fallback(rag):
+    class StreamingCompletions(FakeCompletions):
+        async def create(self, **kwargs):
+            self.calls.append(kwargs)
+            if "response_format" in kwargs:
+                raise self.error
+
+            async def chunks():
+                yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content="{}"))])
+            return chunks()
+
+    completions = StreamingCompletions(bad_request(message="response_format json_object is not supported"))
+    rag.async_openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    async def collect():
+        return [delta async for delta in rag.astream_complete([{"role": "user", "content": "hi"}], json_mode=True)]
+    assert asyncio.run(collect()) == ["{}"]
+    assert len(completions.calls) == 2
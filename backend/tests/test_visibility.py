@@ -0,0 +1,30 @@
+from services.rag_service import SYSTEM_OWNER
+
+
+def test_student_sees_system_and_own_documents(rag):
+    assert rag.build_visibility_filter("alice", "student") == {"owner_id": {"$in": [SYSTEM_OWNER, "alice"]}}
+
+
+def test_anonymous_and_system_users_see_only_system_documents(rag):
+    assert rag.build_visibility_filter(None, "student") == {"owner_id": SYSTEM_OWNER}
+    assert rag.build_visibility_filter(SYSTEM_OWNER, "teacher") == {"owner_id": SYSTEM_OWNER}
+
+
+def test_internal_test_sees_everything_or_the_selected_users(rag):
+    assert rag.build_visibility_filter(None, "internal_test") is None
+    assert rag.build_visibility_filter(None, "internal_test", [SYSTEM_OWNER, "bob"]) == {"owner_id": {"$in": [SYSTEM_OWNER, "bob"]}}
+
+
+def sources(results):
+    return {meta["owner_id"] for meta in results["metadatas"][0]}
+
+
+def test_retrieve_never_returns_other_users_chunks(rag):
+    rag.add_document("议程设置理论认为媒体影响公众议题。", "system.txt", SYSTEM_OWNER)
+    rag.add_document("议程设置理论的课堂笔记，alice 的私有材料。", "alice.txt", "alice")
+    rag.add_document("议程设置理论的作业草稿，bob 的私有材料。", "bob.txt", "bob")
+
+    assert sources(rag.retrieve("议程设置理论", 10, user_id="alice", role="student")) == {SYSTEM_OWNER, "alice"}
+    assert sources(rag.retrieve("议程设置理论", 10, role="student")) == {SYSTEM_OWNER}
+    assert sources(rag.retrieve("议程设置理论", 10, role="internal_test")) == {SYSTEM_OWNER, "alice", "bob"}
+    assert sources(rag.retrieve("议程设置理论", 10, role="internal_test", target_user_ids=["bob"])) == {SYSTEM_OWNER, "bob"}
@@ -1,8 +1,19 @@
 #!/bin/bash
+# Usage:
+#   ./start.sh                 production: no --reload, $WORKERS uvicorn workers (default 1)
+#   APP_ENV=dev ./start.sh     development: single worker with --reload
+#
+# With WORKERS > 1 the workers share one Chroma server and one embedding
+# sidecar (embedding_server.py), so the model and the vector index are
+# loaded once instead of once per worker. Grading jobs (grading_jobs.sqlite3)
+# and the BM25 index (chroma_db/lexical_index.sqlite3) are shared through SQLite.
 
 # Navigate to backend directory
 cd backend
 
+PORT=${PORT:-8000}
+WORKERS=${WORKERS:-1}
+
 # Check if chroma_db exists
 if [ ! -d "chroma_db" ]; then
     echo "Vector database not found. Starting ingestion..."
@@ -11,7 +22,38 @@ else
     echo "Vector database found. Skipping ingestion."
 fi
 
+wait_for() {
+    # wait_for <name> <url>: poll until the URL answers (max ~5 minutes)
+    for _ in $(seq 1 300); do
+        if python -c "import sys, urllib.request; urllib.request.urlopen(sys.argv[1], timeout=2)" "$2" 2>/dev/null; then
+            echo "$1 is up."
+            return 0
+        fi
+        sleep 1
+    done
+    echo "$1 did not come up at $2" >&2
+    exit 1
+}
+
 # Start the application
-echo "Starting FastAPI server..."
-# Use --reload for development, remove for production
-uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+if [ "$APP_ENV" = "dev" ]; then
+    echo "Starting FastAPI server (development, --reload)..."
+    exec uvicorn main:app --host 0.0.0.0 --port "$PORT" --reload
+fi
+
+if [ "$WORKERS" -gt 1 ]; then
+    export CHROMA_SERVER_HOST=${CHROMA_SERVER_HOST:-127.0.0.1}
+    export CHROMA_SERVER_PORT=${CHROMA_SERVER_PORT:-8001}
+    EMBEDDING_SERVER_PORT=${EMBEDDING_SERVER_PORT:-8002}
+    export EMBEDDING_SERVER_URL=${EMBEDDING_SERVER_URL:-http://127.0.0.1:$EMBEDDING_SERVER_PORT}
+
+    echo "Starting Chroma server and embedding sidecar..."
+    chroma run --path ./chroma_db --host 127.0.0.1 --port "$CHROMA_SERVER_PORT" &
+    python embedding_server.py --port "$EMBEDDING_SERVER_PORT" &
+    trap 'kill $(jobs -p) 2>/dev/null' EXIT
+    wait_for "Chroma" "http://127.0.0.1:$CHROMA_SERVER_PORT/api/v2/heartbeat"
+    wait_for "Embedding sidecar" "$EMBEDDING_SERVER_URL/health"
+fi
+
+echo "Starting FastAPI server ($WORKERS workers)..."
+uvicorn main:app --host 0.0.0.0 --port "$PORT" --workers "$WORKERS" --timeout-graceful-shutdown 30